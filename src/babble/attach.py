@@ -0,0 +1,129 @@
+"""
+Viewer of a session broadcast with `babble serve`.
+
+The frames are decoded from the stream and drawn by the usual renderer: the
+themes are only evaluated by the server.
+"""
+import collections.abc
+import dataclasses
+import typing
+
+import coquille.sequences
+from babble.replay import show_changes
+from babble.replay import show_full_frame
+from babble.tuilib.broadcast import FrameReceiver
+from babble.tuilib.context import Context
+from babble.tuilib.context import ContextSignal
+from babble.tuilib.util import keyhints_repr
+from babble.tuilib.window import Window
+
+
+MAX_WAIT = 0.01
+"""Longest wait for a frame while watching, in seconds"""
+
+
+class AttachSettings(typing.TypedDict):
+    """
+    Settings of the attach context.
+    """
+
+    receiver: FrameReceiver
+
+
+@dataclasses.dataclass(slots=True)
+class AttachContext(Context[AttachSettings]):
+    """
+    Shows the frames broadcast by a server as they come.
+    """
+
+    window: Window
+    settings: AttachSettings
+    global_keyhints: dict[str, str]
+
+    receiver: FrameReceiver = dataclasses.field(init=False)
+    is_connected: bool = dataclasses.field(init=False, default=True)
+    shown_size: tuple[int, int] = dataclasses.field(init=False, default=(0, 0))
+    """Size of the window when the frame was last shown in full"""
+
+    def __post_init__(self) -> None:
+        self.receiver = self.settings["receiver"]
+        self.update_keyhints()
+
+    def update_keyhints(self, message: str | None = None) -> None:
+        """
+        Build the status message showing `message` or the number of frames
+        received, and the key hints.
+        """
+
+        if message is None:
+            message = f"\x1b[1mframe {self.receiver.frame_count}\x1b[22m"
+
+        keyhints = {"q": "quit"}
+
+        if self.is_connected:
+            keyhints = {"space": "watch"} | keyhints
+
+        self.status_message = " \x1b[2m│\x1b[22m ".join(
+            (message, keyhints_repr(**keyhints, **self.global_keyhints)),
+        )
+        self.default_status_message = self.status_message
+
+    def receive_key(self, key: str) -> collections.abc.Iterator[ContextSignal]:
+        match key:
+            case "space" if self.is_connected:
+                yield from self.watch()
+            case "q":
+                yield ContextSignal.ABORT
+            case _:
+                pass
+
+        yield ContextSignal.LISTEN
+
+    def watch(self) -> collections.abc.Iterator[ContextSignal]:
+        """
+        Show the frames as they are received, until the server is gone.
+        """
+
+        message = None
+        self.status_message = (
+            f"\x1b[35mWatching {self.receiver.path}\x1b[39m"
+            " \x1b[2m(Ctrl+C to pause)\x1b[22m"
+        )
+
+        try:
+            while True:
+                try:
+                    changed = self.receiver.receive(MAX_WAIT)
+                except (OSError, ValueError) as error:
+                    self.is_connected = False
+                    message = f"\x1b[31mdisconnected: {error}\x1b[39m"
+
+                    return
+
+                self.show_changes(changed)
+
+                yield ContextSignal.BLOCK
+        except KeyboardInterrupt:
+            # Interrupting might not reset the background color
+            coquille.apply(coquille.sequences.default_background_color)
+        finally:
+            self.update_keyhints(message)
+
+    def show_changes(self, changed: set[int] | None) -> None:
+        """
+        Show the pixels that changed in the window.
+        """
+
+        receiver = self.receiver
+        size = (self.window.width, self.window.height)
+
+        if changed is None or size != self.shown_size:
+            show_full_frame(
+                self.window,
+                receiver.width,
+                receiver.height,
+                receiver.pixels,
+            )
+            self.shown_size = size
+        else:
+            show_changes(self.window, receiver.width, receiver.pixels, changed)
@@ -1,21 +1,37 @@
 import collections.abc
 import dataclasses
-import random
 import typing
 
 import coquille.sequences
+from babble.noise import NoiseSource
+from babble.parallel import fill_parallel
+from babble.parallel import get_theme_name
+from babble.snapshot import save_snapshot
 from babble.themes import Theme
 from babble.tuilib.context import Context
 from babble.tuilib.context import ContextSignal
+from babble.tuilib.sorting import SortKey
 from babble.tuilib.util import keyhints_repr
-from babble.tuilib.window import Coordinates
-from babble.tuilib.window import EMPTY_PIXEL
 from babble.tuilib.window import Window
 
 
-FILLING_HINT = (
-    "\x1b[35mFilling, please wait...\x1b[39m \x1b[2m(Ctrl+C to interrupt)\x1b[22m"
-)
+def busy_hint(action: str) -> str:
+    """
+    Build the status message shown while `action` is running.
+    """
+
+    return (
+        f"\x1b[35m{action}, please wait...\x1b[39m"
+        " \x1b[2m(Ctrl+C to interrupt)\x1b[22m"
+    )
+
+
+FILLING_HINT = busy_hint("Filling")
+ERASING_HINT = busy_hint("Erasing")
+SHUFFLING_HINT = busy_hint("Shuffling")
+SORTING_HINT = busy_hint("Sorting")
+
+OperationResultT = typing.TypeVar("OperationResultT")
 
 
 class BabbleSettings(typing.TypedDict):
@@ -25,6 +41,14 @@ class BabbleSettings(typing.TypedDict):
 
     pixels_per_step: int
     theme: Theme
+    jobs: int
+    """Number of processes filling the window in parallel (1 to fill it in-process)"""
+    sort_key: SortKey
+    """Order the pixels are sorted in first"""
+    snapshot_path: str
+    """File the window is saved to"""
+    noise: NoiseSource
+    """Random streams the noise is drawn from"""
 
 
 @dataclasses.dataclass(slots=True)
@@ -37,19 +61,37 @@ class BabbleContext(Context[BabbleSettings]):
     settings: BabbleSettings
     global_keyhints: dict[str, str]
 
+    sort_key: SortKey = dataclasses.field(init=False)
+    is_sorted: bool = dataclasses.field(init=False, default=False)
+    """Whether the last action was sorting, so that sorting again changes the key"""
+
     def __post_init__(self) -> None:
+        self.sort_key = self.settings["sort_key"]
+        self.update_keyhints()
+
+    def update_keyhints(self) -> None:
+        """
+        Build the status message showing the key hints.
+        """
+
         self.status_message = keyhints_repr(
             enter="add noise",
             space="random fill",
-            s="sort",
+            s=f"sort by {self.sort_key}",
             r="shuffle",
             e="erase",
+            w="save",
             q="quit",
             **self.global_keyhints,
         )
         self.default_status_message = self.status_message
 
     def receive_key(self, key: str) -> collections.abc.Iterator[ContextSignal]:
+        was_sorted = self.is_sorted
+        self.is_sorted = False
+        # Clears the outcome of the previous action, if any
+        self.restore_status_message()
+
         match key:
             case "space":
                 if not self.is_fully_filled():
@@ -63,11 +105,36 @@ class BabbleContext(Context[BabbleSettings]):
             case "enter":
                 self.add_random_noise()
             case "e":
-                self.window.reset()
+                yield from self.run_operation(
+                    ERASING_HINT,
+                    self.window.iter_reset(self.settings["pixels_per_step"]),
+                )
             case "r":
-                random.shuffle(self.window.pixels)
+                yield from self.run_operation(
+                    SHUFFLING_HINT,
+                    self.window.iter_shuffle(
+                        self.settings["pixels_per_step"],
+                        self.settings["noise"].coordinates,
+                    ),
+                )
             case "s":
-                self.window.pixels.sort()
+                if was_sorted:
+                    # Pressing `s` again cycles through the sort keys
+                    self.sort_key = next_sort_key(self.sort_key)
+                    self.update_keyhints()
+
+                is_sorted = yield from self.run_operation(
+                    SORTING_HINT,
+                    self.window.iter_sort(
+                        self.sort_key,
+                        self.settings["pixels_per_step"],
+                    ),
+                )
+                # Unless the sort ran to completion, pressing `s` again resumes
+                # it with the same key
+                self.is_sorted = is_sorted is True
+            case "w":
+                self.save()
             case "q":
                 yield ContextSignal.ABORT
             case _:
@@ -75,12 +142,58 @@ class BabbleContext(Context[BabbleSettings]):
 
         yield ContextSignal.LISTEN
 
+    def run_operation(
+        self,
+        hint: str,
+        steps: collections.abc.Generator[None, None, OperationResultT],
+    ) -> collections.abc.Generator[ContextSignal, None, OperationResultT | None]:
+        """
+        Run the window operation `steps` a step at a time, so that it can be
+        drawn in between and interrupted.
+
+        Return what the operation returns, or `None` if it is interrupted.
+        """
+
+        self.status_message = hint
+
+        try:
+            while True:
+                try:
+                    next(steps)
+                except StopIteration as stop:
+                    return stop.value
+
+                yield ContextSignal.BLOCK
+        except KeyboardInterrupt:
+            # Interrupting might not reset the background color
+            coquille.apply(coquille.sequences.default_background_color)
+        finally:
+            # The operation cleans up even if the context is cancelled
+            steps.close()
+
+            self.restore_status_message()
+
+    def save(self) -> None:
+        """
+        Save the window to the snapshot file.
+        """
+
+        path = self.settings["snapshot_path"]
+        theme_name = get_theme_name(self.settings["theme"]) or ""
+
+        try:
+            save_snapshot(path, self.window, theme_name)
+        except OSError as error:
+            self.status_message = f"\x1b[31mCould not save: {error.strerror}\x1b[39m"
+        else:
+            self.status_message = f"\x1b[32mSaved to {path}\x1b[39m"
+
     def is_fully_filled(self) -> bool:
         """
         Return `True` if the window has no empty pixel else `False`.
         """
 
-        return EMPTY_PIXEL not in self.window.pixels
+        return self.window.is_full()
 
     def add_random_noise(self) -> None:
         """
@@ -92,28 +205,53 @@ class BabbleContext(Context[BabbleSettings]):
         if nb_pixels < 0:
             raise ValueError("the number of pixels must be non-negative")
 
-        i = 0
+        noise = self.settings["noise"]
 
-        while i < nb_pixels:
-            coordinates = Coordinates.random(self.window.width, self.window.height)
-            color = self.settings["theme"].get(
-                coordinates,
-                self.window.width,
-                self.window.height,
-            )
+        # Only empty pixels are drawn, so each one of them is a new pixel
+        count = min(nb_pixels, len(self.window.free_cells))
+        slots = noise.random_slots(count, len(self.window.free_cells))
+        indices = self.window.take_free_cells(slots)
+        colors = self.settings["theme"].get_many(
+            indices,
+            self.window.width,
+            self.window.height,
+            noise.channel_generators,
+            noise.channels,
+        )
 
-            if self.window.set_pixel(coordinates, color):
-                i += 1
+        self.window.fill_cells(indices, colors)
 
     def fill_random(self) -> collections.abc.Iterator[ContextSignal]:
         """
         Fill randomly the window until it is fully crowded.
+
+        With several jobs, the window is filled by bands of rows in parallel
+        instead, provided the theme is a registered one.
         """
 
+        jobs = self.settings["jobs"]
+        theme = self.settings["theme"]
+
         try:
+            if jobs > 1 and get_theme_name(theme) is not None:
+                seed = self.settings["noise"].next_seed()
+
+                for _ in fill_parallel(self.window, theme, jobs, seed):
+                    yield ContextSignal.BLOCK
+
             while not self.is_fully_filled():
                 self.add_random_noise()
                 yield ContextSignal.BLOCK
         except KeyboardInterrupt:
             # Interrupting might not reset the background color
             coquille.apply(coquille.sequences.default_background_color)
+
+
+def next_sort_key(key: SortKey) -> SortKey:
+    """
+    Get the sort key following `key`, going back to the first one at the end.
+    """
+
+    keys: tuple[SortKey, ...] = typing.get_args(SortKey)
+
+    return keys[(keys.index(key) + 1) % len(keys)]
@@ -0,0 +1,461 @@
+"""
+Benchmarks of the hot paths of Babble, runnable without a terminal.
+
+They are used by `babble bench`, which reports how fast a full random fill is
+rendered and how long each stage takes, so that versions can be compared.
+"""
+import collections.abc
+import dataclasses
+import functools
+import importlib.metadata
+import json
+import os
+import random
+import time
+import timeit
+import typing
+
+from babble.babble import BabbleContext
+from babble.babble import BabbleSettings
+from babble.noise import NoiseSource
+from babble.snapshot import DEFAULT_SNAPSHOT_PATH
+from babble.themes import Theme
+from babble.tuilib.layout import Rect
+from babble.tuilib.layout import tiles
+from babble.tuilib.renderer import WindowRenderer
+from babble.tuilib.util import offset_write
+from babble.tuilib.window import Coordinates
+from babble.tuilib.window import PixelStorage
+from babble.tuilib.window import Window
+from babble.tuilib.writer import FrameWriter
+
+
+DEFAULT_SIZES = ((80, 24), (300, 90), (500, 150))
+ORIGIN = Coordinates(0, 0)
+
+
+@dataclasses.dataclass(slots=True)
+class CountingSink:
+    """
+    Output that discards what is written to it, only counting the bytes.
+    """
+
+    written: int = 0
+
+    def write(self, string: str) -> int:
+        self.written += len(string.encode())
+
+        return len(string)
+
+    def flush(self) -> None:
+        pass
+
+
+@dataclasses.dataclass(slots=True)
+class BenchmarkSetup:
+    """
+    Parameters shared by all the benchmarks of a run.
+    """
+
+    width: int
+    height: int
+    theme_name: str
+    theme: Theme
+    storage: PixelStorage
+    pixels_per_step: int
+    jobs: int = 1
+
+    def new_context(self) -> BabbleContext:
+        """
+        Create a context with an empty window and a renderer showing it.
+        """
+
+        window = Window.empty(self.width, self.height, self.storage)
+        settings: BabbleSettings = {
+            "pixels_per_step": self.pixels_per_step,
+            "theme": self.theme,
+            "jobs": self.jobs,
+            "sort_key": "rgb",
+            "snapshot_path": DEFAULT_SNAPSHOT_PATH,
+            "noise": NoiseSource(),
+        }
+
+        return BabbleContext(window, settings, {})
+
+    def new_filled_context(self) -> BabbleContext:
+        context = self.new_context()
+
+        for _ in context.fill_random():
+            pass
+
+        return context
+
+
+@dataclasses.dataclass(slots=True)
+class FillReport:
+    """
+    Measurements of a full random fill, rendered at each step.
+    """
+
+    width: int
+    height: int
+    theme: str
+    steps: int
+    fill_time: float
+    """Time spent filling the window, in seconds"""
+    render_time: float
+    """Time spent rendering and writing the frames, in seconds"""
+    bytes_written: int
+
+    @property
+    def total_time(self) -> float:
+        return self.fill_time + self.render_time
+
+    @property
+    def pixels_per_second(self) -> float:
+        return self.width * self.height / self.fill_time
+
+    @property
+    def frames_per_second(self) -> float:
+        return self.steps / self.render_time
+
+    @property
+    def bytes_per_frame(self) -> float:
+        return self.bytes_written / self.steps
+
+
+def run_fill(setup: BenchmarkSetup) -> FillReport:
+    """
+    Fill a window like `space` does, rendering every step into a null sink.
+    """
+
+    context = setup.new_context()
+    renderer = WindowRenderer()
+    renderer.register(ORIGIN, context.window)
+    sink = CountingSink()
+
+    sink.write(renderer.render(setup.width, setup.height, ORIGIN))
+    renderer.clear_damage()
+
+    steps = 0
+    fill_time = 0.0
+    render_time = 0.0
+    channel = context.fill_random()
+
+    while True:
+        start = time.perf_counter()
+
+        if next(channel, None) is None:
+            break
+
+        rendering_start = time.perf_counter()
+        sink.write(renderer.render_damage(setup.width, setup.height, ORIGIN))
+        renderer.clear_damage()
+        end = time.perf_counter()
+
+        steps += 1
+        fill_time += rendering_start - start
+        render_time += end - rendering_start
+
+    return FillReport(
+        setup.width,
+        setup.height,
+        setup.theme_name,
+        steps,
+        fill_time,
+        render_time,
+        sink.written,
+    )
+
+
+Benchmark: typing.TypeAlias = collections.abc.Callable[
+    [BenchmarkSetup],
+    collections.abc.Callable[[], object],
+]
+"""Prepares what is needed and returns the function to be timed"""
+
+BENCHMARKS: dict[str, Benchmark] = {}
+
+
+def benchmark(name: str) -> collections.abc.Callable[[Benchmark], Benchmark]:
+    """
+    Register a benchmark under the given `name`.
+    """
+
+    def decorator(function: Benchmark) -> Benchmark:
+        BENCHMARKS[name] = function
+
+        return function
+
+    return decorator
+
+
+@benchmark("window.empty")
+def bench_window_empty(setup: BenchmarkSetup) -> collections.abc.Callable[[], object]:
+    return lambda: Window.empty(setup.width, setup.height, setup.storage)
+
+
+@benchmark("window.copy")
+def bench_window_copy(setup: BenchmarkSetup) -> collections.abc.Callable[[], object]:
+    return setup.new_filled_context().window.copy
+
+
+@benchmark("window.reset")
+def bench_window_reset(setup: BenchmarkSetup) -> collections.abc.Callable[[], object]:
+    return setup.new_filled_context().window.reset
+
+
+@benchmark("window.shuffle")
+def bench_window_shuffle(setup: BenchmarkSetup) -> collections.abc.Callable[[], object]:
+    return setup.new_filled_context().window.shuffle
+
+
+@benchmark("window.sort")
+def bench_window_sort(setup: BenchmarkSetup) -> collections.abc.Callable[[], object]:
+    window = setup.new_filled_context().window
+    shuffled = list(window.pixels)
+
+    def sort() -> None:
+        # Sorting already sorted pixels would not be representative
+        window.pixels[:] = shuffled
+        window.sort()
+
+    return sort
+
+
+@benchmark("context.add_random_noise")
+def bench_add_random_noise(
+    setup: BenchmarkSetup,
+) -> collections.abc.Callable[[], object]:
+    context = setup.new_context()
+
+    def add_random_noise() -> None:
+        if context.is_fully_filled():
+            context.window.reset()
+
+        context.add_random_noise()
+
+    return add_random_noise
+
+
+@benchmark("theme.get")
+def bench_theme_get(setup: BenchmarkSetup) -> collections.abc.Callable[[], object]:
+    coordinates = Coordinates.random(setup.width, setup.height)
+
+    return lambda: setup.theme.get(coordinates, setup.width, setup.height)
+
+
+@benchmark("theme.get_many")
+def bench_theme_get_many(setup: BenchmarkSetup) -> collections.abc.Callable[[], object]:
+    size = setup.width * setup.height
+    indices = random.sample(range(size), min(size, setup.pixels_per_step))
+
+    return lambda: setup.theme.get_many(indices, setup.width, setup.height)
+
+
+@benchmark("renderer.compose")
+def bench_compose(setup: BenchmarkSetup) -> collections.abc.Callable[[], object]:
+    renderer = WindowRenderer()
+    renderer.register(ORIGIN, setup.new_filled_context().window)
+
+    return lambda: renderer.compose(setup.width, setup.height)
+
+
+@benchmark("renderer.compose_tiles")
+def bench_compose_tiles(setup: BenchmarkSetup) -> collections.abc.Callable[[], object]:
+    renderer = WindowRenderer()
+    window = setup.new_filled_context().window
+
+    # 2×2 panes covering the whole Context, to compare with a single window
+    for rect in tiles(2, 2, gap=0).arrange(Rect(0, 0, setup.width, setup.height)):
+        pane = window.copy()
+        pane.resize(rect.width, rect.height)
+        renderer.register(Coordinates(rect.x, rect.y), pane)
+
+    return lambda: renderer.compose(setup.width, setup.height)
+
+
+@benchmark("renderer.render")
+def bench_render(setup: BenchmarkSetup) -> collections.abc.Callable[[], object]:
+    renderer = WindowRenderer()
+    renderer.register(ORIGIN, setup.new_filled_context().window)
+
+    return lambda: renderer.render(setup.width, setup.height, ORIGIN)
+
+
+@benchmark("renderer.render_damage")
+def bench_render_damage(setup: BenchmarkSetup) -> collections.abc.Callable[[], object]:
+    context = setup.new_context()
+    context.add_random_noise()
+
+    renderer = WindowRenderer()
+    renderer.register(ORIGIN, context.window)
+
+    return lambda: renderer.render_damage(setup.width, setup.height, ORIGIN)
+
+
+@benchmark("util.offset_write")
+def bench_offset_write(setup: BenchmarkSetup) -> collections.abc.Callable[[], object]:
+    renderer = WindowRenderer()
+    renderer.register(ORIGIN, setup.new_filled_context().window)
+    rendering = renderer.render(setup.width, setup.height, ORIGIN)
+    sink = typing.cast(typing.TextIO, CountingSink())
+
+    return lambda: offset_write(rendering, 2, 2, sink)
+
+
+@functools.cache
+def devnull_fd() -> int:
+    """
+    Get a file descriptor writing to the null device, opened once and shared by
+    all the runs.
+    """
+
+    return os.open(os.devnull, os.O_WRONLY)
+
+
+@benchmark("writer.frame")
+def bench_frame_writer(setup: BenchmarkSetup) -> collections.abc.Callable[[], object]:
+    renderer = WindowRenderer()
+    renderer.register(ORIGIN, setup.new_filled_context().window)
+    rendering = renderer.render(setup.width, setup.height, ORIGIN)
+    writer = FrameWriter(devnull_fd())
+
+    def write_frame() -> None:
+        writer.write(rendering)
+        writer.flush()
+
+    return write_frame
+
+
+def time_benchmark(function: collections.abc.Callable[[], object]) -> float:
+    """
+    Get the best time per call of `function` over a few repetitions, in
+    seconds.
+    """
+
+    timer = timeit.Timer(function)
+    number, _ = timer.autorange()
+
+    return min(timer.repeat(repeat=3, number=number)) / number
+
+
+def run_benchmarks(
+    setup: BenchmarkSetup,
+    names: collections.abc.Iterable[str] | None = None,
+) -> dict[str, float]:
+    """
+    Run the registered benchmarks (or only those in `names`) and return their
+    time per call.
+    """
+
+    return {
+        name: time_benchmark(BENCHMARKS[name](setup))
+        for name in (BENCHMARKS if names is None else names)
+    }
+
+
+def get_version() -> str:
+    try:
+        return importlib.metadata.version("Babble")
+    except importlib.metadata.PackageNotFoundError:
+        return "unknown"
+
+
+def format_duration(seconds: float) -> str:
+    for unit, factor in (("s", 1), ("ms", 1e3), ("µs", 1e6)):
+        if seconds * factor >= 1:
+            return f"{seconds * factor:.2f} {unit}"
+
+    return f"{seconds * 1e9:.0f} ns"
+
+
+def format_fill_report(report: FillReport) -> str:
+    return (
+        f"\x1b[1mfill\x1b[22m {report.width}x{report.height} "
+        f"\x1b[95m{report.theme}\x1b[39m: "
+        f"{report.pixels_per_second:,.0f} pixels/s, "
+        f"{report.frames_per_second:,.1f} frames/s, "
+        f"{report.bytes_per_frame:,.0f} bytes/frame, "
+        f"full fill in {format_duration(report.total_time)}"
+    )
+
+
+def format_benchmark(
+    name: str,
+    seconds: float,
+    baseline: float | None,
+) -> str:
+    line = f"  {name:<28} {format_duration(seconds):>12}"
+
+    if baseline is not None:
+        ratio = baseline / seconds
+        color = 32 if ratio >= 1 else 31
+        line += f"  \x1b[{color}m{ratio:.2f}x\x1b[39m"
+
+    return line
+
+
+def main(
+    sizes: collections.abc.Sequence[tuple[int, int]],
+    themes: dict[str, Theme],
+    storage: PixelStorage,
+    pixels_per_step: int,
+    jobs: int = 1,
+    output_path: str | None = None,
+    baseline_path: str | None = None,
+) -> None:
+    """
+    Run the whole suite, print the results and optionally save them as JSON
+    to `output_path`, comparing them to those saved in `baseline_path`.
+    """
+
+    baseline: dict[str, typing.Any] = {"benchmarks": {}}
+
+    if baseline_path is not None:
+        with open(baseline_path) as file:
+            baseline = json.load(file)
+
+        print(f"Comparing to version {baseline.get('version', 'unknown')}")
+
+    results: dict[str, typing.Any] = {
+        "version": get_version(),
+        "storage": storage,
+        "pixels_per_step": pixels_per_step,
+        "jobs": jobs,
+        "fills": [],
+        "benchmarks": {},
+    }
+
+    for width, height in sizes:
+        for theme_name, theme in themes.items():
+            setup = BenchmarkSetup(
+                width,
+                height,
+                theme_name,
+                theme,
+                storage,
+                pixels_per_step,
+                jobs,
+            )
+            report = run_fill(setup)
+
+            print(format_fill_report(report))
+            results["fills"].append(
+                dataclasses.asdict(report)
+                | {
+                    "pixels_per_second": report.pixels_per_second,
+                    "frames_per_second": report.frames_per_second,
+                    "bytes_per_frame": report.bytes_per_frame,
+                },
+            )
+
+            for name, seconds in run_benchmarks(setup).items():
+                key = f"{name}@{width}x{height}/{theme_name}"
+                results["benchmarks"][key] = seconds
+
+                print(format_benchmark(name, seconds, baseline["benchmarks"].get(key)))
+
+    if output_path is not None:
+        with open(output_path, "w") as file:
+            json.dump(results, file, indent=2)
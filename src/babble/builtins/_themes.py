@@ -1,46 +1,131 @@
+# pyright: reportOptionalMemberAccess = false
+import functools
+
+from babble.themes import numpy
+from babble.themes import random_channel
 from babble.themes import Theme
-from babble.tuilib.window import RGBColor
+from babble.themes import VectorizedTheme
+from babble.user_themes import load_theme_specs
+from babble.user_themes import themes_path
+from babble.user_themes import ThemeSpec
 
 
+# The vectorized channel functions are only called if numpy is available
 class _Themes:
     BABBLE = Theme(
         lambda c, w, h: int(c.x / w * 255),
         lambda c, w, h: 0,
         lambda c, w, h: 255 - int(c.y / h * 255),
+        VectorizedTheme(
+            lambda x, y, w, h, g: (x / w * 255).astype(numpy.uint8),
+            lambda x, y, w, h, g: numpy.zeros(len(x), dtype=numpy.uint8),
+            lambda x, y, w, h, g: 255 - (y / h * 255).astype(numpy.uint8),
+        ),
+        deterministic=True,
     )
 
     PLASMA = Theme(
-        lambda c, w, h: RGBColor.random().red,
-        lambda c, w, h: RGBColor.random().green,
-        lambda c, w, h: RGBColor.random().blue,
+        lambda c, w, h, g: g.getrandbits(8),
+        lambda c, w, h, g: g.getrandbits(8),
+        lambda c, w, h, g: g.getrandbits(8),
+        VectorizedTheme.new_uniform(
+            lambda x, y, w, h, g: random_channel(g, len(x)),
+        ),
+        seeded=True,
     )
 
     RADIOACTIVE = Theme(
+        lambda c, w, h, g: int(c.x / w * 255),
+        lambda c, w, h, g: g.getrandbits(8),
+        lambda c, w, h, g: int(c.y / h * 255),
+        VectorizedTheme(
+            lambda x, y, w, h, g: (x / w * 255).astype(numpy.uint8),
+            lambda x, y, w, h, g: random_channel(g, len(x)),
+            lambda x, y, w, h, g: (y / h * 255).astype(numpy.uint8),
+        ),
+        seeded=True,
+    )
+
+    MONOCHROME = Theme.new_uniform(
         lambda c, w, h: int(c.x / w * 255),
-        lambda c, w, h: RGBColor.random().green,
-        lambda c, w, h: int(c.y / h * 255),
+        lambda x, y, w, h, g: (x / w * 255).astype(numpy.uint8),
+        deterministic=True,
     )
 
-    MONOCHROME = Theme.new_uniform(lambda c, w, h: int(c.x / w * 255))
+    _user_themes: dict[str, Theme] = {}
+    """User themes compiled so far"""
 
     @classmethod
-    def list(cls) -> dict[str, Theme]:
+    @functools.cache
+    def builtins(cls) -> dict[str, Theme]:
         return {
             key.lower(): value
             for key, value in cls.__dict__.items()
             if isinstance(value, Theme)
         }
 
+    @classmethod
+    @functools.cache
+    def user_theme_specs(cls) -> dict[str, ThemeSpec]:
+        """
+        Read the user themes file, once.
+
+        Raises a `ValueError` if it is invalid, or if one of its themes has the
+        name of a built-in one.
+        """
+
+        specs = load_theme_specs(themes_path())
+
+        for name in specs:
+            if name in cls.builtins():
+                raise ValueError(f"{name}: there is already a built-in theme named so")
+
+        return specs
+
+    @classmethod
+    @functools.cache
+    def names(cls) -> tuple[str, ...]:
+        """
+        Get the names of the built-in themes, then of the user ones, without
+        compiling the latter.
+        """
+
+        return (*cls.builtins(), *cls.user_theme_specs())
+
+    @classmethod
+    def list(cls) -> dict[str, Theme]:
+        return {name: cls.get_unchecked(name) for name in cls.names()}
+
     @classmethod
     def get(cls, name: str) -> Theme | None:
-        if name not in cls.list():
+        if name not in cls.names():
             return None
 
         return cls.get_unchecked(name)
 
     @classmethod
     def get_unchecked(cls, name: str) -> Theme:
-        return cls.list()[name]
+        if (theme := cls.builtins().get(name)) is not None:
+            return theme
+
+        # The user themes are compiled the first time they are requested
+        if (theme := cls._user_themes.get(name)) is None:
+            theme = cls.user_theme_specs()[name].compile()
+            cls._user_themes[name] = theme
+
+        return theme
+
+    @classmethod
+    def name_of(cls, theme: Theme) -> str | None:
+        """
+        Get the name under which `theme` is registered, or `None` if it is not.
+        """
+
+        for name, registered in (*cls.builtins().items(), *cls._user_themes.items()):
+            if registered is theme:
+                return name
+
+        return None
 
 
 themes = _Themes()
@@ -1,23 +1,90 @@
 # pyright: reportUnusedCallResult = false
 import argparse
+import asyncio
 import os
+import sys
 import typing
 
+from babble import bench
+from babble.attach import AttachContext
+from babble.attach import AttachSettings
 from babble.babble import BabbleContext
 from babble.babble import BabbleSettings
 from babble.builtins import themes
+from babble.export import export
+from babble.noise import NoiseSource
+from babble.replay import ReplayContext
+from babble.replay import ReplaySettings
+from babble.snapshot import DEFAULT_SNAPSHOT_PATH
+from babble.snapshot import load_snapshot
+from babble.themes import is_vectorization_available
 from babble.tuilib.app import App
+from babble.tuilib.app import DEFAULT_MAX_FPS
+from babble.tuilib.app import FrameScheduler
+from babble.tuilib.broadcast import DEFAULT_SOCKET_PATH
+from babble.tuilib.broadcast import FrameBroadcaster
+from babble.tuilib.broadcast import FrameReceiver
+from babble.tuilib.colors import ColorDepth
+from babble.tuilib.colors import detect_color_depth
+from babble.tuilib.layout import tiles
+from babble.tuilib.recording import SessionPlayer
+from babble.tuilib.recording import SessionRecorder
+from babble.tuilib.renderer import CellMode
+from babble.tuilib.renderer import WindowRenderer
+from babble.tuilib.sorting import SortKey
+from babble.tuilib.util import dimensions
 from babble.tuilib.util import emit_warning_pps_performance
+from babble.tuilib.util import fraction
+from babble.tuilib.util import positive_float
 from babble.tuilib.util import positive_int
 from babble.tuilib.util import prompt_confirmation
 from babble.tuilib.util import should_warn_pps_performance
+from babble.tuilib.util import terminal_supports_rep
+from babble.tuilib.window import PixelStorage
 
 
 class BabbleNamespace(typing.Protocol):
+    command: typing.Literal["bench", "replay", "export", "serve", "attach"] | None
     randomize_at_launch: bool
     immersive: bool
     pixels_per_step: int
-    theme: str
+    jobs: int
+    theme: list[str] | None
+    tiles: tuple[int, int]
+    sort_key: SortKey
+    storage: PixelStorage
+    cell_mode: CellMode
+    color_depth: ColorDepth | typing.Literal["auto"]
+    dither: bool
+    max_fps: int
+    asyncio: bool
+    profile_out: str | None
+    save: str
+    load: str | None
+    record: str | None
+    record_zlib: bool
+    seed: int | None
+
+    # bench
+    sizes: list[tuple[int, int]]
+    themes: list[str]
+    output: str | None
+    compare: str | None
+
+    # replay
+    recording: str
+    speed: float
+    frame: int
+
+    # export
+    image: str
+    size: tuple[int, int]
+    export_theme: str | None
+    fill: float
+    compression: int
+
+    # serve, attach
+    socket: str
 
 
 def parse_args() -> BabbleNamespace:
@@ -26,30 +93,404 @@ def parse_args() -> BabbleNamespace:
     parser.add_argument("--randomize-at-launch", "-rl", action="store_true")
     parser.add_argument("--immersive", "-i", action="store_true")
     parser.add_argument("--pixels-per-step", "-pps", type=positive_int, default=1_000)
+    parser.add_argument("--jobs", "-j", type=positive_int, default=1)
     parser.add_argument(
         "--theme",
-        choices=themes.list().keys(),
-        default="babble",
+        action="append",
+        choices=themes.names(),
+        help=(
+            "defaults to the theme of the loaded snapshot, else `babble` ; "
+            "repeat it to give each pane its own"
+        ),
+    )
+    parser.add_argument(
+        "--tiles",
+        type=dimensions,
+        default=(1, 1),
+        metavar="COLUMNSxROWS",
+        help="split the window into panes, each with its own context",
+    )
+    parser.add_argument(
+        "--sort-key",
+        choices=typing.get_args(SortKey),
+        default="rgb",
+    )
+    parser.add_argument("--asyncio", action="store_true")
+    parser.add_argument("--max-fps", type=positive_int, default=DEFAULT_MAX_FPS)
+    parser.add_argument(
+        "--storage",
+        choices=typing.get_args(PixelStorage),
+        default="packed",
+    )
+    parser.add_argument(
+        "--cell-mode",
+        choices=typing.get_args(CellMode),
+        default="full",
+    )
+    parser.add_argument(
+        "--color-depth",
+        choices=(*typing.get_args(ColorDepth), "auto"),
+        default="truecolor",
+        help="`auto` picks it from the `COLORTERM` and `TERM` variables",
+    )
+    parser.add_argument("--dither", action="store_true")
+    parser.add_argument("--profile-out", metavar="JSON_PATH")
+    parser.add_argument(
+        "--save",
+        default=DEFAULT_SNAPSHOT_PATH,
+        metavar="SNAPSHOT_PATH",
+        help="file the window is saved to when pressing `w`",
+    )
+    parser.add_argument("--load", metavar="SNAPSHOT_PATH")
+    parser.add_argument(
+        "--seed",
+        type=int,
+        help="seed of the noise, to get the same canvas again",
+    )
+    parser.add_argument(
+        "--record",
+        metavar="RECORDING_PATH",
+        help="record the frames, to be played back with `babble replay`",
+    )
+    parser.add_argument(
+        "--record-zlib",
+        action=argparse.BooleanOptionalAction,
+        default=True,
+        help="compress the recorded frames",
+    )
+
+    subparsers = parser.add_subparsers(dest="command")
+
+    bench_parser = subparsers.add_parser(
+        "bench",
+        help="measure the performance without a terminal",
+    )
+    bench_parser.add_argument(
+        "--sizes",
+        nargs="+",
+        type=dimensions,
+        default=list(bench.DEFAULT_SIZES),
+        metavar="WIDTHxHEIGHT",
+    )
+    bench_parser.add_argument(
+        "--themes",
+        nargs="+",
+        choices=themes.names(),
+        default=list(themes.names()),
+    )
+    bench_parser.add_argument("--output", "-o", metavar="JSON_PATH")
+    bench_parser.add_argument("--compare", metavar="JSON_PATH")
+
+    replay_parser = subparsers.add_parser(
+        "replay",
+        help="play back a session recorded with `--record`",
+    )
+    replay_parser.add_argument("recording", metavar="RECORDING_PATH")
+    replay_parser.add_argument("--speed", type=positive_float, default=1.0)
+    replay_parser.add_argument("--frame", type=int, default=0, help="first frame shown")
+
+    export_parser = subparsers.add_parser(
+        "export",
+        help="generate a canvas of any size into a PNG or PPM image",
+    )
+    export_parser.add_argument("image", metavar="IMAGE_PATH")
+    export_parser.add_argument(
+        "--size",
+        type=dimensions,
+        required=True,
+        metavar="WIDTHxHEIGHT",
+    )
+    export_parser.add_argument(
+        "--theme",
+        dest="export_theme",
+        choices=themes.names(),
+    )
+    export_parser.add_argument(
+        "--fill",
+        type=fraction,
+        default=1.0,
+        help="fraction of the pixels which are not empty",
+    )
+    export_parser.add_argument(
+        "--compression",
+        type=int,
+        choices=range(10),
+        default=1,
+        metavar="0-9",
+        help="zlib level of the PNG images, 0 storing them uncompressed",
+    )
+
+    serve_parser = subparsers.add_parser(
+        "serve",
+        help="run the session and broadcast it to the viewers of `babble attach`",
+    )
+    serve_parser.add_argument(
+        "--socket",
+        default=DEFAULT_SOCKET_PATH,
+        metavar="SOCKET_PATH",
+        help="Unix socket the viewers connect to",
+    )
+
+    attach_parser = subparsers.add_parser(
+        "attach",
+        help="watch a session broadcast with `babble serve`",
+    )
+    attach_parser.add_argument(
+        "--socket",
+        default=DEFAULT_SOCKET_PATH,
+        metavar="SOCKET_PATH",
+        help="Unix socket of the server",
     )
 
     return typing.cast(BabbleNamespace, parser.parse_args())
 
 
 def main() -> int:
+    try:
+        themes.names()
+    except (OSError, ValueError) as error:
+        print(f"babble: cannot load the user themes: {error}", file=sys.stderr)
+
+        return os.EX_CONFIG
+
     namespace = parse_args()
 
-    context_settings: BabbleSettings = {
-        "pixels_per_step": namespace.pixels_per_step,
-        "theme": themes.get_unchecked(namespace.theme),
-    }
+    if namespace.command == "bench":
+        bench.main(
+            namespace.sizes,
+            {name: themes.get_unchecked(name) for name in namespace.themes},
+            namespace.storage,
+            namespace.pixels_per_step,
+            namespace.jobs,
+            namespace.output,
+            namespace.compare,
+        )
+
+        return os.EX_OK
+
+    if namespace.command == "replay":
+        return replay(namespace)
+
+    if namespace.command == "export":
+        return export_image(namespace)
+
+    if namespace.command == "attach":
+        return attach(namespace)
 
-    if should_warn_pps_performance(context_settings["pixels_per_step"]):
-        emit_warning_pps_performance(context_settings["pixels_per_step"])
+    initial_window = None
+    theme_names = namespace.theme
+
+    if namespace.load is not None:
+        try:
+            initial_window, snapshot_theme_name = load_snapshot(
+                namespace.load,
+                namespace.storage,
+            )
+        except (OSError, ValueError) as error:
+            print(f"babble: cannot load {namespace.load}: {error}", file=sys.stderr)
+
+            return os.EX_DATAERR
+
+        if theme_names is None and snapshot_theme_name in themes.names():
+            theme_names = [snapshot_theme_name]
+
+    columns, rows = namespace.tiles
+    theme_names = theme_names or ["babble"]
+    seed = namespace.seed
+    panes_settings: list[BabbleSettings] = [
+        {
+            "pixels_per_step": namespace.pixels_per_step,
+            "theme": themes.get_unchecked(theme_names[index % len(theme_names)]),
+            "jobs": namespace.jobs,
+            "sort_key": namespace.sort_key,
+            "snapshot_path": namespace.save,
+            # Each pane has its own streams, derived from the seed if any
+            "noise": NoiseSource(None if seed is None else seed + index),
+        }
+        for index in range(columns * rows)
+    ]
+
+    pixels_per_step = namespace.pixels_per_step
+    vectorized = is_vectorization_available()
+
+    if should_warn_pps_performance(pixels_per_step, vectorized):
+        emit_warning_pps_performance(pixels_per_step, vectorized)
 
         if not prompt_confirmation():
             return os.EX_DATAERR
 
-    with App("Babble", BabbleContext, immersive=namespace.immersive) as app:
-        app.run(context_settings)
+    broadcaster = None
+
+    if namespace.command == "serve":
+        try:
+            broadcaster = FrameBroadcaster.open(namespace.socket)
+        except OSError as error:
+            print(
+                f"babble: cannot serve on {namespace.socket}: {error}",
+                file=sys.stderr,
+            )
+
+            return os.EX_UNAVAILABLE
+
+    recorder = None
+
+    if namespace.record is not None:
+        try:
+            recorder = SessionRecorder.open(namespace.record, namespace.record_zlib)
+        except OSError as error:
+            print(f"babble: cannot record {namespace.record}: {error}", file=sys.stderr)
+
+            if broadcaster is not None:
+                broadcaster.close()
+
+            return os.EX_CANTCREAT
+
+    try:
+        with App(
+            "Babble",
+            BabbleContext,
+            new_renderer(namespace),
+            FrameScheduler(namespace.max_fps),
+            immersive=namespace.immersive,
+            storage=namespace.storage,
+            initial_window=initial_window,
+            recorder=recorder,
+            broadcaster=broadcaster,
+            layout=tiles(columns, rows),
+        ) as app:
+            if namespace.asyncio:
+                asyncio.run(app.run_async(*panes_settings))
+            else:
+                app.run(*panes_settings)
+    finally:
+        if recorder is not None:
+            recorder.close()
+
+        if broadcaster is not None:
+            broadcaster.close()
+
+    if namespace.profile_out is not None:
+        app.profiler.dump(namespace.profile_out)
 
     return os.EX_OK
+
+
+def replay(namespace: BabbleNamespace) -> int:
+    """
+    Play back a recorded session.
+    """
+
+    try:
+        player = SessionPlayer.open(namespace.recording)
+    except (OSError, ValueError) as error:
+        print(f"babble: cannot replay {namespace.recording}: {error}", file=sys.stderr)
+
+        return os.EX_DATAERR
+
+    settings: ReplaySettings = {
+        "player": player,
+        "speed": namespace.speed,
+        "start_frame": namespace.frame,
+    }
+
+    with player, App(
+        "Babble",
+        ReplayContext,
+        new_renderer(namespace),
+        FrameScheduler(namespace.max_fps),
+        immersive=namespace.immersive,
+        storage=namespace.storage,
+    ) as app:
+        if namespace.asyncio:
+            asyncio.run(app.run_async(settings))
+        else:
+            app.run(settings)
+
+    if namespace.profile_out is not None:
+        app.profiler.dump(namespace.profile_out)
+
+    return os.EX_OK
+
+
+def attach(namespace: BabbleNamespace) -> int:
+    """
+    Watch a session broadcast by a server.
+    """
+
+    try:
+        receiver = FrameReceiver.open(namespace.socket)
+    except (OSError, ValueError) as error:
+        print(f"babble: cannot attach to {namespace.socket}: {error}", file=sys.stderr)
+
+        return os.EX_UNAVAILABLE
+
+    settings: AttachSettings = {"receiver": receiver}
+
+    with receiver, App(
+        "Babble",
+        AttachContext,
+        new_renderer(namespace),
+        FrameScheduler(namespace.max_fps),
+        immersive=namespace.immersive,
+        storage=namespace.storage,
+        # Watching starts right away
+        pending_keys=["space"],
+    ) as app:
+        if namespace.asyncio:
+            asyncio.run(app.run_async(settings))
+        else:
+            app.run(settings)
+
+    if namespace.profile_out is not None:
+        app.profiler.dump(namespace.profile_out)
+
+    return os.EX_OK
+
+
+def export_image(namespace: BabbleNamespace) -> int:
+    """
+    Generate a canvas into an image file, and report how fast it went.
+    """
+
+    theme_name = namespace.export_theme or (namespace.theme or ["babble"])[0]
+    width, height = namespace.size
+
+    try:
+        report = export(
+            namespace.image,
+            themes.get_unchecked(theme_name),
+            width,
+            height,
+            namespace.fill,
+            namespace.compression,
+            namespace.seed,
+        )
+    except (OSError, ValueError) as error:
+        print(f"babble: cannot export {namespace.image}: {error}", file=sys.stderr)
+
+        return os.EX_DATAERR
+
+    print(
+        f"{namespace.image}: {width}×{height} ({report.nb_pixels / 1e6:.1f} MP) "
+        f"in {report.seconds:.2f} s, {report.megapixels_per_second:.2f} MP/s",
+    )
+
+    return os.EX_OK
+
+
+def new_renderer(namespace: BabbleNamespace) -> WindowRenderer:
+    """
+    Create the renderer configured by the command line.
+    """
+
+    if namespace.color_depth == "auto":
+        color_depth = detect_color_depth()
+    else:
+        color_depth = namespace.color_depth
+
+    return WindowRenderer(
+        use_rep=terminal_supports_rep(),
+        cell_mode=namespace.cell_mode,
+        color_depth=color_depth,
+        dither=namespace.dither,
+    )
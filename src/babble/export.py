@@ -0,0 +1,233 @@
+# pyright: reportMissingImports = false
+"""
+Headless export of canvases of any size to image files.
+
+The canvas is generated by bands of rows which are written to the file as soon
+as they are ready, so that the memory used depends on the size of a band and
+not on the size of the image. The empty pixels are black.
+"""
+import array
+import dataclasses
+import os
+import random
+import struct
+import time
+import typing
+import zlib
+
+from babble.parallel import BAND_SIZE
+from babble.parallel import band_seed
+from babble.themes import numpy
+from babble.themes import Theme
+
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+
+class ImageWriter(typing.Protocol):
+    """
+    Streams the rows of an image to a file, from top to bottom.
+    """
+
+    def write_rows(self, rgb: bytes) -> None:
+        """
+        Write the next rows, given as packed 8-bit RGB triplets.
+        """
+
+    def close(self) -> None:
+        """
+        Finish the image.
+        """
+
+
+@dataclasses.dataclass(slots=True)
+class PPMWriter:
+    """
+    Writer of binary PPM images (P6), which are raw RGB after a short header.
+    """
+
+    file: typing.BinaryIO
+    width: int
+    height: int
+
+    def __post_init__(self) -> None:
+        self.file.write(f"P6\n{self.width} {self.height}\n255\n".encode())
+
+    def write_rows(self, rgb: bytes) -> None:
+        self.file.write(rgb)
+
+    def close(self) -> None:
+        self.file.close()
+
+
+@dataclasses.dataclass(slots=True)
+class PNGWriter:
+    """
+    Writer of 8-bit RGB PNG images.
+
+    The rows are compressed as they come and written as a sequence of `IDAT`
+    chunks. A `compression` of 0 stores them uncompressed.
+    """
+
+    file: typing.BinaryIO
+    width: int
+    height: int
+    compression: int = 1
+
+    compressor: typing.Any = dataclasses.field(init=False)
+    """zlib stream shared by all the `IDAT` chunks"""
+
+    def __post_init__(self) -> None:
+        self.compressor = zlib.compressobj(self.compression)
+        self.file.write(PNG_SIGNATURE)
+        # Bit depth of 8, truecolor, and the only compression, filtering and
+        # interlacing methods (the latter being none)
+        header = struct.pack(">IIBBBBB", self.width, self.height, 8, 2, 0, 0, 0)
+        self.write_chunk(b"IHDR", header)
+
+    def write_chunk(self, kind: bytes, data: bytes) -> None:
+        self.file.write(struct.pack(">I", len(data)))
+        self.file.write(kind)
+        self.file.write(data)
+        self.file.write(struct.pack(">I", zlib.crc32(data, zlib.crc32(kind))))
+
+    def write_rows(self, rgb: bytes) -> None:
+        stride = 3 * self.width
+        scanlines = bytearray()
+
+        # Each row starts with its filter type, here none
+        for start in range(0, len(rgb), stride):
+            scanlines.append(0)
+            scanlines += rgb[start : start + stride]
+
+        if compressed := self.compressor.compress(scanlines):
+            self.write_chunk(b"IDAT", compressed)
+
+    def close(self) -> None:
+        self.write_chunk(b"IDAT", self.compressor.flush())
+        self.write_chunk(b"IEND", b"")
+        self.file.close()
+
+
+def open_image_writer(
+    path: str,
+    width: int,
+    height: int,
+    compression: int = 1,
+) -> ImageWriter:
+    """
+    Create the writer of the image at `path`, its format depending on the
+    extension (`.png` or `.ppm`).
+
+    Raises a `ValueError` if the extension is not one of them.
+    """
+
+    extension = os.path.splitext(path)[1].lower()
+
+    if extension not in (".png", ".ppm"):
+        raise ValueError(f"unsupported image format: {extension or path!r}")
+
+    file = open(path, "wb")
+
+    if extension == ".ppm":
+        return PPMWriter(file, width, height)
+
+    return PNGWriter(file, width, height, compression)
+
+
+def generate_band(
+    theme: Theme,
+    width: int,
+    height: int,
+    start_row: int,
+    stop_row: int,
+    fill: float,
+    seed: int,
+) -> bytes:
+    """
+    Generate the rows from `start_row` to `stop_row` of a canvas in which a
+    `fill` fraction of the pixels, picked at random, are not empty.
+
+    Return them as packed 8-bit RGB triplets.
+    """
+
+    start = start_row * width
+    stop = stop_row * width
+
+    if numpy is None:
+        generator = random.Random(seed)
+        indices = [index for index in range(start, stop) if generator.random() < fill]
+        colors = theme.evaluate(indices, width, height, scalar_generator=generator)
+        band = array.array("I", [0]) * (stop - start)
+
+        for index, color in zip(indices, colors):
+            band[index - start] = color
+
+        return bytes(
+            channel
+            for color in band
+            for channel in ((color >> 16) & 0xFF, (color >> 8) & 0xFF, color & 0xFF)
+        )
+
+    generator = numpy.random.default_rng(seed)
+    band = numpy.zeros(stop - start, dtype=numpy.uint32)
+    indices = numpy.flatnonzero(generator.random(stop - start) < fill)
+    band[indices] = theme.evaluate(indices + start, width, height, generator)
+
+    # The bytes of a little-endian `0x00RRGGBB` are B, G, R and 0
+    channels = band.astype("<u4").view(numpy.uint8).reshape(-1, 4)
+
+    return channels[:, 2::-1].tobytes()
+
+
+@dataclasses.dataclass(slots=True, frozen=True)
+class ExportReport:
+    nb_pixels: int
+    seconds: float
+
+    @property
+    def megapixels_per_second(self) -> float:
+        return self.nb_pixels / self.seconds / 1e6 if self.seconds else 0.0
+
+
+def export(
+    path: str,
+    theme: Theme,
+    width: int,
+    height: int,
+    fill: float = 1.0,
+    compression: int = 1,
+    seed: int | None = None,
+) -> ExportReport:
+    """
+    Generate a `width` × `height` canvas and write it to the image at `path`,
+    a band at a time.
+
+    The image is the same for a given `seed`.
+    """
+
+    if seed is None:
+        seed = random.getrandbits(64)
+
+    start_time = time.perf_counter()
+    writer = open_image_writer(path, width, height, compression)
+    band_rows = max(1, BAND_SIZE // width)
+
+    try:
+        for band, start_row in enumerate(range(0, height, band_rows)):
+            stop_row = min(height, start_row + band_rows)
+            writer.write_rows(
+                generate_band(
+                    theme,
+                    width,
+                    height,
+                    start_row,
+                    stop_row,
+                    fill,
+                    band_seed(seed, band),
+                ),
+            )
+    finally:
+        writer.close()
+
+    return ExportReport(width * height, time.perf_counter() - start_time)
@@ -0,0 +1,111 @@
+# pyright: reportMissingImports = false
+"""
+Seedable random streams of the noise.
+
+The pixels to fill and their colors are drawn from separate streams, in which
+each value only depends on the number of values drawn before it and not on how
+the draws are grouped. For a given seed, the canvas is then the same whatever
+the number of pixels per step.
+"""
+from __future__ import annotations
+
+import array
+import collections.abc
+import dataclasses
+import random
+import typing
+
+from babble.themes import ChannelGenerators
+from babble.themes import numpy
+
+
+BLOCK_SIZE = 1 << 12
+"""Number of 64-bit words drawn at once when numpy is not available"""
+
+
+@dataclasses.dataclass(slots=True)
+class NoiseSource:
+    """
+    Random streams used to add noise to a window.
+
+    With numpy, the streams are `Generator`s and the values are drawn in bulk.
+    Without it, the coordinates stream hands out words drawn by blocks with
+    `getrandbits()`, and the scalar themes draw from the `channels` stream.
+    """
+
+    seed: int | None = None
+    """Seed of all the streams, picked at random if `None`"""
+
+    coordinates: random.Random = dataclasses.field(init=False)
+    """Coordinates stream, which also shuffles the window"""
+    channels: random.Random = dataclasses.field(init=False)
+    """Channel stream of the scalar themes"""
+    words: array.array[int] = dataclasses.field(
+        init=False,
+        default_factory=lambda: array.array("Q"),
+    )
+    """Words of the coordinates stream left to be used, in reverse order"""
+    generator: typing.Any = dataclasses.field(init=False, default=None)
+    """Vectorized coordinates stream, if numpy is available"""
+    channel_generators: ChannelGenerators | None = dataclasses.field(
+        init=False,
+        default=None,
+    )
+    """Vectorized channel streams, one per channel, if numpy is available"""
+
+    def __post_init__(self) -> None:
+        if self.seed is None:
+            self.seed = random.getrandbits(64)
+
+        self.coordinates = random.Random(f"{self.seed}:coordinates")
+        self.channels = random.Random(f"{self.seed}:channels")
+
+        if numpy is not None:
+            sequence = numpy.random.SeedSequence(self.seed % (1 << 64))
+            coordinates, red, green, blue = (
+                numpy.random.default_rng(child) for child in sequence.spawn(4)
+            )
+            self.generator = coordinates
+            self.channel_generators = (red, green, blue)
+
+    def random_slots(self, count: int, size: int) -> collections.abc.Sequence[int]:
+        """
+        Draw `count` slots to take one after the other from `size` free cells,
+        the i-th one being between 0 (inclusive) and `size - i` (exclusive).
+        """
+
+        if self.generator is not None:
+            # One draw per slot, so that the stream does not depend on `count`
+            bounds = numpy.arange(size, size - count, -1)
+
+            return (self.generator.random(count) * bounds).astype(numpy.intp).tolist()
+
+        slots: list[int] = []
+        words = self.words
+
+        for bound in range(size, size - count, -1):
+            if not words:
+                self.refill_words()
+
+            # Multiplying then shifting maps the word to the range fairly
+            # enough, and much faster than `randrange()`
+            slots.append((words.pop() * bound) >> 64)
+
+        return slots
+
+    def refill_words(self) -> None:
+        data = self.coordinates.getrandbits(64 * BLOCK_SIZE).to_bytes(
+            8 * BLOCK_SIZE,
+            "little",
+        )
+        self.words.frombytes(data)
+
+    def next_seed(self) -> int:
+        """
+        Draw the seed of a derived stream from the coordinates stream.
+        """
+
+        if self.generator is not None:
+            return int(self.generator.integers(0, 1 << 63))
+
+        return self.coordinates.getrandbits(64)
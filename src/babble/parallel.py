@@ -0,0 +1,235 @@
+# pyright: reportMissingImports = false
+"""
+Parallel fill of large windows.
+
+The window is split into bands of rows which are filled by a pool of worker
+processes, writing the colors directly into a shared memory copy of the
+pixels. The main process only copies the finished bands back into the window.
+"""
+import array
+import collections.abc
+import concurrent.futures
+import dataclasses
+import functools
+import hashlib
+import multiprocessing
+import random
+import typing
+from multiprocessing import shared_memory
+
+from babble.builtins import themes
+from babble.themes import numpy
+from babble.themes import Theme
+from babble.tuilib.window import EMPTY_PACKED
+from babble.tuilib.window import PackedPixels
+from babble.tuilib.window import unpack
+from babble.tuilib.window import Window
+
+
+BAND_SIZE = 1 << 16
+"""
+Approximate number of pixels per band. It does not depend on the number of
+jobs so that the random streams, which are per band, do not either.
+"""
+
+
+@dataclasses.dataclass(slots=True, frozen=True)
+class BandTask:
+    """
+    Everything a worker needs to fill a band, sent to it by the main process.
+    """
+
+    memory_name: str
+    width: int
+    height: int
+    start_row: int
+    stop_row: int
+    theme_name: str
+    """The theme is given by name since its functions cannot be pickled"""
+    seed: int
+
+
+def get_theme_name(theme: Theme) -> str | None:
+    """
+    Get the name of `theme` in the theme registry, or `None` if it is not
+    registered (in which case the workers cannot use it).
+    """
+
+    return themes.name_of(theme)
+
+
+@functools.cache
+def get_executor(jobs: int) -> concurrent.futures.ProcessPoolExecutor:
+    """
+    Get the pool of `jobs` worker processes, created on first use and reused by
+    the following fills.
+
+    The workers are not forked from the app, whose other threads might hold
+    locks at that time: they are forked from a server process, or spawned if
+    the platform has none.
+    """
+
+    methods = multiprocessing.get_all_start_methods()
+    method = "forkserver" if "forkserver" in methods else "spawn"
+
+    return concurrent.futures.ProcessPoolExecutor(
+        jobs,
+        mp_context=multiprocessing.get_context(method),
+    )
+
+
+def band_seed(seed: int, band: int) -> int:
+    """
+    Derive the seed of the random stream of a band from the seed of the fill.
+    """
+
+    digest = hashlib.blake2b(f"{seed}:{band}".encode(), digest_size=8).digest()
+
+    return int.from_bytes(digest, "little")
+
+
+def fill_band(task: BandTask) -> int:
+    """
+    Fill the empty pixels of a band in the shared memory.
+
+    Return the number of pixels filled. Runs in a worker process.
+    """
+
+    memory = shared_memory.SharedMemory(task.memory_name)
+    pixels = memory.buf.cast("I")
+
+    try:
+        start = task.start_row * task.width
+        stop = task.stop_row * task.width
+        theme = themes.get_unchecked(task.theme_name)
+        scalar_generator = random.Random(task.seed)
+
+        if numpy is None:
+            indices = [
+                index for index in range(start, stop) if pixels[index] == EMPTY_PACKED
+            ]
+            colors = theme.evaluate(
+                indices,
+                task.width,
+                task.height,
+                scalar_generator=scalar_generator,
+            )
+
+            for index, color in zip(indices, colors):
+                pixels[index] = color
+
+            return len(indices)
+
+        buffer = numpy.frombuffer(memory.buf, dtype=numpy.uint32)
+
+        try:
+            indices = numpy.flatnonzero(buffer[start:stop] == EMPTY_PACKED) + start
+            buffer[indices] = theme.evaluate(
+                indices,
+                task.width,
+                task.height,
+                numpy.random.default_rng(task.seed),
+                scalar_generator,
+            )
+        finally:
+            # The memory cannot be closed while the array still exports it
+            del buffer
+
+        return len(indices)
+    finally:
+        pixels.release()
+        memory.close()
+
+
+def fill_parallel(
+    window: Window,
+    theme: Theme,
+    jobs: int,
+    seed: int | None = None,
+) -> collections.abc.Iterator[int]:
+    """
+    Fill the empty pixels of `window` using a pool of `jobs` worker processes.
+
+    The filled pixels are the same for a given `seed` whatever the number of
+    jobs. This yields the number of pixels filled each time a band has been
+    copied back into the window, so that it can be drawn.
+
+    It stops early if the window is resized in the meantime, since the bands
+    do not fit it anymore.
+
+    Raises a `ValueError` if `theme` is not registered.
+    """
+
+    theme_name = get_theme_name(theme)
+
+    if theme_name is None:
+        raise ValueError("only registered themes can be used in parallel")
+
+    if seed is None:
+        seed = random.getrandbits(64)
+
+    pixels = window.pixels
+    shape = (window.width, window.height)
+    size = window.width * window.height
+    memory = shared_memory.SharedMemory(create=True, size=max(1, size) * 4)
+    shared = memory.buf.cast("I")
+    executor = get_executor(jobs)
+    futures: dict[concurrent.futures.Future[int], tuple[int, int]] = {}
+
+    try:
+        shared[:size] = array.array("I", window.packed())
+
+        band_rows = max(1, BAND_SIZE // max(1, window.width))
+        bounds = [*range(0, window.height, band_rows), window.height]
+        futures = {
+            executor.submit(
+                fill_band,
+                BandTask(
+                    memory.name,
+                    window.width,
+                    window.height,
+                    start_row,
+                    stop_row,
+                    theme_name,
+                    band_seed(seed, band),
+                ),
+            ): (start_row * window.width, stop_row * window.width)
+            for band, (start_row, stop_row) in enumerate(zip(bounds, bounds[1:]))
+        }
+
+        for future in concurrent.futures.as_completed(futures):
+            if window.pixels is not pixels or (window.width, window.height) != shape:
+                return
+
+            filled = future.result()
+            start, stop = futures[future]
+            copy_band(window, shared[start:stop], start)
+
+            yield filled
+    finally:
+        # The bands already being filled write to memory that is not read anymore
+        for future in futures:
+            future.cancel()
+
+        shared.release()
+        memory.close()
+        memory.unlink()
+
+        # The pixels were copied without updating the free cells
+        window.invalidate_free_cells()
+
+
+def copy_band(window: Window, band: typing.Any, start: int) -> None:
+    """
+    Copy the packed pixels of a `band` from the shared memory into the window,
+    starting at the index `start`.
+    """
+
+    stop = start + len(band)
+
+    if isinstance(window.pixels, PackedPixels):
+        window.pixels.data[start:stop] = array.array("I", band.tobytes())
+    else:
+        window.pixels[start:stop] = [unpack(value) for value in band]
+
+    window.mark_fully_damaged()
@@ -0,0 +1,208 @@
+"""
+Playback of the sessions recorded with `--record`.
+
+The frames are decoded from the recording and drawn by the usual renderer:
+the themes are never evaluated again.
+"""
+import array
+import collections.abc
+import dataclasses
+import time
+import typing
+
+import coquille.sequences
+from babble.babble import busy_hint
+from babble.tuilib.context import Context
+from babble.tuilib.context import ContextSignal
+from babble.tuilib.recording import SessionPlayer
+from babble.tuilib.util import keyhints_repr
+from babble.tuilib.window import PackedPixels
+from babble.tuilib.window import Window
+
+
+PLAYING_HINT = busy_hint("Playing")
+
+MAX_SLEEP = 0.01
+"""Longest wait between two steps while playing, in seconds"""
+
+
+class ReplaySettings(typing.TypedDict):
+    """
+    Settings of the replay context.
+    """
+
+    player: SessionPlayer
+    speed: float
+    """Playback speed, 1 being the speed the session was recorded at"""
+    start_frame: int
+
+
+@dataclasses.dataclass(slots=True)
+class ReplayContext(Context[ReplaySettings]):
+    """
+    Shows the frames of a recording, letting the user play it or move around.
+    """
+
+    window: Window
+    settings: ReplaySettings
+    global_keyhints: dict[str, str]
+
+    player: SessionPlayer = dataclasses.field(init=False)
+    speed: float = dataclasses.field(init=False)
+    shown_size: tuple[int, int] = dataclasses.field(init=False, default=(0, 0))
+    """Size of the window when the frame was last shown in full"""
+
+    def __post_init__(self) -> None:
+        self.player = self.settings["player"]
+        self.speed = self.settings["speed"]
+        self.show_frame(self.settings["start_frame"])
+
+    def update_keyhints(self) -> None:
+        """
+        Build the status message showing the position and the key hints.
+        """
+
+        position = (
+            f"\x1b[1mframe {self.player.position + 1}/{len(self.player)}\x1b[22m"
+            f" \x1b[2m│\x1b[22m ×{self.speed:g}"
+        )
+        self.status_message = " \x1b[2m│\x1b[22m ".join(
+            (
+                position,
+                keyhints_repr(
+                    space="play",
+                    left="step",
+                    right="step",
+                    up="speed",
+                    down="speed",
+                    q="quit",
+                    **{"0-9": "seek"},
+                    **self.global_keyhints,
+                ),
+            ),
+        )
+        self.default_status_message = self.status_message
+
+    def receive_key(self, key: str) -> collections.abc.Iterator[ContextSignal]:
+        match key:
+            case "space":
+                yield from self.play()
+            case "right":
+                self.show_frame(self.player.position + 1)
+            case "left":
+                self.show_frame(self.player.position - 1)
+            case "up":
+                self.speed *= 2
+                self.update_keyhints()
+            case "down":
+                self.speed /= 2
+                self.update_keyhints()
+            case "0" | "1" | "2" | "3" | "4" | "5" | "6" | "7" | "8" | "9":
+                # Jumps to a tenth of the recording
+                self.show_frame(len(self.player) * int(key) // 10)
+            case "q":
+                yield ContextSignal.ABORT
+            case _:
+                pass
+
+        yield ContextSignal.LISTEN
+
+    def play(self) -> collections.abc.Iterator[ContextSignal]:
+        """
+        Play the recording from the current frame, following its timestamps.
+        """
+
+        frames = self.player.frames
+
+        if self.player.position == len(frames) - 1:
+            self.show_frame(0)
+
+        start_time = time.perf_counter()
+        start_timestamp = frames[self.player.position].timestamp
+
+        self.status_message = PLAYING_HINT
+
+        try:
+            while self.player.position < len(frames) - 1:
+                elapsed = (time.perf_counter() - start_time) * self.speed
+                target = self.player.find_frame(start_timestamp + elapsed)
+
+                if target > self.player.position:
+                    # Skipping the frames that are already late
+                    self.show_frame(target, with_status=False)
+                else:
+                    next_timestamp = frames[self.player.position + 1].timestamp
+                    delay = (next_timestamp - start_timestamp - elapsed) / self.speed
+                    time.sleep(min(MAX_SLEEP, max(0, delay)))
+
+                yield ContextSignal.BLOCK
+        except KeyboardInterrupt:
+            # Interrupting might not reset the background color
+            coquille.apply(coquille.sequences.default_background_color)
+        finally:
+            self.update_keyhints()
+
+    def show_frame(self, index: int, with_status: bool = True) -> None:
+        """
+        Show the frame at `index` of the recording in the window.
+        """
+
+        changed = self.player.seek(index)
+        size = (self.window.width, self.window.height)
+
+        if changed is None or size != self.shown_size:
+            show_full_frame(
+                self.window,
+                self.player.width,
+                self.player.height,
+                self.player.pixels,
+            )
+            self.shown_size = size
+        else:
+            show_changes(self.window, self.player.width, self.player.pixels, changed)
+
+        if with_status:
+            self.update_keyhints()
+
+
+def show_changes(
+    window: Window,
+    width: int,
+    pixels: collections.abc.Sequence[int],
+    changed: collections.abc.Iterable[int],
+) -> None:
+    """
+    Copy the `changed` pixels of a frame of the given `width` into `window`,
+    skipping those which do not fit in it.
+    """
+
+    size = (window.width, window.height)
+
+    for pixel_index in changed:
+        y, x = divmod(pixel_index, width)
+
+        if x < size[0] and y < size[1]:
+            window.set_packed(y * size[0] + x, pixels[pixel_index])
+
+
+def show_full_frame(
+    window: Window,
+    width: int,
+    height: int,
+    pixels: collections.abc.Sequence[int],
+) -> None:
+    """
+    Copy a whole frame into `window`, which may not have the size it was
+    recorded at.
+    """
+
+    frame = Window(width, height, PackedPixels(array.array("I", pixels)))
+    frame.resize(window.width, window.height)
+
+    if window.storage == "packed":
+        window.pixels = frame.pixels
+    else:
+        window.pixels = list(frame.pixels)
+
+    window.invalidate_free_cells()
+    window.mark_fully_damaged()
@@ -0,0 +1,153 @@
+"""
+Binary snapshots of a window.
+
+A snapshot is a fixed-size header followed by the packed colors of the pixels,
+as little-endian 32-bit integers. The empty pixels have their own packed value
+(see `EMPTY_PACKED`), so that no separate bitmap is needed.
+
+Loading maps the file into memory and uses it directly as the pixel buffer, so
+that even large windows are restored instantly. The mapping is copy-on-write:
+a page is only duplicated once it changes, and is shared otherwise by all the
+processes showing the same snapshot.
+"""
+import array
+import dataclasses
+import mmap
+import os
+import struct
+import sys
+import typing
+
+from babble.tuilib.window import PackedPixels
+from babble.tuilib.window import PixelStorage
+from babble.tuilib.window import unpack
+from babble.tuilib.window import Window
+
+
+MAGIC = b"BABL"
+VERSION = 1
+
+HEADER = struct.Struct("<4sHHII32s")
+"""Magic, version, reserved, width, height and NUL-padded theme name"""
+
+DEFAULT_SNAPSHOT_PATH = "babble.snapshot"
+
+
+@dataclasses.dataclass(slots=True, frozen=True)
+class SnapshotHeader:
+    """
+    Metadata stored at the beginning of a snapshot.
+    """
+
+    width: int
+    height: int
+    theme_name: str
+    """Empty if the theme of the window is not a registered one"""
+
+    def to_bytes(self) -> bytes:
+        theme_name = self.theme_name.encode()
+
+        if len(theme_name) > 32:
+            raise ValueError(f"theme name is too long: {self.theme_name!r}")
+
+        return HEADER.pack(MAGIC, VERSION, 0, self.width, self.height, theme_name)
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> typing.Self:
+        """
+        Constructor from the first bytes of a snapshot.
+
+        Raises a `ValueError` if they are not a valid header.
+        """
+
+        if len(data) < HEADER.size:
+            raise ValueError("not a Babble snapshot: the file is too short")
+
+        magic, version, _, width, height, theme_name = HEADER.unpack_from(data)
+
+        if magic != MAGIC:
+            raise ValueError("not a Babble snapshot")
+
+        if version != VERSION:
+            raise ValueError(f"unsupported snapshot version: {version}")
+
+        return cls(width, height, theme_name.rstrip(b"\0").decode())
+
+
+def save_snapshot(path: str, window: Window, theme_name: str) -> None:
+    """
+    Save the pixels of `window` to the snapshot file at `path`.
+
+    The file is replaced atomically, so that the processes which have mapped
+    the previous version keep seeing it intact.
+    """
+
+    header = SnapshotHeader(window.width, window.height, theme_name)
+
+    if isinstance(window.pixels, PackedPixels):
+        data = window.pixels.data
+    else:
+        data = array.array("I", window.packed())
+
+    if sys.byteorder != "little":
+        data = array.array("I", data)
+        data.byteswap()
+
+    temporary_path = f"{path}.tmp"
+
+    with open(temporary_path, "wb") as file:
+        file.write(header.to_bytes())
+        file.write(data)
+
+    os.replace(temporary_path, path)
+
+
+def load_snapshot(
+    path: str,
+    storage: PixelStorage = "packed",
+) -> tuple[Window, str]:
+    """
+    Load the window saved in the snapshot file at `path`, along with the name
+    of its theme.
+
+    With the packed storage, the pixels are the mapped file itself.
+
+    Raises a `ValueError` if the file is not a valid snapshot.
+    """
+
+    with open(path, "rb") as file:
+        header = SnapshotHeader.from_bytes(file.read(HEADER.size))
+        size = header.width * header.height
+
+        if os.fstat(file.fileno()).st_size != HEADER.size + size * 4:
+            raise ValueError("the snapshot is truncated")
+
+        if storage == "list" or sys.byteorder != "little":
+            data = array.array("I")
+            data.frombytes(file.read())
+
+            if sys.byteorder != "little":
+                data.byteswap()
+
+            if storage == "list":
+                pixels = [unpack(value) for value in data]
+
+                window = Window(header.width, header.height, pixels)
+            else:
+                window = Window(header.width, header.height, PackedPixels(data))
+
+            return window, header.theme_name
+
+        memory = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_COPY)
+
+    # The view keeps the mapping alive as long as the window uses it, and it
+    # supports everything the window does with its packed pixels
+    view = memoryview(memory)[HEADER.size :].cast("I")
+
+    window = Window(
+        header.width,
+        header.height,
+        PackedPixels(typing.cast("array.array[int]", view)),
+    )
+
+    return window, header.theme_name
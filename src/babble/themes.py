@@ -1,39 +1,369 @@
+# pyright: reportMissingImports = false
+from __future__ import annotations
+
 import collections.abc
 import dataclasses
+import functools
+import random
 import typing
 
 from babble.tuilib.window import Coordinates
+from babble.tuilib.window import pack
 from babble.tuilib.window import RGBColor
 
+try:
+    import numpy
+except ImportError:  # numpy is an optional dependency
+    numpy = None
+
+if typing.TYPE_CHECKING:
+    import numpy.typing
+
+    Array: typing.TypeAlias = numpy.typing.NDArray[typing.Any]
+
 
 ChannelFunction: typing.TypeAlias = collections.abc.Callable[
     [Coordinates, int, int],
     int,
 ]
+SeededChannelFunction: typing.TypeAlias = collections.abc.Callable[
+    [Coordinates, int, int, random.Random],
+    int,
+]
+"""
+Channel function that is also given a random generator, so that its values can
+be drawn from a seeded stream.
+"""
+ScalarChannels: typing.TypeAlias = tuple[
+    ChannelFunction,
+    ChannelFunction,
+    ChannelFunction,
+]
+VectorizedChannelFunction: typing.TypeAlias = collections.abc.Callable[
+    ["Array", "Array", int, int, "numpy.random.Generator"],
+    "Array",
+]
+"""
+Channel function evaluated on whole arrays of `x` and `y` coordinates at once,
+returning an array of `uint8`. It is also given a random generator.
+"""
+ChannelGenerators: typing.TypeAlias = tuple[
+    "numpy.random.Generator",
+    "numpy.random.Generator",
+    "numpy.random.Generator",
+]
+"""Random generators of the red, green and blue channels"""
+
+
+def is_vectorization_available() -> bool:
+    """
+    Return `True` if vectorized themes can be evaluated (i.e. numpy is
+    installed), else `False`.
+    """
+
+    return numpy is not None
+
+
+@functools.cache
+def default_generator() -> numpy.random.Generator:
+    assert numpy is not None
+
+    return numpy.random.default_rng()
+
+
+@functools.cache
+def default_random() -> random.Random:
+    return random.Random()
+
+
+def random_channel(generator: numpy.random.Generator, count: int) -> Array:
+    """
+    Draw `count` random channel values.
+
+    Each value takes exactly one draw from `generator`, so that drawing them
+    in several calls gives the same values.
+    """
+
+    assert numpy is not None
+
+    return (generator.random(count) * 256).astype(numpy.uint8)
+
+
+def bind_generator(
+    function: SeededChannelFunction,
+    generator: random.Random,
+) -> ChannelFunction:
+    """
+    Adapt a seeded channel function to the scalar protocol, drawing from
+    `generator`.
+    """
+
+    return lambda coordinates, width, height: function(
+        coordinates,
+        width,
+        height,
+        generator,
+    )
+
+
+def vectorize_channel(function: ChannelFunction) -> VectorizedChannelFunction:
+    """
+    Adapt a scalar channel function to the vectorized protocol.
+    """
+
+    def vectorized(
+        x: Array,
+        y: Array,
+        width: int,
+        height: int,
+        _: numpy.random.Generator,
+    ) -> Array:
+        assert numpy is not None
+
+        return numpy.fromiter(
+            (
+                function(Coordinates(cx, cy), width, height)
+                for cx, cy in zip(x.tolist(), y.tolist())
+            ),
+            dtype=numpy.uint8,
+            count=len(x),
+        )
+
+    return vectorized
+
+
+@dataclasses.dataclass(slots=True, frozen=True)
+class VectorizedTheme:
+    red: VectorizedChannelFunction
+    green: VectorizedChannelFunction
+    blue: VectorizedChannelFunction
+
+    @classmethod
+    def new_uniform(cls, function: VectorizedChannelFunction) -> typing.Self:
+        """
+        Return a vectorized theme for which the red, green and blue channel
+        functions are identical.
+        """
+
+        return cls(function, function, function)
+
+    @classmethod
+    def from_scalar(
+        cls,
+        theme: Theme,
+        generator: random.Random | None = None,
+    ) -> typing.Self:
+        """
+        Adapt the scalar channel functions of `theme`. They draw from
+        `generator` if the theme is seeded.
+        """
+
+        red, green, blue = theme.bind_channels(generator)
+
+        return cls(
+            vectorize_channel(red),
+            vectorize_channel(green),
+            vectorize_channel(blue),
+        )
+
+    def get_many(
+        self,
+        x: Array,
+        y: Array,
+        width: int,
+        height: int,
+        generator: numpy.random.Generator | ChannelGenerators,
+    ) -> Array:
+        """
+        Get the packed colors of the pixels at the coordinates `x` and `y`.
+
+        `generator` can also be a generator per channel.
+        """
+
+        assert numpy is not None
+
+        if isinstance(generator, tuple):
+            red_generator, green_generator, blue_generator = generator
+        else:
+            red_generator = green_generator = blue_generator = generator
+
+        red = self.red(x, y, width, height, red_generator)
+        green = self.green(x, y, width, height, green_generator)
+        blue = self.blue(x, y, width, height, blue_generator)
+
+        packed = red.astype(numpy.uint32) << 16
+        packed |= green.astype(numpy.uint32) << 8
+        packed |= blue.astype(numpy.uint32)
+
+        return packed
 
 
 @dataclasses.dataclass(slots=True, frozen=True)
 class Theme:
-    red: ChannelFunction
-    green: ChannelFunction
-    blue: ChannelFunction
+    red: ChannelFunction | SeededChannelFunction
+    green: ChannelFunction | SeededChannelFunction
+    blue: ChannelFunction | SeededChannelFunction
+
+    vectorized: VectorizedTheme | None = None
+    """Optional equivalent of the theme working on arrays, used with numpy"""
+
+    deterministic: bool = False
+    """Whether the colors only depend on the coordinates and the window size"""
+
+    seeded: bool = False
+    """Whether the channel functions are `SeededChannelFunction`s"""
 
     @classmethod
-    def new_uniform(cls, function: ChannelFunction) -> typing.Self:
+    def new_uniform(
+        cls,
+        function: ChannelFunction | SeededChannelFunction,
+        vectorized: VectorizedChannelFunction | None = None,
+        deterministic: bool = False,
+        seeded: bool = False,
+    ) -> typing.Self:
         """
         Return a theme for which the red, green and blue channel functions are
         identical.
         """
 
-        return cls(function, function, function)
+        return cls(
+            function,
+            function,
+            function,
+            None if vectorized is None else VectorizedTheme.new_uniform(vectorized),
+            deterministic,
+            seeded,
+        )
+
+    def bind_channels(self, generator: random.Random | None = None) -> ScalarChannels:
+        """
+        Return the red, green and blue channel functions, with `generator` (or
+        a default one) bound to them if the theme is seeded.
+        """
+
+        if not self.seeded:
+            return typing.cast(ScalarChannels, (self.red, self.green, self.blue))
+
+        generator = generator or default_random()
+        red, green, blue = typing.cast(
+            tuple[SeededChannelFunction, SeededChannelFunction, SeededChannelFunction],
+            (self.red, self.green, self.blue),
+        )
+
+        return (
+            bind_generator(red, generator),
+            bind_generator(green, generator),
+            bind_generator(blue, generator),
+        )
 
-    def get(self, coordinates: Coordinates, width: int, height: int) -> RGBColor:
+    def get(
+        self,
+        coordinates: Coordinates,
+        width: int,
+        height: int,
+        generator: random.Random | None = None,
+    ) -> RGBColor:
         """
-        Get the color of the pixel at the provided `coordinates`.
+        Get the color of the pixel at the provided `coordinates`. A seeded
+        theme draws from `generator` if it is provided.
         """
 
+        red, green, blue = self.bind_channels(generator)
+
         return RGBColor(
-            self.red(coordinates, width, height),
-            self.green(coordinates, width, height),
-            self.blue(coordinates, width, height),
+            red(coordinates, width, height),
+            green(coordinates, width, height),
+            blue(coordinates, width, height),
+        )
+
+    def get_many(
+        self,
+        indices: collections.abc.Sequence[int],
+        width: int,
+        height: int,
+        generator: numpy.random.Generator | ChannelGenerators | None = None,
+        scalar_generator: random.Random | None = None,
+    ) -> collections.abc.Sequence[int]:
+        """
+        Get the packed colors of the pixels at the provided `indices` of a
+        window of size `width` × `height`.
+
+        If numpy is available, they are evaluated all at once, using
+        `generator` if it is provided. The channel functions of a seeded theme
+        use `scalar_generator` instead. If the theme is deterministic, they are
+        looked up in its color field instead.
+        """
+
+        if self.deterministic:
+            field = get_color_field(self, width, height)
+
+            if numpy is None:
+                return [field[index] for index in indices]
+
+            return field[numpy.asarray(indices, dtype=numpy.intp)].tolist()
+
+        colors = self.evaluate(indices, width, height, generator, scalar_generator)
+
+        return colors if numpy is None else colors.tolist()
+
+    def evaluate(
+        self,
+        indices: collections.abc.Sequence[int],
+        width: int,
+        height: int,
+        generator: numpy.random.Generator | ChannelGenerators | None = None,
+        scalar_generator: random.Random | None = None,
+    ) -> typing.Any:
+        """
+        Compute the packed colors of the pixels at the provided `indices`.
+
+        The result is a numpy array if numpy is available, else a list. The
+        vectorized themes use `generator` if it is provided, and the channel
+        functions of a seeded theme `scalar_generator`.
+        """
+
+        if numpy is None:
+            red, green, blue = self.bind_channels(scalar_generator)
+            colors: list[int] = []
+
+            for index in indices:
+                coordinates = Coordinates(index % width, index // width)
+                color = RGBColor(
+                    red(coordinates, width, height),
+                    green(coordinates, width, height),
+                    blue(coordinates, width, height),
+                )
+                colors.append(pack(color))
+
+            return colors
+
+        vectorized = self.vectorized or VectorizedTheme.from_scalar(
+            self,
+            scalar_generator,
+        )
+        y, x = numpy.divmod(numpy.asarray(indices, dtype=numpy.intp), width)
+
+        return vectorized.get_many(
+            x,
+            y,
+            width,
+            height,
+            generator or default_generator(),
         )
+
+
+COLOR_FIELD_CACHE_SIZE = 4
+"""Number of color fields cached, one per size of the panes of a grid at most"""
+
+
+@functools.lru_cache(maxsize=COLOR_FIELD_CACHE_SIZE)
+def get_color_field(theme: Theme, width: int, height: int) -> typing.Any:
+    """
+    Get the packed colors of every pixel of a window of size `width` × `height`
+    for a deterministic `theme`.
+
+    The fields of the sizes used most recently are computed once and cached.
+    They are numpy arrays if numpy is available, else lists.
+    """
+
+    return theme.evaluate(range(width * height), width, height)
@@ -0,0 +1,184 @@
+# pyright: reportMissingTypeStubs = false
+"""
+Building blocks of the asyncio mode of the application.
+"""
+import asyncio
+import codecs
+import collections
+import dataclasses
+import os
+import string
+import sys
+import termios
+import tty
+import typing
+
+
+ESCAPE = "\x1b"
+CSI = ESCAPE + "["
+SS3 = ESCAPE + "O"
+
+READ_SIZE = 1 << 10
+
+KEY_NAMES = {
+    ESCAPE: "esc",
+    "\x7f": "backspace",
+    " ": "space",
+    "\t": "tab",
+    "\r": "enter",
+    "\n": "enter",
+    "\r\n": "enter",
+    CSI + "3~": "delete",
+    CSI + "Z": "shift+tab",
+    **{
+        prefix + final: f"{modifiers}{name}"
+        for final, name in zip("ABCD", ("up", "down", "right", "left"))
+        for prefix, modifiers in (
+            (CSI, ""),
+            (CSI + "1;2", "shift+"),
+            (ESCAPE + CSI, "alt+"),
+            (CSI + "1;4", "shift+alt+"),
+            (CSI + "1;10", "shift+alt+"),
+            (CSI + "1;6", "shift+ctrl+"),
+        )
+    },
+    **{SS3 + final: f"f{number}" for number, final in enumerate("PQRS", 1)},
+    **{
+        CSI + "1;2" + final: f"shift+f{number}"
+        for number, final in enumerate("PQRS", 1)
+    },
+    **{
+        f"{CSI}{code}{modifier}~": f"{name}f{number}"
+        for number, code in enumerate((15, 17, 18, 19, 20, 21, 23, 24), 5)
+        for modifier, name in (("", ""), (";2", "shift+"))
+    },
+    **{
+        chr(index): f"^{letter}"
+        for index, letter in enumerate(string.ascii_uppercase, 1)
+        if letter not in "IJM"
+    },
+}
+"""
+Names of the keys from their sequence, the same as the ones of `outspin`
+"""
+
+
+def split_keys(data: str) -> tuple[list[str], str]:
+    """
+    Split the characters read from the terminal into the sequences of the
+    keys, which are the escape sequences and the other characters.
+
+    Return them along with the end of `data` if it is an incomplete sequence.
+    """
+
+    keys: list[str] = []
+    start = 0
+
+    while start < len(data):
+        stop = start + 1
+
+        if data.startswith("\r\n", start):
+            stop = start + 2
+        elif data.startswith(ESCAPE, start):
+            # Alt is sent as an escape before the sequence of the key
+            sequence_start = start
+
+            if data.startswith(ESCAPE + CSI, start):
+                sequence_start += 1
+
+            if data.startswith(CSI, sequence_start):
+                # Parameters and intermediate bytes, then a final byte
+                stop = sequence_start + 2
+
+                while stop < len(data) and "\x20" <= data[stop] <= "\x3f":
+                    stop += 1
+
+                if stop == len(data):
+                    return keys, data[start:]
+
+                stop += 1
+            elif data.startswith(SS3, start):
+                if start + 2 == len(data):
+                    return keys, data[start:]
+
+                stop = start + 3
+            elif start + 1 < len(data) and data[start + 1].isprintable():
+                # Alt with a character, left unnamed (and ignored) as by `outspin`
+                stop = start + 2
+
+        keys.append(data[start:stop])
+        start = stop
+
+    return keys, ""
+
+
+@dataclasses.dataclass(slots=True)
+class KeyReader:
+    """
+    Non-blocking reader of the pressed keys.
+
+    The terminal is kept in cbreak mode while the reader is active, and stdin
+    is only read by the event loop when it is readable: awaiting a key does
+    not consume any CPU.
+    """
+
+    fd: int = dataclasses.field(default_factory=sys.stdin.fileno)
+    keys: collections.deque[str] = dataclasses.field(
+        default_factory=collections.deque,
+    )
+    """Names of the keys pressed and not returned yet, in order"""
+    is_key_available: asyncio.Event = dataclasses.field(
+        default_factory=asyncio.Event,
+    )
+
+    decoder: codecs.IncrementalDecoder = dataclasses.field(
+        init=False,
+        default_factory=lambda: codecs.getincrementaldecoder("utf-8")("replace"),
+    )
+    partial: str = dataclasses.field(init=False, default="")
+    """Start of a key sequence whose end has not been read yet"""
+
+    saved_attributes: list[typing.Any] = dataclasses.field(
+        init=False,
+        default_factory=list,
+    )
+
+    def __enter__(self) -> typing.Self:
+        self.saved_attributes = termios.tcgetattr(self.fd)
+        tty.setcbreak(self.fd)
+        asyncio.get_running_loop().add_reader(self.fd, self.on_readable)
+
+        return self
+
+    def __exit__(self, *_) -> None:
+        asyncio.get_running_loop().remove_reader(self.fd)
+        termios.tcsetattr(self.fd, termios.TCSADRAIN, self.saved_attributes)
+
+    def on_readable(self) -> None:
+        data = self.partial + self.decoder.decode(os.read(self.fd, READ_SIZE))
+        sequences, self.partial = split_keys(data)
+
+        # Fast typing and pasting send several keys in a single read
+        self.keys.extend(KEY_NAMES.get(sequence, sequence) for sequence in sequences)
+
+        if self.keys:
+            self.is_key_available.set()
+
+    async def get_key(self) -> str:
+        """
+        Wait for a key to be pressed and return its name.
+        """
+
+        while not self.keys:
+            self.is_key_available.clear()
+            await self.is_key_available.wait()
+
+        return self.keys.popleft()
+
+    def unget_key(self, key: str) -> None:
+        """
+        Put back a key so it is the next one to be returned by `get_key()`.
+        """
+
+        self.keys.appendleft(key)
+        self.is_key_available.set()
@@ -1,18 +1,33 @@
 # pyright: reportMissingTypeStubs = false
+import asyncio
+import collections.abc
 import dataclasses
+import math
 import shutil
+import signal
+import time
 import typing
 
 import coquille.sequences
 import outspin
+from babble.tuilib.aio import KeyReader
+from babble.tuilib.broadcast import FrameBroadcaster
 from babble.tuilib.context import Context
+from babble.tuilib.context import ContextChannel
 from babble.tuilib.context import ContextSettingsT
 from babble.tuilib.context import ContextSignal
+from babble.tuilib.layout import Layout
+from babble.tuilib.layout import Pane
+from babble.tuilib.layout import Rect
+from babble.tuilib.profiling import FrameProfiler
+from babble.tuilib.recording import SessionRecorder
+from babble.tuilib.renderer import Layer
 from babble.tuilib.renderer import WindowRenderer
 from babble.tuilib.util import keyhints_repr
-from babble.tuilib.util import offset_write
 from babble.tuilib.window import Coordinates
+from babble.tuilib.window import PixelStorage
 from babble.tuilib.window import Window
+from babble.tuilib.writer import FrameWriter
 
 
 PIXELS_PER_STEP_DEFAULT = 1000
@@ -31,12 +46,59 @@ GLOBAL_KEYHINTS = {
     "esc": "quit",
     "shift+f5": "force refresh",
     "i": "switch immersive",
+    "p": "stats",
 }
+PANES_KEYHINTS = {"tab": "next pane"}
 FILLING_HINT = (
     "\x1b[35mFilling, please wait...\x1b[39m \x1b[2m(Ctrl+C to interrupt)\x1b[22m"
 )
 
 CONTEXT_MARGIN = 5
+CONTEXT_ORIGIN = Coordinates(2, 2)
+
+DEFAULT_MAX_FPS = 60
+
+
+@dataclasses.dataclass(slots=True)
+class FrameScheduler:
+    """
+    Paces the redraws of the application to a target frame rate, so that a
+    blocking context can run as many steps as fit into a frame.
+    """
+
+    max_fps: int = DEFAULT_MAX_FPS
+
+    last_frame_time: float = dataclasses.field(init=False, default=-math.inf)
+
+    @property
+    def frame_budget(self) -> float:
+        """
+        Duration of a frame, in seconds.
+        """
+
+        return 1 / self.max_fps
+
+    def is_frame_due(self) -> bool:
+        """
+        Return `True` if the frame budget has been spent since the last frame,
+        else `False`.
+        """
+
+        return self.time_until_next_frame() <= 0
+
+    def time_until_next_frame(self) -> float:
+        """
+        Time left before the next frame is due, in seconds (negative if late).
+        """
+
+        return self.last_frame_time + self.frame_budget - time.perf_counter()
+
+    def mark_frame(self) -> None:
+        """
+        Record that a frame has just been drawn.
+        """
+
+        self.last_frame_time = time.perf_counter()
 
 
 @dataclasses.dataclass(slots=True)
@@ -48,10 +110,54 @@ class App(typing.Generic[ContextSettingsT]):
     name: str
     context_factory: type[Context[ContextSettingsT]]
     renderer: WindowRenderer = dataclasses.field(default_factory=WindowRenderer)
+    scheduler: FrameScheduler = dataclasses.field(default_factory=FrameScheduler)
 
     immersive: bool = dataclasses.field(default=False)
+    storage: PixelStorage = dataclasses.field(default="packed")
+    profiler: FrameProfiler = dataclasses.field(default_factory=FrameProfiler)
+    writer: FrameWriter = dataclasses.field(default_factory=FrameWriter)
+    show_stats: bool = dataclasses.field(default=False)
+    initial_window: Window | None = dataclasses.field(default=None)
+    """
+    Window to start with instead of an empty one, e.g. loaded from a file.
+
+    It keeps its size and is cropped to its pane, so that its pixels are not
+    copied, and stay shared if they are a mapped snapshot.
+    """
+    recorder: SessionRecorder | None = dataclasses.field(default=None)
+    """Where the frames of the first pane are recorded, if they are"""
+    broadcaster: FrameBroadcaster | None = dataclasses.field(default=None)
+    """Where the frames of the first pane are broadcast, if they are"""
+    pending_keys: list[str] = dataclasses.field(default_factory=list)
+    """Keys handled before the pressed ones, e.g. to start a context right away"""
+    layout: Layout = dataclasses.field(default_factory=Pane)
+    """Arrangement of the panes, each running its own context in its own window"""
+
+    contexts: list[Context[ContextSettingsT]] = dataclasses.field(
+        init=False,
+        default_factory=list,
+    )
+    """Context of each pane"""
+    layers: list[Layer] = dataclasses.field(init=False, default_factory=list)
+    """Layer of the window of each pane"""
+    focus: int = dataclasses.field(init=False, default=0)
+    """Index of the pane receiving the keys"""
 
     is_requesting_exit: bool = dataclasses.field(init=False, default=False)
+    is_waiting_key: bool = dataclasses.field(init=False, default=False)
+    is_resized: bool = dataclasses.field(init=False, default=True)
+    terminal_size: tuple[int, int] = dataclasses.field(
+        init=False,
+        default_factory=shutil.get_terminal_size,
+    )
+    """Size of the terminal, only refreshed when it is resized"""
+    running_task: asyncio.Task[ContextSignal] | None = dataclasses.field(
+        init=False,
+        default=None,
+    )
+
+    def __post_init__(self) -> None:
+        self.renderer.profiler = self.profiler
 
     def __enter__(self) -> typing.Self:
         coquille.apply(coquille.sequences.enable_alternative_screen_buffer)
@@ -65,83 +171,198 @@ class App(typing.Generic[ContextSettingsT]):
         coquille.apply(coquille.sequences.disable_alternative_screen_buffer)
         coquille.apply(coquille.sequences.show_cursor)
 
+    @property
+    def focused_context(self) -> Context[ContextSettingsT]:
+        return self.contexts[self.focus]
+
     @property
     def header(self) -> str:
         """
-        The header of the application shows its title.
+        The header of the application shows its title, and the focused pane if
+        there are several.
         """
 
-        return f"\x1b[1;45m {self.name} \x1b[22;49m"
+        header = f"\x1b[1;45m {self.name} \x1b[22;49m"
+
+        if len(self.contexts) > 1:
+            header += f" \x1b[2mpane\x1b[22m {self.focus + 1}/{len(self.contexts)}"
+
+        return header
 
     def draw_header(self) -> None:
         """
         Draw the application header in the terminal.
 
-        Side-effect: write to stdout.
+        Side-effect: write to the frame.
         """
 
         if not self.immersive:
-            offset_write(self.header, x=2, y=0)
+            with self.profiler.phase("write_at"):
+                self.writer.write_at(self.header, x=2, y=0)
 
-    def draw_windows(self, width: int, height: int) -> None:
+    def draw_windows(self, width: int, height: int) -> int:
         """
-        Draw the application window in the terminal.
+        Draw the windows of the panes in the terminal.
+
+        The area containing every window is what the renderer calls the
+        `Context`.
 
-        The renderer technically allows for multiple windows -- this never
-        happens in practice. But, this is why a `Context` is mentioned: it
-        refers to the frame containing every window.
+        Return the number of pixels that have been drawn.
 
-        Side-effect: write to stdout.
+        Side-effect: write to the frame.
         """
 
         context_width = width - CONTEXT_MARGIN
         context_height = height - CONTEXT_MARGIN
-        rendering = self.renderer.render(context_width, context_height)
 
-        offset_write(rendering, x=2, y=2)
-        coquille.apply(coquille.sequences.default_background_color)
+        if self.renderer.needs_full_repaint():
+            render = self.renderer.render
+            nb_pixels = context_width * context_height * self.renderer.rows_per_cell
+        else:
+            # Only the cells that changed since the last frame are sent
+            render = self.renderer.render_damage
+            nb_pixels = sum(len(layer.window.damage) for layer in self.renderer.layers)
+
+        rendering = render(context_width, context_height, CONTEXT_ORIGIN)
+
+        with self.profiler.phase("write_at"):
+            self.writer.write(rendering)
+
+        self.renderer.clear_damage()
+
+        return nb_pixels
 
     def draw_statusbar(self, context: Context[ContextSettingsT], height: int) -> None:
         """
         Draw the application status bar in the terminal.
 
-        Side-effect: write to stdout.
+        Side-effect: write to the frame.
         """
 
         message = coquille.sequences.erase_in_line(2)
+
+        if self.show_stats:
+            message += self.profiler.summary() + " \x1b[2m│\x1b[22m "
+
         message += context.status_message
 
         if not self.immersive:
-            offset_write(message, x=2, y=height - 2)
+            with self.profiler.phase("write_at"):
+                self.writer.write_at(message, x=2, y=height - 2)
 
     def draw(self, context: Context[ContextSettingsT]) -> None:
         """
         Draw the app interface.
         """
 
-        # We refresh the terminal size at every iteration
-        width, height = shutil.get_terminal_size()
+        start = time.perf_counter()
+
+        if self.is_resized:
+            self.reflow()
+
+        width, height = self.terminal_size
+
+        # Recording and broadcasting need the damage, which is cleared once the
+        # windows are drawn
+        if self.recorder is not None:
+            with self.profiler.phase("record"):
+                self.recorder.record(self.layers[0].window)
 
-        # We draw bottom to top, this order is mandatory due to the
-        # way it is done (it prints over previous lines)
+        if self.broadcaster is not None:
+            with self.profiler.phase("broadcast"):
+                self.broadcaster.publish(self.layers[0].window)
+
+        # The whole frame is assembled before being written at once
         self.draw_statusbar(context, height)
-        self.draw_windows(width, height)
+        nb_pixels = self.draw_windows(width, height)
         self.draw_header()
 
+        with self.profiler.phase("write"):
+            nb_bytes = self.writer.flush()
+
+        self.scheduler.mark_frame()
+        self.profiler.record_frame(time.perf_counter() - start, nb_bytes, nb_pixels)
+
+    def arrange_panes(self) -> list[Rect]:
+        """
+        Get the rectangle of each pane in the current terminal size, in cells
+        relative to the Context.
+        """
+
+        width, height = self.terminal_size
+        context = Rect(
+            0,
+            0,
+            max(0, width - CONTEXT_MARGIN),
+            max(0, height - CONTEXT_MARGIN),
+        )
+
+        return self.layout.arrange(context)
+
+    def pane_clip(self, rect: Rect) -> Rect:
+        """
+        Get the part of the Context a pane occupies, in pixels.
+        """
+
+        rows_per_cell = self.renderer.rows_per_cell
+
+        return Rect(
+            rect.x,
+            rect.y * rows_per_cell,
+            rect.width,
+            rect.height * rows_per_cell,
+        )
+
+    def reflow(self) -> None:
+        """
+        Fit the windows to their pane in the current terminal size.
+        """
+
+        rows_per_cell = self.renderer.rows_per_cell
+
+        for layer, rect in zip(self.layers, self.arrange_panes()):
+            layer.position = Coordinates(rect.x, rect.y * rows_per_cell)
+
+            if layer.window is self.initial_window:
+                layer.clip = self.pane_clip(rect)
+            else:
+                layer.window.resize(rect.width, rect.height * rows_per_cell)
+
+        # The previous frame is at the wrong place, we need to start over
+        self.writer.write(coquille.sequences.erase_in_display(2))
+        self.renderer.invalidate()
+        self.is_resized = False
+
+    def handle_resize(self, context: Context[ContextSettingsT]) -> None:
+        """
+        Act on the terminal being resized (`SIGWINCH`).
+        """
+
+        self.terminal_size = shutil.get_terminal_size()
+        self.is_resized = True
+
+        # If the context is running, the next frame will take care of it
+        if self.is_waiting_key:
+            self.draw(context)
+
     def refresh(self, context: Context[ContextSettingsT]) -> None:
         """
         Refresh the app interface (clear and re-draw).
         """
 
-        coquille.apply(coquille.sequences.erase_in_display(2))
+        # Reflowing also clears the screen and invalidates the renderer
+        self.terminal_size = shutil.get_terminal_size()
+        self.is_resized = True
         self.draw(context)
 
-    def listen_key(self, context: Context[ContextSettingsT]) -> None:
+    def handle_app_key(self, context: Context[ContextSettingsT], key: str) -> bool:
         """
-        Listen for a pressed key and act accordingly.
+        Act on the keys handled by the application itself.
+
+        Return `True` if the key was one of them, else `False`.
         """
 
-        match outspin.get_key():
+        match key:
             case "esc":
                 self.is_requesting_exit = True
             case "shift+f5":
@@ -149,38 +370,115 @@ class App(typing.Generic[ContextSettingsT]):
             case "i":
                 self.immersive = not self.immersive
                 coquille.apply(coquille.sequences.erase_in_display(2))
-            case key:
-                channel = context.receive_key(key)
-
-                # We let the Context run while it is blocking
-                while (signal := next(channel)) is ContextSignal.BLOCK:
-                    # We still draw in case of updates
-                    self.draw(context)
+                self.renderer.invalidate()
+            case "p":
+                self.show_stats = not self.show_stats
+            case "tab" | "shift+tab" if len(self.contexts) > 1:
+                step = 1 if key == "tab" else -1
+                self.focus = (self.focus + step) % len(self.contexts)
+            case _:
+                return False
+
+        return True
+
+    def handle_final_signal(self, signal: ContextSignal) -> None:
+        """
+        Act on the signal sent by the context once it stopped blocking.
+        """
 
-                match signal:
-                    case ContextSignal.ABORT:
-                        self.is_requesting_exit = True
-                    case ContextSignal.LISTEN:
-                        return
+        match signal:
+            case ContextSignal.ABORT:
+                self.is_requesting_exit = True
+            case ContextSignal.LISTEN | ContextSignal.BLOCK:
+                pass
 
-    def run(self, settings: ContextSettingsT) -> None:
+    def listen_key(self, context: Context[ContextSettingsT]) -> None:
         """
-        Run the app.
+        Listen for a pressed key and act accordingly.
         """
 
-        width, height = shutil.get_terminal_size()
-        window_width = width - CONTEXT_MARGIN
-        window_height = height - CONTEXT_MARGIN
+        self.is_waiting_key = True
+
+        try:
+            key = self.pending_keys.pop(0) if self.pending_keys else outspin.get_key()
+        finally:
+            self.is_waiting_key = False
 
-        window = Window.empty(window_width, window_height)
-        self.renderer.register(Coordinates(0, 0), window)
+        if self.handle_app_key(context, key):
+            return
 
-        context = self.context_factory(window, settings, GLOBAL_KEYHINTS)
+        channel = context.receive_key(key)
 
+        if not isinstance(channel, collections.abc.Iterator):
+            raise TypeError("asynchronous contexts require the asyncio mode")
+
+        # We let the Context run while it is blocking
         while True:
-            try:
+            with self.profiler.phase("step"):
+                signal = next(channel)
+
+            if signal is not ContextSignal.BLOCK:
+                break
+
+            # We still draw in case of updates, but only at frame
+            # boundaries ; the final state is drawn by `run()` anyway
+            if self.scheduler.is_frame_due():
                 self.draw(context)
-                self.listen_key(context)
+
+        self.handle_final_signal(signal)
+
+    def setup(self, *settings: ContextSettingsT) -> None:
+        """
+        Create the window and the context of each pane.
+
+        The panes take the `settings` in turn.
+        """
+
+        rows_per_cell = self.renderer.rows_per_cell
+        keyhints = GLOBAL_KEYHINTS
+
+        if self.layout.count > 1:
+            keyhints = GLOBAL_KEYHINTS | PANES_KEYHINTS
+
+        for index, rect in enumerate(self.arrange_panes()):
+            clip = None
+
+            if index == 0 and self.initial_window is not None:
+                window = self.initial_window
+                clip = self.pane_clip(rect)
+            else:
+                window = Window.empty(
+                    rect.width,
+                    rect.height * rows_per_cell,
+                    self.storage,
+                )
+
+            self.layers.append(
+                self.renderer.register(
+                    Coordinates(rect.x, rect.y * rows_per_cell),
+                    window,
+                    clip=clip,
+                ),
+            )
+            self.contexts.append(
+                self.context_factory(window, settings[index % len(settings)], keyhints),
+            )
+
+    def run(self, *settings: ContextSettingsT) -> None:
+        """
+        Run the app, with the `settings` of the context of each pane.
+        """
+
+        self.setup(*settings)
+        signal.signal(
+            signal.SIGWINCH,
+            lambda *_: self.handle_resize(self.focused_context),
+        )
+
+        while True:
+            try:
+                self.draw(self.focused_context)
+                self.listen_key(self.focused_context)
             except KeyboardInterrupt:
                 pass
 
@@ -189,3 +487,139 @@ class App(typing.Generic[ContextSettingsT]):
                 # thing in this context, but `break` allows us to add some
                 # "at exit" stuff later if needed
                 break
+
+    async def drive_context(
+        self,
+        channel: ContextChannel,
+    ) -> ContextSignal:
+        """
+        Let the context run while it is blocking, giving back control to the
+        event loop between each of its steps.
+
+        Return the signal it sent once it stopped blocking.
+        """
+
+        try:
+            if isinstance(channel, collections.abc.AsyncIterator):
+                while True:
+                    with self.profiler.phase("step"):
+                        signal = await anext(channel, ContextSignal.LISTEN)
+
+                    if signal is not ContextSignal.BLOCK:
+                        return signal
+
+                    await asyncio.sleep(0)
+            else:
+                while True:
+                    with self.profiler.phase("step"):
+                        signal = next(channel, ContextSignal.LISTEN)
+
+                    if signal is not ContextSignal.BLOCK:
+                        return signal
+
+                    await asyncio.sleep(0)
+        finally:
+            # Makes sure that the context cleans up if it has been cancelled
+            if isinstance(channel, collections.abc.AsyncGenerator):
+                await channel.aclose()
+            elif isinstance(channel, collections.abc.Generator):
+                channel.close()
+
+        return ContextSignal.LISTEN
+
+    async def draw_frames(self, context: Context[ContextSettingsT]) -> None:
+        """
+        Draw the app interface at every frame, until cancelled.
+        """
+
+        while True:
+            await asyncio.sleep(max(0, self.scheduler.time_until_next_frame()))
+            self.draw(context)
+
+    async def listen_key_async(
+        self,
+        context: Context[ContextSettingsT],
+        reader: KeyReader,
+    ) -> None:
+        """
+        Asynchronous version of `listen_key()`.
+
+        While the context is blocking, pressing any key interrupts it.
+        """
+
+        self.is_waiting_key = True
+
+        try:
+            key = await reader.get_key()
+        finally:
+            self.is_waiting_key = False
+
+        if self.handle_app_key(context, key):
+            return
+
+        task = asyncio.create_task(self.drive_context(context.receive_key(key)))
+        frames = asyncio.create_task(self.draw_frames(context))
+        interruption = asyncio.create_task(reader.get_key())
+        self.running_task = task
+
+        try:
+            await asyncio.wait(
+                {task, interruption},
+                return_when=asyncio.FIRST_COMPLETED,
+            )
+        finally:
+            self.running_task = None
+            frames.cancel()
+
+        if not interruption.done():
+            interruption.cancel()
+        elif not task.done():
+            task.cancel()
+
+            if interruption.result() in ("q", "esc"):
+                self.is_requesting_exit = True
+        else:
+            # Both finished at the same time, the key was not meant for us
+            reader.unget_key(interruption.result())
+
+        try:
+            self.handle_final_signal(await task)
+        except asyncio.CancelledError:
+            pass
+
+    def interrupt(self) -> None:
+        """
+        Interrupt the context if it is running.
+        """
+
+        if self.running_task is not None:
+            self.running_task.cancel()
+
+    async def run_async(self, *settings: ContextSettingsT) -> None:
+        """
+        Run the app using asyncio.
+        """
+
+        self.setup(*settings)
+        loop = asyncio.get_running_loop()
+
+        # Ctrl+C only interrupts the context, like in the synchronous mode
+        loop.add_signal_handler(signal.SIGINT, self.interrupt)
+        loop.add_signal_handler(
+            signal.SIGWINCH,
+            lambda: self.handle_resize(self.focused_context),
+        )
+
+        try:
+            with KeyReader() as reader:
+                for key in self.pending_keys:
+                    reader.unget_key(key)
+
+                self.pending_keys.clear()
+
+                while not self.is_requesting_exit:
+                    self.draw(self.focused_context)
+                    await self.listen_key_async(self.focused_context, reader)
+        finally:
+            loop.remove_signal_handler(signal.SIGINT)
+            loop.remove_signal_handler(signal.SIGWINCH)
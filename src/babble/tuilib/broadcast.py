@@ -0,0 +1,571 @@
+"""
+Live broadcast of the frames of a window to local viewers.
+
+The server listens on a Unix socket and sends each viewer a stream in the
+format of the recordings (see `babble.tuilib.recording`): a header, then a
+keyframe, then the deltas of the following frames. Each delta is encoded once
+and the same bytes are queued for every viewer.
+
+The viewers are served by a thread, with non-blocking sockets, so that a viewer
+which does not keep up never slows down the application. Instead of queuing
+the frames it missed without bound, it skips to a keyframe of the latest frame
+once it has caught up with what was already queued.
+"""
+from __future__ import annotations
+
+import array
+import collections
+import dataclasses
+import errno
+import os
+import selectors
+import socket
+import stat
+import tempfile
+import threading
+import time
+import typing
+import zlib
+
+from babble.tuilib.recording import COMPRESSED_FLAG
+from babble.tuilib.recording import decode_delta
+from babble.tuilib.recording import DELTA
+from babble.tuilib.recording import encode_delta
+from babble.tuilib.recording import FILE_HEADER
+from babble.tuilib.recording import from_little_endian
+from babble.tuilib.recording import KEYFRAME
+from babble.tuilib.recording import MAGIC
+from babble.tuilib.recording import RECORD_HEADER
+from babble.tuilib.recording import to_little_endian
+from babble.tuilib.recording import VERSION
+from babble.tuilib.window import Window
+
+
+DEFAULT_SOCKET_PATH = os.path.join(tempfile.gettempdir(), "babble.sock")
+
+DEFAULT_MAX_PENDING = 1 << 22
+"""Bytes queued for a viewer beyond which it skips to a keyframe"""
+
+CONNECT_TIMEOUT = 5.0
+"""Longest wait for the header of the stream, in seconds"""
+
+RECEIVE_SIZE = 1 << 16
+
+
+@dataclasses.dataclass(slots=True)
+class Viewer:
+    """
+    Connection of a viewer to the server, and the records queued for it.
+    """
+
+    connection: socket.socket
+    pending: collections.deque[bytes] = dataclasses.field(
+        default_factory=collections.deque,
+    )
+    offset: int = 0
+    """Number of bytes of the first pending record already sent"""
+    pending_size: int = 0
+    needs_keyframe: bool = True
+    """Whether the viewer waits for a keyframe before getting the deltas"""
+    events: int = selectors.EVENT_READ
+    """Events the viewer is registered for"""
+
+    def enqueue(self, data: bytes) -> None:
+        self.pending.append(data)
+        self.pending_size += len(data)
+
+    def skip(self) -> None:
+        """
+        Drop the pending records that were not started, and wait for the next
+        keyframe.
+        """
+
+        if self.offset:
+            # The stream would be corrupted without the end of this record
+            first = self.pending[0]
+            self.pending.clear()
+            self.pending.append(first)
+            self.pending_size = len(first) - self.offset
+        else:
+            self.pending.clear()
+            self.pending_size = 0
+
+        self.needs_keyframe = True
+
+    def send_pending(self) -> None:
+        """
+        Send as much of the pending records as the socket accepts right away.
+        """
+
+        while self.pending:
+            first = self.pending[0]
+
+            try:
+                sent = self.connection.send(memoryview(first)[self.offset :])
+            except BlockingIOError:
+                return
+
+            self.offset += sent
+            self.pending_size -= sent
+
+            if self.offset < len(first):
+                return
+
+            self.pending.popleft()
+            self.offset = 0
+
+
+@dataclasses.dataclass(slots=True)
+class FrameBroadcaster:
+    """
+    Server sending the frames of a window to the viewers connected to its Unix
+    socket.
+
+    `publish()` is called by the application at each frame, and the viewers are
+    served by a background thread.
+    """
+
+    path: str
+    listener: socket.socket
+    max_pending: int = DEFAULT_MAX_PENDING
+
+    viewers: list[Viewer] = dataclasses.field(init=False, default_factory=list)
+    lock: threading.Lock = dataclasses.field(
+        init=False,
+        default_factory=threading.Lock,
+    )
+    selector: selectors.BaseSelector = dataclasses.field(
+        init=False,
+        default_factory=selectors.DefaultSelector,
+    )
+    wakeup: tuple[socket.socket, socket.socket] = dataclasses.field(init=False)
+    """Sockets waking the thread up when records are queued, or on close"""
+    thread: threading.Thread = dataclasses.field(init=False)
+    is_closing: bool = dataclasses.field(init=False, default=False)
+
+    start_time: float = dataclasses.field(
+        init=False,
+        default_factory=time.perf_counter,
+    )
+    size: tuple[int, int] = dataclasses.field(init=False, default=(0, 0))
+    pixels: array.array[int] = dataclasses.field(
+        init=False,
+        default_factory=lambda: array.array("I"),
+    )
+    """Packed pixels of the latest frame, to build the keyframes from"""
+    keyframe: bytes | None = dataclasses.field(init=False, default=None)
+    """Keyframe record of the latest frame, once built"""
+
+    @classmethod
+    def open(
+        cls,
+        path: str = DEFAULT_SOCKET_PATH,
+        max_pending: int = DEFAULT_MAX_PENDING,
+    ) -> typing.Self:
+        """
+        Constructor listening on the socket at `path` and starting to serve.
+
+        The file of a socket left behind by a server that is gone is replaced,
+        but an `OSError` is raised if a server still listens on it.
+        """
+
+        remove_stale_socket(path)
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+
+        try:
+            listener.bind(path)
+            listener.listen()
+            listener.setblocking(False)
+        except BaseException:
+            listener.close()
+            raise
+
+        return cls(path, listener, max_pending)
+
+    def __post_init__(self) -> None:
+        self.wakeup = socket.socketpair()
+
+        for wakeup_socket in self.wakeup:
+            wakeup_socket.setblocking(False)
+
+        self.selector.register(self.listener, selectors.EVENT_READ)
+        self.selector.register(self.wakeup[0], selectors.EVENT_READ)
+        self.thread = threading.Thread(
+            target=self.serve,
+            name="babble-broadcast",
+            daemon=True,
+        )
+        self.thread.start()
+
+    def __enter__(self) -> typing.Self:
+        return self
+
+    def __exit__(self, *_) -> None:
+        self.close()
+
+    def close(self) -> None:
+        """
+        Stop serving, disconnect the viewers and remove the socket.
+        """
+
+        self.is_closing = True
+        self.wake()
+        self.thread.join()
+
+        for viewer in self.viewers:
+            viewer.connection.close()
+
+        self.viewers.clear()
+        self.selector.close()
+        self.listener.close()
+
+        for wakeup_socket in self.wakeup:
+            wakeup_socket.close()
+
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
+
+    def wake(self) -> None:
+        try:
+            self.wakeup[1].send(b"\0")
+        except BlockingIOError:
+            # The thread has not woken up yet, it will see the changes
+            pass
+
+    def publish(self, window: Window) -> None:
+        """
+        Send the changes of `window` since the previous frame to the viewers,
+        using its damage. It must be called before the damage is cleared.
+
+        Nothing is sent if the window did not change.
+        """
+
+        size = (window.width, window.height)
+        is_fully_changed = window.is_fully_damaged or size != self.size
+
+        if not is_fully_changed and not window.damage:
+            return
+
+        packed = window.packed()
+        # Encoded once for all the viewers, outside of the lock
+        delta = b"" if is_fully_changed else encode_delta(window.damage, packed)
+
+        with self.lock:
+            self.keyframe = None
+
+            if is_fully_changed:
+                self.pixels = array.array("I", packed)
+                self.size = size
+                record = self.get_keyframe()
+            else:
+                pixels = self.pixels
+
+                for index in window.damage:
+                    pixels[index] = packed[index]
+
+                record = self.encode_record(DELTA, delta)
+
+            for viewer in self.viewers:
+                if viewer.needs_keyframe:
+                    self.send_keyframe(viewer)
+                elif viewer.pending_size + len(record) > self.max_pending:
+                    viewer.skip()
+                else:
+                    viewer.enqueue(record)
+
+        self.wake()
+
+    def encode_record(self, kind: int, payload: bytes) -> bytes:
+        timestamp = time.perf_counter() - self.start_time
+
+        return RECORD_HEADER.pack(kind, timestamp, *self.size, len(payload)) + payload
+
+    def get_keyframe(self) -> bytes:
+        """
+        Get the keyframe record of the latest frame, encoding it only once.
+
+        The lock must be held.
+        """
+
+        if self.keyframe is None:
+            self.keyframe = self.encode_record(KEYFRAME, to_little_endian(self.pixels))
+
+        return self.keyframe
+
+    def send_keyframe(self, viewer: Viewer) -> None:
+        """
+        Queue the keyframe of the latest frame for `viewer` if it waits for
+        one, once it has nothing else pending.
+
+        The lock must be held.
+        """
+
+        if viewer.needs_keyframe and not viewer.pending and self.size != (0, 0):
+            viewer.enqueue(self.get_keyframe())
+            viewer.needs_keyframe = False
+
+    def serve(self) -> None:
+        """
+        Accept the viewers and send them their pending records, until closed.
+        """
+
+        while not self.is_closing:
+            for key, events in self.selector.select():
+                if key.fileobj is self.listener:
+                    self.accept()
+                elif key.fileobj is self.wakeup[0]:
+                    try:
+                        self.wakeup[0].recv(RECEIVE_SIZE)
+                    except BlockingIOError:
+                        pass
+                elif events & selectors.EVENT_READ:
+                    # The viewers never send anything: this is a disconnection
+                    with self.lock:
+                        self.disconnect(typing.cast(Viewer, key.data))
+
+            with self.lock:
+                for viewer in list(self.viewers):
+                    try:
+                        viewer.send_pending()
+                    except OSError:
+                        self.disconnect(viewer)
+                        continue
+
+                    self.send_keyframe(viewer)
+                    self.update_events(viewer)
+
+    def accept(self) -> None:
+        try:
+            connection, _ = self.listener.accept()
+        except BlockingIOError:
+            return
+
+        connection.setblocking(False)
+        viewer = Viewer(connection)
+        viewer.enqueue(FILE_HEADER.pack(MAGIC, VERSION, 0))
+        self.selector.register(connection, viewer.events, viewer)
+
+        with self.lock:
+            self.viewers.append(viewer)
+
+    def disconnect(self, viewer: Viewer) -> None:
+        """
+        Forget about `viewer` and close its connection.
+
+        The lock must be held.
+        """
+
+        if viewer not in self.viewers:
+            return
+
+        self.selector.unregister(viewer.connection)
+        viewer.connection.close()
+        self.viewers.remove(viewer)
+
+    def update_events(self, viewer: Viewer) -> None:
+        """
+        Only watch for `viewer` being writable while it has pending records.
+        """
+
+        events = selectors.EVENT_READ
+
+        if viewer.pending:
+            events |= selectors.EVENT_WRITE
+
+        if events != viewer.events:
+            self.selector.modify(viewer.connection, events, viewer)
+            viewer.events = events
+
+
+def remove_stale_socket(path: str) -> None:
+    """
+    Remove the socket at `path` if no server listens on it anymore.
+
+    Raises an `OSError` if one does.
+    """
+
+    try:
+        if not stat.S_ISSOCK(os.stat(path).st_mode):
+            return
+    except FileNotFoundError:
+        return
+
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+
+    try:
+        probe.connect(path)
+    except ConnectionRefusedError:
+        os.unlink(path)
+    else:
+        raise OSError(errno.EADDRINUSE, "a server is already running", path)
+    finally:
+        probe.close()
+
+
+@dataclasses.dataclass(slots=True)
+class FrameReceiver:
+    """
+    Viewer side of a broadcast, rebuilding the frames from the stream.
+    """
+
+    path: str
+    connection: socket.socket
+    is_compressed: bool
+
+    buffer: bytearray = dataclasses.field(init=False, default_factory=bytearray)
+    """Received bytes which do not form a whole record yet"""
+    width: int = dataclasses.field(init=False, default=0)
+    height: int = dataclasses.field(init=False, default=0)
+    pixels: array.array[int] = dataclasses.field(
+        init=False,
+        default_factory=lambda: array.array("I"),
+    )
+    """Packed pixels of the current frame"""
+    frame_count: int = dataclasses.field(init=False, default=0)
+    """Number of frames received"""
+
+    @classmethod
+    def open(cls, path: str = DEFAULT_SOCKET_PATH) -> typing.Self:
+        """
+        Constructor connecting to the server listening at `path`.
+
+        Raises an `OSError` if it cannot be reached, and a `ValueError` if it is
+        not a Babble server.
+        """
+
+        connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+
+        try:
+            connection.settimeout(CONNECT_TIMEOUT)
+            connection.connect(path)
+            header = b""
+
+            while len(header) < FILE_HEADER.size:
+                if not (data := connection.recv(FILE_HEADER.size - len(header))):
+                    break
+
+                header += data
+
+            if len(header) < FILE_HEADER.size:
+                raise ValueError("the server closed the connection")
+
+            magic, version, flags = FILE_HEADER.unpack(header)
+
+            if magic != MAGIC:
+                raise ValueError("not a Babble server")
+
+            if version != VERSION:
+                raise ValueError(f"unsupported stream version: {version}")
+
+            connection.setblocking(False)
+        except BaseException:
+            connection.close()
+            raise
+
+        return cls(path, connection, bool(flags & COMPRESSED_FLAG))
+
+    def __enter__(self) -> typing.Self:
+        return self
+
+    def __exit__(self, *_) -> None:
+        self.close()
+
+    def close(self) -> None:
+        self.connection.close()
+
+    def receive(self, timeout: float) -> set[int] | None:
+        """
+        Wait at most `timeout` seconds for frames, and apply all those that
+        arrived.
+
+        Return the indices of the pixels that changed, or `None` if all of them
+        might have. Raises a `ConnectionError` once the server is gone.
+        """
+
+        changed: set[int] | None = set()
+
+        with selectors.DefaultSelector() as selector:
+            selector.register(self.connection, selectors.EVENT_READ)
+
+            if not selector.select(timeout):
+                return changed
+
+        while True:
+            try:
+                data = self.connection.recv(RECEIVE_SIZE)
+            except BlockingIOError:
+                break
+
+            if not data:
+                raise ConnectionError("the server closed the connection")
+
+            self.buffer += data
+
+        offset = 0
+
+        while len(self.buffer) - offset >= RECORD_HEADER.size:
+            header = RECORD_HEADER.unpack_from(self.buffer, offset)
+            kind, _, width, height, size = header
+            start = offset + RECORD_HEADER.size
+
+            if len(self.buffer) - start < size:
+                break
+
+            payload = bytes(self.buffer[start : start + size])
+            offset = start + size
+
+            indices = self.apply(kind, width, height, payload)
+
+            if indices is None:
+                changed = None
+            elif changed is not None:
+                changed.update(indices)
+
+        del self.buffer[:offset]
+
+        return changed
+
+    def apply(
+        self,
+        kind: int,
+        width: int,
+        height: int,
+        payload: bytes,
+    ) -> array.array[int] | None:
+        """
+        Apply a record to the current frame.
+
+        Return the indices of the pixels it changed, or `None` for a keyframe.
+        """
+
+        if self.is_compressed:
+            payload = zlib.decompress(payload)
+
+        self.frame_count += 1
+
+        if kind == KEYFRAME:
+            pixels = from_little_endian(payload)
+
+            if len(pixels) != width * height:
+                raise ValueError("the stream is corrupted")
+
+            self.pixels = pixels
+            self.width, self.height = width, height
+
+            return None
+
+        if kind != DELTA:
+            raise ValueError("the stream is corrupted")
+
+        if (width, height) != (self.width, self.height):
+            raise ValueError("the stream does not start with a keyframe")
+
+        indices, colors = decode_delta(payload)
+        pixels = self.pixels
+
+        for index, color in zip(indices, colors):
+            pixels[index] = color
+
+        return indices
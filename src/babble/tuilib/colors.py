@@ -0,0 +1,281 @@
+"""
+Reduced color depths of the terminal output.
+
+The colors are quantized to a palette through a lookup table indexed by their
+5 most significant bits per channel, so that it only costs a table lookup per
+pixel while rendering.
+"""
+from __future__ import annotations
+
+import array
+import collections.abc
+import dataclasses
+import functools
+import os
+import typing
+
+from babble.tuilib.window import EMPTY_PACKED
+
+
+ColorDepth: typing.TypeAlias = typing.Literal["truecolor", "256", "16"]
+
+TABLE_BITS = 5
+"""Number of most significant bits per channel used to index the tables"""
+
+XTERM_16_PALETTE = (
+    (0, 0, 0),
+    (205, 0, 0),
+    (0, 205, 0),
+    (205, 205, 0),
+    (0, 0, 238),
+    (205, 0, 205),
+    (0, 205, 205),
+    (229, 229, 229),
+    (127, 127, 127),
+    (255, 0, 0),
+    (0, 255, 0),
+    (255, 255, 0),
+    (92, 92, 255),
+    (255, 0, 255),
+    (0, 255, 255),
+    (255, 255, 255),
+)
+"""Default colors of xterm ; other terminals use similar ones"""
+
+XTERM_CUBE_LEVELS = (0, 95, 135, 175, 215, 255)
+"""Channel values of the 6×6×6 color cube of xterm-256 (indices 16 to 231)"""
+
+XTERM_GRAY_LEVELS = tuple(8 + 10 * i for i in range(24))
+"""Values of the gray ramp of xterm-256 (indices 232 to 255)"""
+
+BAYER_MATRIX = (
+    (0, 8, 2, 10),
+    (12, 4, 14, 6),
+    (3, 11, 1, 9),
+    (15, 7, 13, 5),
+)
+
+DITHER_SPREAD: dict[ColorDepth, int] = {"256": 40, "16": 128}
+"""Amplitude of the dithering, about the distance between two palette colors"""
+
+
+def detect_color_depth(
+    environ: collections.abc.Mapping[str, str] = os.environ,
+) -> ColorDepth:
+    """
+    Guess the color depth supported by the terminal from the `COLORTERM` and
+    `TERM` environment variables.
+    """
+
+    if environ.get("COLORTERM", "").lower() in ("truecolor", "24bit"):
+        return "truecolor"
+
+    term = environ.get("TERM", "")
+
+    if term.endswith("-direct"):
+        return "truecolor"
+
+    if "256color" in term:
+        return "256"
+
+    return "16"
+
+
+def table_key(value: int) -> int:
+    """
+    Get the index in the quantization tables of the packed color `value`.
+    """
+
+    return ((value >> 9) & 0x7C00) | ((value >> 6) & 0x3E0) | ((value >> 3) & 0x1F)
+
+
+@functools.cache
+def nearest_level(value: int, levels: tuple[int, ...]) -> int:
+    """
+    Get the index of the level the closest to `value`.
+    """
+
+    return min(range(len(levels)), key=lambda index: abs(levels[index] - value))
+
+
+def distance(
+    first: collections.abc.Sequence[int],
+    second: collections.abc.Sequence[int],
+) -> int:
+    return sum((a - b) ** 2 for a, b in zip(first, second))
+
+
+def nearest_xterm_256(red: int, green: int, blue: int) -> int:
+    """
+    Get the index of the xterm-256 color the closest to the provided one.
+
+    The 16 system colors are left out since terminals customize them.
+    """
+
+    cube = tuple(
+        nearest_level(value, XTERM_CUBE_LEVELS) for value in (red, green, blue)
+    )
+    gray = nearest_level((red + green + blue) // 3, XTERM_GRAY_LEVELS)
+
+    cube_color = tuple(XTERM_CUBE_LEVELS[level] for level in cube)
+    gray_color = (XTERM_GRAY_LEVELS[gray],) * 3
+
+    if distance((red, green, blue), gray_color) < distance(
+        (red, green, blue),
+        cube_color,
+    ):
+        return 232 + gray
+
+    return 16 + 36 * cube[0] + 6 * cube[1] + cube[2]
+
+
+def nearest_xterm_16(red: int, green: int, blue: int) -> int:
+    """
+    Get the index of the xterm-16 color the closest to the provided one.
+    """
+
+    # This is called for every entry of the table, hence the inlined distance
+    nearest = 0
+    nearest_distance = 3 * 256**2
+
+    for index, (palette_red, palette_green, palette_blue) in enumerate(
+        XTERM_16_PALETTE,
+    ):
+        color_distance = (
+            (red - palette_red) ** 2
+            + (green - palette_green) ** 2
+            + (blue - palette_blue) ** 2
+        )
+
+        if color_distance < nearest_distance:
+            nearest = index
+            nearest_distance = color_distance
+
+    return nearest
+
+
+@functools.cache
+def get_quantization_table(depth: ColorDepth) -> array.array[int]:
+    """
+    Get the table mapping the key of a color (see `table_key()`) to its
+    palette index for the given `depth`.
+
+    It is computed on first use, then cached.
+    """
+
+    nearest = nearest_xterm_256 if depth == "256" else nearest_xterm_16
+    # Each key stands for the center of the colors sharing it
+    center = 1 << (7 - TABLE_BITS)
+    levels = [(level << (8 - TABLE_BITS)) | center for level in range(1 << TABLE_BITS)]
+
+    return array.array(
+        "B",
+        (
+            nearest(red, green, blue)
+            for red in levels
+            for green in levels
+            for blue in levels
+        ),
+    )
+
+
+@functools.lru_cache(maxsize=1 << 10)
+def indexed_sequence(index: int, depth: ColorDepth, is_background: bool) -> str:
+    """
+    Get the SGR sequence that sets the terminal background (or foreground) to
+    the palette color `index`.
+
+    The empty pixel corresponds to the default color of the terminal.
+    """
+
+    if index == EMPTY_PACKED:
+        return "\x1b[49m" if is_background else "\x1b[39m"
+
+    if depth == "256":
+        return f"\x1b[{48 if is_background else 38};5;{index}m"
+
+    base = 40 if is_background else 30
+
+    # The bright colors have their own range of parameters
+    if index >= 8:
+        return f"\x1b[{base + 60 + index - 8}m"
+
+    return f"\x1b[{base + index}m"
+
+
+@dataclasses.dataclass(slots=True)
+class ColorQuantizer:
+    """
+    Maps the packed colors to the palette of a reduced color depth.
+
+    The empty pixel is left as is.
+    """
+
+    depth: ColorDepth
+    dither: bool = False
+    """Whether an ordered dithering is applied, trading noise for banding"""
+
+    table: array.array[int] = dataclasses.field(init=False)
+    offsets: tuple[tuple[int, ...], ...] = dataclasses.field(init=False)
+    """Offsets added to the channels by the dithering, by position"""
+
+    def __post_init__(self) -> None:
+        if self.depth == "truecolor":
+            raise ValueError("truecolor does not need to be quantized")
+
+        self.table = get_quantization_table(self.depth)
+        spread = DITHER_SPREAD[self.depth]
+        self.offsets = tuple(
+            tuple(int(((threshold + 0.5) / 16 - 0.5) * spread) for threshold in row)
+            for row in BAYER_MATRIX
+        )
+
+    def quantize(self, value: int, x: int, y: int) -> int:
+        """
+        Get the palette index of the packed color `value` shown at the pixel
+        (`x`, `y`).
+        """
+
+        if value == EMPTY_PACKED:
+            return value
+
+        if self.dither:
+            value = self.apply_dithering(value, self.offsets[y & 3][x & 3])
+
+        return self.table[table_key(value)]
+
+    def quantize_row(self, row: collections.abc.Sequence[int], y: int) -> list[int]:
+        """
+        Get the palette indices of the packed colors of the pixel row `y`.
+        """
+
+        table = self.table
+
+        if self.dither:
+            offsets = self.offsets[y & 3]
+
+            return [
+                value
+                if value == EMPTY_PACKED
+                else table[table_key(self.apply_dithering(value, offsets[x & 3]))]
+                for x, value in enumerate(row)
+            ]
+
+        return [
+            value if value == EMPTY_PACKED else table[table_key(value)]
+            for value in row
+        ]
+
+    @staticmethod
+    def apply_dithering(value: int, offset: int) -> int:
+        red = min(255, max(0, (value >> 16) + offset))
+        green = min(255, max(0, ((value >> 8) & 0xFF) + offset))
+        blue = min(255, max(0, (value & 0xFF) + offset))
+
+        return (red << 16) | (green << 8) | blue
+
+    def background_sequence(self, index: int) -> str:
+        return indexed_sequence(index, self.depth, True)
+
+    def foreground_sequence(self, index: int) -> str:
+        return indexed_sequence(index, self.depth, False)
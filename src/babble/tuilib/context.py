@@ -24,6 +24,16 @@ class ContextSignal(enum.Enum):
     """The context requests the application to close"""
 
 
+ContextChannel: typing.TypeAlias = (
+    collections.abc.Iterator[ContextSignal]
+    | collections.abc.AsyncIterator[ContextSignal]
+)
+"""
+Stream of signals of the context. It can only be asynchronous if the
+application runs in asyncio mode.
+"""
+
+
 @dataclasses.dataclass(slots=True)
 class Context(typing.Generic[ContextSettingsT], abc.ABC):
     """
@@ -41,7 +51,7 @@ class Context(typing.Generic[ContextSettingsT], abc.ABC):
         self.status_message = self.default_status_message
 
     @abc.abstractmethod
-    def receive_key(self, key: str) -> collections.abc.Iterator[ContextSignal]:
+    def receive_key(self, key: str) -> ContextChannel:
         """
         Receive the pressed key from the application and act in consequence.
         """
@@ -0,0 +1,263 @@
+import collections.abc
+import dataclasses
+import functools
+
+from babble.tuilib.window import EMPTY_PACKED
+
+
+DEFAULT_BACKGROUND_SEQUENCE = "\x1b[49m"
+DEFAULT_FOREGROUND_SEQUENCE = "\x1b[39m"
+
+ANY_COLOR = -1
+"""Foreground of the cells which do not show it, such as spaces"""
+
+UPPER_HALF_BLOCK = "▀"
+LOWER_HALF_BLOCK = "▄"
+
+
+@functools.lru_cache(maxsize=1 << 16)
+def background_sequence(value: int) -> str:
+    """
+    Get the SGR sequence that sets the terminal background to the packed color
+    `value`.
+
+    The empty pixel corresponds to the default background of the terminal.
+    """
+
+    if value == EMPTY_PACKED:
+        return DEFAULT_BACKGROUND_SEQUENCE
+
+    return f"\x1b[48;2;{value >> 16};{(value >> 8) & 0xFF};{value & 0xFF}m"
+
+
+@functools.lru_cache(maxsize=1 << 16)
+def foreground_sequence(value: int) -> str:
+    """
+    Get the SGR sequence that sets the terminal foreground to the packed color
+    `value`.
+
+    The empty pixel corresponds to the default foreground of the terminal.
+    """
+
+    if value == EMPTY_PACKED:
+        return DEFAULT_FOREGROUND_SEQUENCE
+
+    return f"\x1b[38;2;{value >> 16};{(value >> 8) & 0xFF};{value & 0xFF}m"
+
+
+def repeat_sequence(count: int) -> str:
+    """
+    Get the `REP` sequence that repeats the preceding character `count` times.
+    """
+
+    return f"\x1b[{count}b"
+
+
+@dataclasses.dataclass(slots=True)
+class OutputEncoder:
+    """
+    Encoder of colored terminal cells.
+
+    It keeps track of the SGR state of the terminal to only emit a sequence
+    when a color actually changes, and collapses runs of identical cells.
+    """
+
+    use_rep: bool = False
+    """Whether the terminal supports the `REP` sequence"""
+
+    encode_background: collections.abc.Callable[[int], str] = background_sequence
+    """Get the sequence setting the background to a color (truecolor by default)"""
+
+    encode_foreground: collections.abc.Callable[[int], str] = foreground_sequence
+    """Get the sequence setting the foreground to a color (truecolor by default)"""
+
+    chunks: list[str] = dataclasses.field(default_factory=list)
+
+    background: int = EMPTY_PACKED
+    """Current background color of the terminal, packed"""
+
+    foreground: int = EMPTY_PACKED
+    """Current foreground color of the terminal, packed"""
+
+    run_glyph: str = dataclasses.field(init=False, default=" ")
+    run_foreground: int = dataclasses.field(init=False, default=ANY_COLOR)
+    run_color: int = dataclasses.field(init=False, default=EMPTY_PACKED)
+    """Background color of the pending run"""
+    run_length: int = dataclasses.field(init=False, default=0)
+
+    def move_to(self, x: int, y: int) -> None:
+        """
+        Move the cursor to the (0-based) terminal position (`x`, `y`).
+        """
+
+        self.flush_run()
+        self.chunks.append(f"\x1b[{y + 1};{x + 1}H")
+
+    def write_cells(self, color: int, count: int = 1) -> None:
+        """
+        Write `count` cells of packed color `color` at the cursor position.
+        """
+
+        if self.run_length and (
+            color != self.run_color or self.run_foreground != ANY_COLOR
+        ):
+            self.flush_run()
+
+        self.run_glyph = " "
+        self.run_foreground = ANY_COLOR
+        self.run_color = color
+        self.run_length += count
+
+    def write_row(self, colors: collections.abc.Iterable[int]) -> None:
+        """
+        Write a cell of each packed color of `colors` at the cursor position.
+
+        This is `write_cells()` for a whole row at once: the runs are detected
+        and emitted inline, which avoids a call per cell.
+        """
+
+        if self.run_length and self.run_foreground != ANY_COLOR:
+            self.flush_run()
+
+        chunks = self.chunks
+        encode_background = self.encode_background
+        background = self.background
+        run_color = self.run_color
+        run_length = self.run_length
+
+        for color in colors:
+            if color == run_color:
+                run_length += 1
+                continue
+
+            if run_length:
+                if run_color != background:
+                    chunks.append(encode_background(run_color))
+                    background = run_color
+
+                chunks.append(" " if run_length == 1 else self.spaces(run_length))
+
+            run_color = color
+            run_length = 1
+
+        self.background = background
+        self.run_glyph = " "
+        self.run_foreground = ANY_COLOR
+        self.run_color = run_color
+        self.run_length = run_length
+
+    def write_half_row(
+        self,
+        top_colors: collections.abc.Iterable[int],
+        bottom_colors: collections.abc.Iterable[int],
+    ) -> None:
+        """
+        Write a cell of each pair of packed colors of `top_colors` and
+        `bottom_colors` at the cursor position, like `write_half_cell()`.
+        """
+
+        write_half_cell = self.write_half_cell
+
+        for top, bottom in zip(top_colors, bottom_colors):
+            write_half_cell(top, bottom)
+
+    def spaces(self, count: int) -> str:
+        """
+        Get `count` spaces, repeated with `REP` if it is shorter.
+        """
+
+        if self.use_rep and count > 5 and count - 1 > len(repeat_sequence(count - 1)):
+            return " " + repeat_sequence(count - 1)
+
+        return " " * count
+
+    def write_half_cell(self, top: int, bottom: int) -> None:
+        """
+        Write a cell showing the packed colors `top` and `bottom` on its upper
+        and lower halves at the cursor position.
+        """
+
+        if top == bottom:
+            self.write_cells(top)
+            return
+
+        if top == EMPTY_PACKED:
+            glyph, foreground, background = LOWER_HALF_BLOCK, bottom, top
+        elif bottom == EMPTY_PACKED:
+            glyph, foreground, background = UPPER_HALF_BLOCK, top, bottom
+        elif top == self.background or bottom == self.foreground:
+            # Both blocks work: we pick the one that keeps the current colors
+            glyph, foreground, background = LOWER_HALF_BLOCK, bottom, top
+        else:
+            glyph, foreground, background = UPPER_HALF_BLOCK, top, bottom
+
+        if self.run_length and (
+            glyph != self.run_glyph
+            or foreground != self.run_foreground
+            or background != self.run_color
+        ):
+            self.flush_run()
+
+        self.run_glyph = glyph
+        self.run_foreground = foreground
+        self.run_color = background
+        self.run_length += 1
+
+    def flush_run(self) -> None:
+        """
+        Emit the pending run of identical cells.
+        """
+
+        if not self.run_length:
+            return
+
+        background_changed = self.run_color != self.background
+        foreground_changed = self.run_foreground not in (ANY_COLOR, self.foreground)
+
+        if background_changed and foreground_changed:
+            # Both colors fit in a single SGR sequence
+            self.chunks.append(
+                self.encode_foreground(self.run_foreground)[:-1]
+                + ";"
+                + self.encode_background(self.run_color)[2:],
+            )
+        elif background_changed:
+            self.chunks.append(self.encode_background(self.run_color))
+        elif foreground_changed:
+            self.chunks.append(self.encode_foreground(self.run_foreground))
+
+        self.background = self.run_color
+
+        if foreground_changed:
+            self.foreground = self.run_foreground
+
+        glyph = self.run_glyph
+        repetitions = self.run_length - 1
+
+        # REP is only worth it if it is shorter than the glyphs themselves
+        if self.use_rep and repetitions * len(glyph.encode()) > len(
+            repeat_sequence(repetitions),
+        ):
+            self.chunks.append(glyph + repeat_sequence(repetitions))
+        else:
+            self.chunks.append(glyph * self.run_length)
+
+        self.run_length = 0
+
+    def getvalue(self) -> str:
+        """
+        Get the encoded output, restoring the default colors of the terminal
+        at the end.
+        """
+
+        self.flush_run()
+
+        if self.background != EMPTY_PACKED:
+            self.background = EMPTY_PACKED
+            self.chunks.append(DEFAULT_BACKGROUND_SEQUENCE)
+
+        if self.foreground != EMPTY_PACKED:
+            self.foreground = EMPTY_PACKED
+            self.chunks.append(DEFAULT_FOREGROUND_SEQUENCE)
+
+        return "".join(self.chunks)
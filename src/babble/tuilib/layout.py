@@ -0,0 +1,142 @@
+"""
+Geometry of the panes of the application.
+
+A layout is a tree of splits whose leaves are the panes. Arranging it in a
+rectangle gives the rectangle of each pane, from left to right and top to
+bottom.
+"""
+from __future__ import annotations
+
+import dataclasses
+import typing
+
+
+Orientation: typing.TypeAlias = typing.Literal["horizontal", "vertical"]
+"""
+How a split places its children: side by side with `"horizontal"`, or stacked
+with `"vertical"`.
+"""
+
+
+@dataclasses.dataclass(slots=True, frozen=True)
+class Rect:
+    """
+    Rectangle of cells or pixels, `x` and `y` being its top-left corner.
+    """
+
+    x: int
+    y: int
+    width: int
+    height: int
+
+    @property
+    def right(self) -> int:
+        return self.x + self.width
+
+    @property
+    def bottom(self) -> int:
+        return self.y + self.height
+
+    @property
+    def is_empty(self) -> bool:
+        return self.width <= 0 or self.height <= 0
+
+    def intersection(self, other: Rect) -> Rect:
+        """
+        Get the part of the rectangle which is also in `other`, which is empty
+        if they do not overlap.
+        """
+
+        x = max(self.x, other.x)
+        y = max(self.y, other.y)
+
+        return Rect(
+            x,
+            y,
+            max(0, min(self.right, other.right) - x),
+            max(0, min(self.bottom, other.bottom) - y),
+        )
+
+
+@dataclasses.dataclass(slots=True, frozen=True)
+class Pane:
+    """
+    Leaf of a layout, taking the whole rectangle it is given.
+    """
+
+    @property
+    def count(self) -> int:
+        return 1
+
+    def arrange(self, rect: Rect) -> list[Rect]:
+        return [rect]
+
+
+@dataclasses.dataclass(slots=True, frozen=True)
+class Split:
+    """
+    Node of a layout sharing its rectangle between its children, in proportion
+    to their `weights` (equal by default), with `gap` cells between them.
+    """
+
+    orientation: Orientation
+    children: tuple[Layout, ...]
+    weights: tuple[int, ...] | None = None
+    gap: int = 1
+
+    def __post_init__(self) -> None:
+        if not self.children:
+            raise ValueError("a split needs at least one child")
+
+        if self.weights is not None and len(self.weights) != len(self.children):
+            raise ValueError("a split needs as many weights as children")
+
+    @property
+    def count(self) -> int:
+        return sum(child.count for child in self.children)
+
+    def arrange(self, rect: Rect) -> list[Rect]:
+        weights = self.weights or (1,) * len(self.children)
+        is_horizontal = self.orientation == "horizontal"
+        length = rect.width if is_horizontal else rect.height
+        available = max(0, length - self.gap * (len(self.children) - 1))
+        total_weight = sum(weights)
+
+        rects: list[Rect] = []
+        start = 0
+        cumulated_weight = 0
+
+        for index, (child, weight) in enumerate(zip(self.children, weights)):
+            # Cumulating the weights avoids losing cells to rounding
+            cumulated_weight += weight
+            stop = available * cumulated_weight // total_weight
+            offset = start + self.gap * index
+
+            if is_horizontal:
+                child_rect = Rect(rect.x + offset, rect.y, stop - start, rect.height)
+            else:
+                child_rect = Rect(rect.x, rect.y + offset, rect.width, stop - start)
+
+            rects.extend(child.arrange(child_rect))
+            start = stop
+
+        return rects
+
+
+Layout: typing.TypeAlias = Pane | Split
+
+
+def tiles(columns: int, rows: int, gap: int = 1) -> Layout:
+    """
+    Get a layout of `columns` × `rows` panes of the same size.
+    """
+
+    if columns == rows == 1:
+        return Pane()
+
+    row = Split("horizontal", (Pane(),) * columns, gap=gap)
+
+    if rows == 1:
+        return row
+
+    return Split("vertical", (row,) * rows, gap=gap)
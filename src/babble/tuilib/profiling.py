@@ -0,0 +1,161 @@
+import collections
+import contextlib
+import dataclasses
+import json
+import time
+import typing
+
+
+ROLLING_WINDOW_SIZE = 120
+"""Number of frames the live statistics are computed on"""
+
+
+@dataclasses.dataclass(slots=True)
+class Histogram:
+    """
+    Distribution of values using power-of-two buckets.
+    """
+
+    buckets: dict[int, int] = dataclasses.field(default_factory=dict)
+    count: int = 0
+    total: float = 0
+
+    def add(self, value: float) -> None:
+        bucket = int(value).bit_length()
+
+        self.buckets[bucket] = self.buckets.get(bucket, 0) + 1
+        self.count += 1
+        self.total += value
+
+    def as_dict(self, unit: str) -> dict[str, typing.Any]:
+        return {
+            "count": self.count,
+            "total": self.total,
+            "mean": self.total / self.count if self.count else 0,
+            "buckets": {
+                f"<{1 << bucket}{unit}": amount
+                for bucket, amount in sorted(self.buckets.items())
+            },
+        }
+
+
+def percentile(values: collections.abc.Collection[float], ratio: float) -> float:
+    if not values:
+        return 0
+
+    ordered = sorted(values)
+
+    return ordered[min(len(ordered) - 1, int(len(ordered) * ratio))]
+
+
+@dataclasses.dataclass(slots=True)
+class FrameProfiler:
+    """
+    Records the time spent in each phase of the frames, along with the amount
+    of data they carry.
+    """
+
+    phases: dict[str, Histogram] = dataclasses.field(default_factory=dict)
+    """Durations of the phases, in microseconds"""
+
+    frame_durations: Histogram = dataclasses.field(default_factory=Histogram)
+    """Durations of the frames, in microseconds"""
+
+    frame_bytes: Histogram = dataclasses.field(default_factory=Histogram)
+    frame_pixels: Histogram = dataclasses.field(default_factory=Histogram)
+
+    recent_timestamps: collections.deque[float] = dataclasses.field(
+        default_factory=lambda: collections.deque(maxlen=ROLLING_WINDOW_SIZE),
+    )
+    recent_durations: collections.deque[float] = dataclasses.field(
+        default_factory=lambda: collections.deque(maxlen=ROLLING_WINDOW_SIZE),
+    )
+    recent_bytes: collections.deque[int] = dataclasses.field(
+        default_factory=lambda: collections.deque(maxlen=ROLLING_WINDOW_SIZE),
+    )
+
+    @contextlib.contextmanager
+    def phase(self, name: str) -> collections.abc.Iterator[None]:
+        """
+        Record the time spent in the `with` block as the phase `name`.
+        """
+
+        start = time.perf_counter()
+
+        try:
+            yield
+        finally:
+            self.record_phase(name, time.perf_counter() - start)
+
+    def record_phase(self, name: str, duration: float) -> None:
+        """
+        Record that the phase `name` took `duration` seconds.
+        """
+
+        if name not in self.phases:
+            self.phases[name] = Histogram()
+
+        self.phases[name].add(duration * 1e6)
+
+    def record_frame(self, duration: float, nb_bytes: int, nb_pixels: int) -> None:
+        """
+        Record that a frame took `duration` seconds, writing `nb_bytes` bytes
+        for `nb_pixels` changed pixels.
+        """
+
+        self.frame_durations.add(duration * 1e6)
+        self.frame_bytes.add(nb_bytes)
+        self.frame_pixels.add(nb_pixels)
+
+        self.recent_timestamps.append(time.perf_counter())
+        self.recent_durations.append(duration)
+        self.recent_bytes.append(nb_bytes)
+
+    @property
+    def fps(self) -> float:
+        """
+        Rolling number of frames per second.
+        """
+
+        if len(self.recent_timestamps) < 2:
+            return 0
+
+        elapsed = self.recent_timestamps[-1] - self.recent_timestamps[0]
+
+        return (len(self.recent_timestamps) - 1) / elapsed if elapsed else 0
+
+    def summary(self) -> str:
+        """
+        Get a printable one-line summary of the recent frames.
+        """
+
+        p50 = percentile(self.recent_durations, 0.5) * 1e3
+        p99 = percentile(self.recent_durations, 0.99) * 1e3
+        average_bytes = sum(self.recent_bytes) / max(1, len(self.recent_bytes))
+
+        return (
+            f"\x1b[96m{self.fps:.1f}\x1b[39m fps, "
+            f"frame p50 \x1b[96m{p50:.2f}\x1b[39mms "
+            f"p99 \x1b[96m{p99:.2f}\x1b[39mms, "
+            f"\x1b[96m{average_bytes:,.0f}\x1b[39m B/frame"
+        )
+
+    def dump(self, path: str) -> None:
+        """
+        Save the histograms as JSON at `path`.
+        """
+
+        data = {
+            "phases": {
+                name: histogram.as_dict("µs")
+                for name, histogram in self.phases.items()
+            },
+            "frames": {
+                "duration": self.frame_durations.as_dict("µs"),
+                "bytes": self.frame_bytes.as_dict("B"),
+                "pixels": self.frame_pixels.as_dict("px"),
+            },
+        }
+
+        with open(path, "w") as file:
+            json.dump(data, file, indent=2, ensure_ascii=False)
@@ -0,0 +1,369 @@
+"""
+Recording of the frames of a window, and their playback.
+
+A recording is a small header followed by one record per frame in which the
+window changed. A record is either:
+
+- a keyframe, holding all the packed pixels of the window ;
+- a delta, holding the runs of consecutive pixels that changed since the
+  previous frame, then the packed colors of those pixels.
+
+Keyframes are written periodically and whenever the whole window changes, so
+that seeking only has to apply a bounded number of deltas. The payloads can be
+compressed with zlib, and the integers are little-endian.
+"""
+from __future__ import annotations
+
+import array
+import bisect
+import collections.abc
+import dataclasses
+import os
+import struct
+import sys
+import time
+import typing
+import zlib
+
+from babble.tuilib.window import Window
+
+
+MAGIC = b"BABR"
+VERSION = 1
+
+FILE_HEADER = struct.Struct("<4sHH")
+"""Magic, version and flags"""
+RECORD_HEADER = struct.Struct("<BdIII")
+"""Kind, timestamp, width, height and payload size"""
+
+COMPRESSED_FLAG = 1
+
+KEYFRAME = 0
+DELTA = 1
+
+DEFAULT_KEYFRAME_INTERVAL = 120
+"""Number of frames after which a keyframe is recorded again"""
+
+
+def to_little_endian(data: array.array[int]) -> bytes:
+    if sys.byteorder != "little":
+        data = array.array(data.typecode, data)
+        data.byteswap()
+
+    return data.tobytes()
+
+
+def from_little_endian(data: bytes) -> array.array[int]:
+    values = array.array("I")
+    values.frombytes(data)
+
+    if sys.byteorder != "little":
+        values.byteswap()
+
+    return values
+
+
+def encode_delta(
+    indices: collections.abc.Iterable[int],
+    data: collections.abc.Sequence[int],
+) -> bytes:
+    """
+    Encode the packed colors of `data` at `indices` as runs of consecutive
+    indices, followed by the colors.
+    """
+
+    runs = array.array("I")
+    colors = array.array("I")
+    run_start = run_stop = -1
+
+    for index in sorted(indices):
+        if index != run_stop:
+            if run_stop >= 0:
+                runs.extend((run_start, run_stop - run_start))
+
+            run_start = index
+
+        run_stop = index + 1
+        colors.append(data[index])
+
+    if run_stop >= 0:
+        runs.extend((run_start, run_stop - run_start))
+
+    return struct.pack("<I", len(runs) // 2) + to_little_endian(runs + colors)
+
+
+def decode_delta(payload: bytes) -> tuple[array.array[int], array.array[int]]:
+    """
+    Decode a delta into the changed indices and their packed colors.
+    """
+
+    (run_count,) = struct.unpack_from("<I", payload)
+    values = from_little_endian(payload[4:])
+    runs, colors = values[: 2 * run_count], values[2 * run_count :]
+    indices = array.array("I")
+
+    for start, length in zip(runs[::2], runs[1::2]):
+        indices.extend(range(start, start + length))
+
+    return indices, colors
+
+
+@dataclasses.dataclass(slots=True)
+class SessionRecorder:
+    """
+    Writes the changes of a window to a recording, one frame at a time.
+    """
+
+    file: typing.BinaryIO
+    is_compressed: bool = True
+    keyframe_interval: int = DEFAULT_KEYFRAME_INTERVAL
+
+    start_time: float = dataclasses.field(
+        init=False,
+        default_factory=time.perf_counter,
+    )
+    frame_count: int = dataclasses.field(init=False, default=0)
+    last_keyframe: int = dataclasses.field(init=False, default=-1)
+    size: tuple[int, int] = dataclasses.field(init=False, default=(0, 0))
+
+    @classmethod
+    def open(
+        cls,
+        path: str,
+        is_compressed: bool = True,
+        keyframe_interval: int = DEFAULT_KEYFRAME_INTERVAL,
+    ) -> typing.Self:
+        """
+        Constructor creating the recording file at `path`.
+        """
+
+        file = open(path, "wb")
+        flags = COMPRESSED_FLAG if is_compressed else 0
+        file.write(FILE_HEADER.pack(MAGIC, VERSION, flags))
+
+        return cls(file, is_compressed, keyframe_interval)
+
+    def __enter__(self) -> typing.Self:
+        return self
+
+    def __exit__(self, *_) -> None:
+        self.close()
+
+    def close(self) -> None:
+        self.file.close()
+
+    def record(self, window: Window) -> None:
+        """
+        Record the changes of `window` since the previous frame, using its
+        damage. It must be called before the damage is cleared.
+
+        Nothing is written if the window did not change.
+        """
+
+        size = (window.width, window.height)
+        is_fully_changed = window.is_fully_damaged or size != self.size
+
+        if not is_fully_changed and not window.damage:
+            return
+
+        is_keyframe = (
+            is_fully_changed
+            or self.frame_count - self.last_keyframe >= self.keyframe_interval
+        )
+        packed = window.packed()
+
+        if is_keyframe:
+            payload = to_little_endian(array.array("I", packed))
+            self.last_keyframe = self.frame_count
+        else:
+            payload = encode_delta(window.damage, packed)
+
+        self.write_record(KEYFRAME if is_keyframe else DELTA, size, payload)
+        self.size = size
+        self.frame_count += 1
+
+    def write_record(self, kind: int, size: tuple[int, int], payload: bytes) -> None:
+        if self.is_compressed:
+            payload = zlib.compress(payload, 1)
+
+        timestamp = time.perf_counter() - self.start_time
+
+        self.file.write(RECORD_HEADER.pack(kind, timestamp, *size, len(payload)))
+        self.file.write(payload)
+
+
+@dataclasses.dataclass(slots=True, frozen=True)
+class FrameRecord:
+    """
+    Location of a frame in a recording.
+    """
+
+    kind: int
+    timestamp: float
+    """Seconds elapsed since the start of the recording"""
+    width: int
+    height: int
+    offset: int
+    """Position of the payload in the file"""
+    size: int
+
+
+@dataclasses.dataclass(slots=True)
+class SessionPlayer:
+    """
+    Reconstructs the frames of a recording, in any order.
+
+    Only the frames between the nearest keyframe and the requested one are
+    decoded.
+    """
+
+    file: typing.BinaryIO
+    is_compressed: bool
+    frames: list[FrameRecord]
+    keyframes: list[int]
+    """Indices of the keyframes in `frames`, in increasing order"""
+
+    width: int = dataclasses.field(init=False, default=0)
+    height: int = dataclasses.field(init=False, default=0)
+    pixels: array.array[int] = dataclasses.field(
+        init=False,
+        default_factory=lambda: array.array("I"),
+    )
+    """Packed pixels of the current frame"""
+    position: int = dataclasses.field(init=False, default=-1)
+    """Index of the current frame, -1 before the first one"""
+
+    @classmethod
+    def open(cls, path: str) -> typing.Self:
+        """
+        Constructor indexing the frames of the recording at `path`.
+
+        Raises a `ValueError` if the file is not a valid recording.
+        """
+
+        file = open(path, "rb")
+
+        try:
+            header = file.read(FILE_HEADER.size)
+
+            if len(header) < FILE_HEADER.size:
+                raise ValueError("not a Babble recording: the file is too short")
+
+            magic, version, flags = FILE_HEADER.unpack(header)
+
+            if magic != MAGIC:
+                raise ValueError("not a Babble recording")
+
+            if version != VERSION:
+                raise ValueError(f"unsupported recording version: {version}")
+
+            frames: list[FrameRecord] = []
+            keyframes: list[int] = []
+            file_size = os.fstat(file.fileno()).st_size
+            offset = file.tell() + RECORD_HEADER.size
+
+            # Only the headers are read, the payloads are skipped over. A
+            # recording interrupted while writing a record ends with a partial
+            # one, which is ignored
+            while offset <= file_size:
+                record = file.read(RECORD_HEADER.size)
+                kind, timestamp, width, height, size = RECORD_HEADER.unpack(record)
+
+                if offset + size > file_size:
+                    break
+
+                if kind == KEYFRAME:
+                    keyframes.append(len(frames))
+                elif kind != DELTA:
+                    raise ValueError("the recording is corrupted")
+                elif not keyframes:
+                    raise ValueError("the recording does not start with a keyframe")
+
+                frames.append(FrameRecord(kind, timestamp, width, height, offset, size))
+                offset = file.seek(size, os.SEEK_CUR) + RECORD_HEADER.size
+
+            if not frames:
+                raise ValueError("the recording is empty")
+        except BaseException:
+            file.close()
+            raise
+
+        return cls(file, bool(flags & COMPRESSED_FLAG), frames, keyframes)
+
+    def __enter__(self) -> typing.Self:
+        return self
+
+    def __exit__(self, *_) -> None:
+        self.close()
+
+    def __len__(self) -> int:
+        return len(self.frames)
+
+    def close(self) -> None:
+        self.file.close()
+
+    @property
+    def duration(self) -> float:
+        return self.frames[-1].timestamp if self.frames else 0.0
+
+    def find_frame(self, timestamp: float) -> int:
+        """
+        Get the index of the last frame shown at `timestamp`.
+        """
+
+        index = bisect.bisect_right(
+            self.frames,
+            timestamp,
+            key=lambda frame: frame.timestamp,
+        )
+
+        return max(0, index - 1)
+
+    def read_payload(self, frame: FrameRecord) -> bytes:
+        self.file.seek(frame.offset)
+        payload = self.file.read(frame.size)
+
+        return zlib.decompress(payload) if self.is_compressed else payload
+
+    def seek(self, index: int) -> set[int] | None:
+        """
+        Make the frame at `index` the current one.
+
+        Return the indices of the pixels that changed, or `None` if all of them
+        might have.
+        """
+
+        index = min(max(0, index), len(self.frames) - 1)
+        keyframe = self.keyframes[bisect.bisect_right(self.keyframes, index) - 1]
+
+        if index == self.position:
+            return set()
+
+        if keyframe <= self.position < index:
+            # Going forward: the deltas since the current frame are enough
+            start = self.position + 1
+            changed: set[int] | None = set()
+        else:
+            start = keyframe
+            changed = None
+
+        for position in range(start, index + 1):
+            frame = self.frames[position]
+            payload = self.read_payload(frame)
+
+            if frame.kind == KEYFRAME:
+                self.pixels = from_little_endian(payload)
+                self.width, self.height = frame.width, frame.height
+                changed = None
+            else:
+                indices, colors = decode_delta(payload)
+
+                for pixel_index, color in zip(indices, colors):
+                    self.pixels[pixel_index] = color
+
+                if changed is not None:
+                    changed.update(indices)
+
+        self.position = index
+
+        return changed
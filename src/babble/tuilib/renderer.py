@@ -1,165 +1,617 @@
 from __future__ import annotations
 
+import array
+import bisect
 import collections.abc
 import dataclasses
 import typing
 
+from babble.tuilib.colors import ColorDepth
+from babble.tuilib.colors import ColorQuantizer
+from babble.tuilib.encoder import OutputEncoder
+from babble.tuilib.layout import Rect
+from babble.tuilib.profiling import FrameProfiler
 from babble.tuilib.window import Coordinates
-from babble.tuilib.window import EMPTY_PIXEL
-from babble.tuilib.window import RGBColor
+from babble.tuilib.window import EMPTY_PACKED
 from babble.tuilib.window import Window
 
-_T = typing.TypeVar("_T")
-_U = typing.TypeVar("_U")
 
+Geometry: typing.TypeAlias = tuple[typing.Hashable, ...]
+"""Positions, bounds and order of the layers, to tell when they changed"""
 
-PipelineResult: typing.TypeAlias = tuple[Coordinates, _T]
-PipelineFunction: typing.TypeAlias = collections.abc.Callable[
-    [Coordinates, _T, int, int],
-    PipelineResult[_U],
-]
+CellMode: typing.TypeAlias = typing.Literal["full", "half"]
+"""
+How many pixels a terminal cell shows: one with `"full"`, or two stacked
+vertically with `"half"`.
+"""
 
-_EMPTY_PIXEL_RENDERING = "\x1b[49m "
 
+@dataclasses.dataclass(slots=True, eq=False)
+class Layer:
+    """
+    Window placed in the Context by the renderer.
+
+    Layers are compared by identity.
+    """
+
+    window: Window
+    position: Coordinates
+    """Position of the top-left pixel of the window in the Context"""
+    z: int = 0
+    """Layers with a greater `z` are drawn over the others"""
+    clip: Rect | None = None
+    """Part of the Context the window is restricted to, in pixels"""
+    is_opaque: bool = False
+    """
+    Whether the empty pixels of the window hide the layers below instead of
+    showing them, in which case the parts it covers are never rendered.
+    """
+
+    @property
+    def bounds(self) -> Rect:
+        """
+        Part of the Context where the window can be seen.
+        """
+
+        rect = Rect(*self.position, self.window.width, self.window.height)
 
-class RenderingPipeline(typing.Generic[_T], typing.NamedTuple):
+        return rect if self.clip is None else rect.intersection(self.clip)
+
+
+class PixelStage(typing.Protocol):
     """
-    A pipeline to make the rendering cleaner.
+    Transformation of the composited pixels of the Context, applied before
+    they are quantized and encoded.
     """
 
-    coordinates: Coordinates
-    data: _T
-    width: int
-    height: int
+    def map_row(self, row: list[int], y: int) -> None:
+        """
+        Transform the packed pixels of the row `y` in place.
+        """
 
-    def apply(self, function: PipelineFunction[_T, _U]) -> RenderingPipeline[_U]:
+    def map_pixel(self, pixel: int, x: int, y: int) -> int:
         """
-        Apply a pipeline function to the wrapped values.
+        Transform the packed pixel (`x`, `y`).
         """
 
-        return RenderingPipeline(*function(*self), self.width, self.height)
 
-    def __rshift__(self, function: PipelineFunction[_T, _U]) -> RenderingPipeline[_U]:
-        return self.apply(function)
+@dataclasses.dataclass(slots=True, frozen=True)
+class PixelMap:
+    """
+    Stage applying a function to the packed colors of the pixels which are not
+    empty, wherever they are.
+
+    Consecutive maps are fused into a single one, so that a row is only gone
+    through once.
+    """
+
+    function: collections.abc.Callable[[int], int]
+
+    def map_row(self, row: list[int], y: int) -> None:
+        function = self.function
+        row[:] = [
+            pixel if pixel == EMPTY_PACKED else function(pixel) for pixel in row
+        ]
+
+    def map_pixel(self, pixel: int, x: int, y: int) -> int:
+        return pixel if pixel == EMPTY_PACKED else self.function(pixel)
+
+    def then(self, other: PixelMap) -> PixelMap:
+        """
+        Get the map applying this one, then `other`.
+        """
+
+        first, second = self.function, other.function
+
+        def fused(pixel: int) -> int:
+            pixel = first(pixel)
+
+            return pixel if pixel == EMPTY_PACKED else second(pixel)
+
+        return PixelMap(fused)
+
+
+def fuse_stages(stages: collections.abc.Iterable[PixelStage]) -> list[PixelStage]:
+    """
+    Fuse the consecutive stages which can be.
+    """
+
+    fused: list[PixelStage] = []
+
+    for stage in stages:
+        if fused and isinstance(stage, PixelMap) and isinstance(fused[-1], PixelMap):
+            fused[-1] = fused[-1].then(stage)
+        else:
+            fused.append(stage)
+
+    return fused
+
+
+class Span(typing.NamedTuple):
+    """
+    Run of pixels of a row of the Context showing the same layers.
+    """
+
+    start: int
+    stop: int
+    layers: tuple[Layer, ...]
+    """
+    Layers covering the run from top to bottom, down to the first opaque one:
+    those below it are culled.
+    """
 
 
 @dataclasses.dataclass(slots=True)
 class WindowRenderer:
     """
     Engine that renders the Context windows.
+
+    The windows are composited by layer: each pixel of the Context shows the
+    topmost layer which is not empty there. The Context is split into spans
+    of pixels covered by the same layers, so that the pixels hidden behind an
+    opaque layer or outside of every layer are never looked at.
     """
 
-    windows: dict[Coordinates, Window] = dataclasses.field(default_factory=dict)
+    layers: list[Layer] = dataclasses.field(default_factory=list)
+    """Layers in the order they were registered in"""
+    use_rep: bool = False
+    """Whether the terminal supports the `REP` sequence"""
+    cell_mode: CellMode = "full"
+    color_depth: ColorDepth = "truecolor"
+    dither: bool = False
+    """Whether the colors are dithered when the color depth is reduced"""
+    profiler: FrameProfiler = dataclasses.field(default_factory=FrameProfiler)
+    stages: list[PixelStage] = dataclasses.field(default_factory=list)
+    """Transformations of the composited pixels, in the order they are applied"""
+
+    is_invalidated: bool = dataclasses.field(init=False, default=True)
+    """Whether the terminal content can no longer be trusted (e.g. cleared)"""
+
+    quantizer: ColorQuantizer | None = dataclasses.field(init=False, default=None)
+
+    spans: list[list[Span]] = dataclasses.field(init=False, default_factory=list)
+    """Spans of each pixel row of the Context, shared by identical rows"""
+    spans_key: Geometry | None = dataclasses.field(init=False, default=None)
+    """Geometry of the layers and size of the Context the spans were made for"""
+    rendered_geometry: Geometry | None = dataclasses.field(init=False, default=None)
+    """Geometry of the layers when the damage was last cleared"""
+    empty_row: list[int] = dataclasses.field(init=False, default_factory=list)
+    row_buffers: tuple[list[int], list[int]] = dataclasses.field(
+        init=False,
+        default_factory=lambda: ([], []),
+    )
+    """Rows the pixels are written into, reused from one frame to the next"""
+
+    def __post_init__(self) -> None:
+        if self.color_depth != "truecolor":
+            self.quantizer = ColorQuantizer(self.color_depth, self.dither)
+
+    @property
+    def rows_per_cell(self) -> int:
+        """
+        Number of pixel rows shown by a row of terminal cells.
+        """
+
+        return 2 if self.cell_mode == "half" else 1
+
+    def new_encoder(self) -> OutputEncoder:
+        """
+        Create an encoder using the color depth of the renderer.
+        """
+
+        if self.quantizer is None:
+            return OutputEncoder(self.use_rep)
+
+        return OutputEncoder(
+            self.use_rep,
+            self.quantizer.background_sequence,
+            self.quantizer.foreground_sequence,
+        )
+
+    def invalidate(self) -> None:
+        """
+        Request the next rendering to be a full repaint.
+        """
+
+        self.is_invalidated = True
+
+    def geometry(self) -> Geometry:
+        return tuple(
+            (id(layer), layer.position, layer.bounds, layer.z, layer.is_opaque)
+            for layer in self.layers
+        )
 
-    def render(self, width: int, height: int) -> str:
+    def needs_full_repaint(self) -> bool:
+        """
+        Return `True` if rendering only the damaged cells is not enough to
+        bring the terminal up to date, else `False`.
+        """
+
+        return (
+            self.is_invalidated
+            or any(layer.window.is_fully_damaged for layer in self.layers)
+            or self.geometry() != self.rendered_geometry
+        )
+
+    def clear_damage(self) -> None:
+        """
+        Acknowledge that the current state of the windows has been rendered.
+        """
+
+        self.is_invalidated = False
+        self.rendered_geometry = self.geometry()
+
+        for layer in self.layers:
+            layer.window.clear_damage()
+
+    def get_spans(self, width: int, pixel_height: int) -> list[list[Span]]:
+        """
+        Get the spans of each pixel row of a Context of `width` ×
+        `pixel_height` pixels.
+
+        They are only computed again when the layers move, change size or
+        order, or when the Context is resized.
+        """
+
+        key = (*self.geometry(), (width, pixel_height))
+
+        if key != self.spans_key:
+            with self.profiler.phase("spans"):
+                self.spans = compute_spans(self.layers, width, pixel_height)
+                self.spans_key = key
+
+        return self.spans
+
+    def open_sources(self) -> dict[Layer, collections.abc.Sequence[int]]:
+        """
+        Get the packed pixels of the window of each layer, as views on the
+        packed storage so that slicing them does not copy anything.
+
+        The views must be released with `close_sources()`.
+        """
+
+        sources: dict[Layer, collections.abc.Sequence[int]] = {}
+
+        for layer in self.layers:
+            data = layer.window.packed()
+
+            # Packing is a copy with the list storage, which is used as is
+            if isinstance(data, (array.array, memoryview)):
+                data = typing.cast("collections.abc.Sequence[int]", memoryview(data))
+
+            sources[layer] = data
+
+        return sources
+
+    @staticmethod
+    def close_sources(sources: dict[Layer, collections.abc.Sequence[int]]) -> None:
+        for data in sources.values():
+            if isinstance(data, memoryview):
+                data.release()
+
+    def fill_row(
+        self,
+        row: list[int],
+        y: int,
+        row_spans: collections.abc.Sequence[Span],
+        sources: dict[Layer, collections.abc.Sequence[int]],
+    ) -> None:
+        """
+        Write the packed pixels of the row `y` of the Context, as seen through
+        the layers, into `row`.
+
+        A span covered by a single layer is copied from its window at once.
+        The pixels outside of every span are empty.
+        """
+
+        row[:] = self.empty_row
+
+        for start, stop, layers in row_spans:
+            if len(layers) == 1:
+                (layer,) = layers
+                offset = (y - layer.position.y) * layer.window.width
+                offset -= layer.position.x
+                row[start:stop] = sources[layer][offset + start : offset + stop]
+
+                continue
+
+            # The layers are painted from the bottom one, the empty pixels of
+            # the transparent ones letting the others through
+            for layer in reversed(layers):
+                offset = (y - layer.position.y) * layer.window.width
+                offset -= layer.position.x
+                pixels = sources[layer][offset + start : offset + stop]
+
+                if layer.is_opaque:
+                    row[start:stop] = pixels
+                else:
+                    for x, pixel in enumerate(pixels, start):
+                        if pixel != EMPTY_PACKED:
+                            row[x] = pixel
+
+    def iter_rows(
+        self,
+        width: int,
+        pixel_height: int,
+    ) -> collections.abc.Iterator[list[int]]:
+        """
+        Get the pixels of each row of the Context as given to the encoder:
+        composited, transformed by the stages, then quantized if the color
+        depth is reduced.
+
+        This is a single pass over the windows. The rows are written into two
+        buffers used in turn, so a row is only valid until the next one but
+        one is requested.
+        """
+
+        spans = self.get_spans(width, pixel_height)
+        stages = fuse_stages(self.stages)
+        quantize_row = None if self.quantizer is None else self.quantizer.quantize_row
+
+        if len(self.empty_row) != width:
+            self.empty_row = [EMPTY_PACKED] * width
+            self.row_buffers = ([], [])
+
+        sources = self.open_sources()
+
+        try:
+            for y, row_spans in enumerate(spans):
+                row = self.row_buffers[y & 1]
+                self.fill_row(row, y, row_spans, sources)
+
+                for stage in stages:
+                    stage.map_row(row, y)
+
+                if quantize_row is not None:
+                    row[:] = quantize_row(row, y)
+
+                yield row
+        finally:
+            self.close_sources(sources)
+
+    def compose(self, width: int, pixel_height: int) -> list[list[int]]:
+        """
+        Get the pixels of the Context as given to the encoder, row by row.
+        """
+
+        return [row.copy() for row in self.iter_rows(width, pixel_height)]
+
+    def render(self, width: int, height: int, origin: Coordinates) -> str:
         """
         Render registered windows into a printable string.
+
+        `width` and `height` are the size of the Context in terminal cells.
+        The rows are positioned using cursor movements, `origin` being the
+        (0-based) terminal position of the Context.
+        """
+
+        encoder = self.new_encoder()
+        rows = self.iter_rows(width, height * self.rows_per_cell)
+
+        with self.profiler.phase("render"):
+            # The rows go straight from the windows to the encoder
+            for y, row in enumerate(rows):
+                if self.cell_mode == "half":
+                    if y & 1:
+                        encoder.move_to(origin.x, origin.y + y // 2)
+                        encoder.write_half_row(self.row_buffers[0], row)
+                else:
+                    encoder.move_to(origin.x, origin.y + y)
+                    encoder.write_row(row)
+
+        with self.profiler.phase("join"):
+            return encoder.getvalue()
+
+    def render_damage(self, width: int, height: int, origin: Coordinates) -> str:
+        """
+        Render the cells that changed since the damage was last cleared into a
+        printable string.
+
+        The changes hidden by an opaque layer are skipped. Like `render()`, the
+        cells are positioned using cursor movements.
+        """
+
+        rows_per_cell = self.rows_per_cell
+        pixel_height = height * rows_per_cell
+        spans = self.get_spans(width, pixel_height)
+        cells: set[Coordinates] = set()
+
+        for layer in self.layers:
+            window = layer.window
+            bounds = layer.bounds
+
+            for index in window.damage:
+                y, x = divmod(index, window.width)
+                x += layer.position.x
+                y += layer.position.y
+
+                if not (
+                    bounds.x <= x < min(width, bounds.right)
+                    and bounds.y <= y < min(pixel_height, bounds.bottom)
+                ):
+                    continue
+
+                span = find_span(spans[y], x)
+
+                if span is not None and layer in span.layers:
+                    cells.add(Coordinates(x, y // rows_per_cell))
+
+        encoder = self.new_encoder()
+        previous: Coordinates | None = None
+
+        with self.profiler.phase("render"):
+            # Sorting by row then column allows to skip the cursor movement
+            # for contiguous cells, since printing one already moves the cursor
+            for cell in sorted(cells, key=lambda cell: (cell.y, cell.x)):
+                if previous is None or previous != (cell.x - 1, cell.y):
+                    encoder.move_to(origin.x + cell.x, origin.y + cell.y)
+
+                if rows_per_cell == 2:
+                    encoder.write_half_cell(
+                        self.get_visible_color(Coordinates(cell.x, 2 * cell.y)),
+                        self.get_visible_color(Coordinates(cell.x, 2 * cell.y + 1)),
+                    )
+                else:
+                    encoder.write_cells(self.get_visible_color(cell))
+
+                previous = cell
+
+        with self.profiler.phase("join"):
+            return encoder.getvalue()
+
+    def get_composited_pixel(self, cell: Coordinates) -> int:
         """
+        Get the packed pixel visible at the pixel `cell` of the Context, that
+        is, the one of the topmost layer that is not empty there, unless an
+        opaque layer is above it.
 
-        grid = [[_EMPTY_PIXEL_RENDERING for _ in range(width)] for _ in range(height)]
+        The spans must be up to date.
+        """
 
-        for coordinates, window in self.windows.items():
-            pipeline = (
-                RenderingPipeline(coordinates, list(window.rows()), width, height)
-                >> truncate
-                >> resize
-                >> render
+        if not 0 <= cell.y < len(self.spans):
+            return EMPTY_PACKED
+
+        span = find_span(self.spans[cell.y], cell.x)
+
+        for layer in () if span is None else span.layers:
+            pixel = layer.window.get_packed(
+                Coordinates(cell.x - layer.position.x, cell.y - layer.position.y),
             )
 
-            for y, row in enumerate(pipeline.data):
-                for x, pixel in enumerate(row):
-                    if pixel != _EMPTY_PIXEL_RENDERING:
-                        grid[y][x] = pixel
+            if pixel is not None and (pixel != EMPTY_PACKED or layer.is_opaque):
+                return pixel
 
-        return "\x1b[49m\n".join("".join(row) for row in grid)
+        return EMPTY_PACKED
 
-    def register(self, coordinates: Coordinates, window: Window) -> None:
+    def get_visible_color(self, cell: Coordinates) -> int:
         """
-        Register the `window` at the `coordinates`.
+        Get the color of the pixel `cell` of the Context as given to the
+        encoder: packed and transformed by the stages, then quantized if the
+        color depth is reduced.
         """
 
-        self.windows[coordinates] = window
+        pixel = self.get_composited_pixel(cell)
 
+        for stage in self.stages:
+            pixel = stage.map_pixel(pixel, cell.x, cell.y)
 
-def truncate(
-    coordinates: Coordinates,
-    data: list[list[RGBColor]],
-    width: int,
-    height: int,
-) -> PipelineResult[list[list[RGBColor]]]:
-    """
-    Truncate the pixels of a window's grid that are outside of the Context
-    viewport ; for example, if the window's coordinates are negative, or
-    bigger than the Context size.
-    """
+        if self.quantizer is None:
+            return pixel
+
+        return self.quantizer.quantize(pixel, cell.x, cell.y)
+
+    def register(
+        self,
+        coordinates: Coordinates,
+        window: Window,
+        z: int | None = None,
+        clip: Rect | None = None,
+        is_opaque: bool = False,
+    ) -> Layer:
+        """
+        Register the `window` at the `coordinates`, above the other windows
+        unless `z` is given.
+        """
 
-    new_x = min(width, max(0, coordinates.x))
-    new_y = min(height, max(0, coordinates.y))
-    new_coordinates = Coordinates(new_x, new_y)
+        if z is None:
+            z = max((layer.z + 1 for layer in self.layers), default=0)
 
-    result: list[list[RGBColor]] = []
+        layer = Layer(window, coordinates, z, clip, is_opaque)
+        self.layers.append(layer)
 
-    for row in data[abs(min(0, new_y)) : min(height, new_y + len(data))]:
-        result.append(row[abs(min(0, new_x)) : new_x + len(row)])
+        return layer
 
-    return new_coordinates, result
+    def unregister(self, window: Window) -> None:
+        """
+        Remove the layers of `window`.
+        """
 
+        self.layers = [layer for layer in self.layers if layer.window is not window]
 
-def resize(
-    coordinates: Coordinates,
-    data: list[list[RGBColor]],
+
+def compute_spans(
+    layers: collections.abc.Iterable[Layer],
     width: int,
     height: int,
-) -> PipelineResult[list[list[RGBColor]]]:
+) -> list[list[Span]]:
     """
-    Resize a window's grid to fit the whole Context by adding empty pixels.
+    Split each row of a Context of size `width` × `height` into the spans of
+    pixels covered by the same `layers`.
+
+    The rows between two horizontal edges of layers have the same spans, so
+    they are computed once for all of them.
     """
 
-    result = [[EMPTY_PIXEL for _ in range(width)] for _ in range(coordinates.y)]
+    viewport = Rect(0, 0, width, height)
+    # Sorting is stable, so the layers registered last are above on a tie
+    visible = [
+        (layer, bounds)
+        for layer in sorted(layers, key=lambda layer: layer.z, reverse=True)
+        if not (bounds := layer.bounds.intersection(viewport)).is_empty
+    ]
+    y_edges = sorted(
+        {0, height, *(bounds.y for _, bounds in visible)}
+        | {bounds.bottom for _, bounds in visible},
+    )
+    rows: list[list[Span]] = []
 
-    for row in data:
-        right_padding = width - (coordinates.x + len(row))
+    for top, bottom in zip(y_edges, y_edges[1:]):
+        active = [
+            (layer, bounds)
+            for layer, bounds in visible
+            if bounds.y <= top < bounds.bottom
+        ]
+        rows.extend([compute_row_spans(active, width)] * (bottom - top))
 
-        padded_row: list[RGBColor] = []
+    return rows
 
-        for _ in range(coordinates.x):
-            padded_row.append(EMPTY_PIXEL)
 
-        padded_row.extend(row)
+def compute_row_spans(
+    active: collections.abc.Sequence[tuple[Layer, Rect]],
+    width: int,
+) -> list[Span]:
+    """
+    Split a row into the spans of pixels covered by the same layers, given the
+    `active` layers of the row and their bounds, from top to bottom.
+    """
 
-        for _ in range(right_padding):
-            padded_row.append(EMPTY_PIXEL)
+    x_edges = sorted(
+        {0, width, *(bounds.x for _, bounds in active)}
+        | {bounds.right for _, bounds in active},
+    )
+    spans: list[Span] = []
 
-        result.append(padded_row)
+    for start, stop in zip(x_edges, x_edges[1:]):
+        covering: list[Layer] = []
 
-    result.extend(
-        [EMPTY_PIXEL for _ in range(width)]
-        for _ in range(height - (coordinates.y + len(data)))
-    )
+        for layer, bounds in active:
+            if bounds.x <= start < bounds.right:
+                covering.append(layer)
 
-    return coordinates, result
+                if layer.is_opaque:
+                    break
 
+        if not covering:
+            continue
 
-def render_pixel(pixel: RGBColor) -> str:
-    """
-    Render a specific pixel into a background-colored terminal cell.
-    """
+        layers = tuple(covering)
 
-    return (
-        _EMPTY_PIXEL_RENDERING
-        if pixel == EMPTY_PIXEL
-        else "\x1b[48;2;{};{};{}m ".format(*pixel)
-    )
+        if spans and spans[-1].stop == start and spans[-1].layers == layers:
+            spans[-1] = Span(spans[-1].start, stop, layers)
+        else:
+            spans.append(Span(start, stop, layers))
 
+    return spans
 
-def render(
-    coordinates: Coordinates,
-    data: list[list[RGBColor]],
-    width: int,
-    height: int,
-) -> PipelineResult[list[list[str]]]:
+
+def find_span(spans: collections.abc.Sequence[Span], x: int) -> Span | None:
     """
-    Render a window's data into a grid of background-colored termianl cells.
+    Get the span of a row containing the pixel `x`, if there is one.
     """
 
-    return coordinates, [[render_pixel(pixel) for pixel in row] for row in data]
+    index = bisect.bisect_right(spans, x, key=lambda span: span.start) - 1
+
+    if index >= 0 and x < spans[index].stop:
+        return spans[index]
+
+    return None
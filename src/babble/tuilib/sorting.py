@@ -0,0 +1,303 @@
+# pyright: reportMissingImports = false
+"""
+Sorting of the pixels of a window.
+
+Each color is given an integer key once, and the pixels are ordered by key:
+
+- with numpy, through an LSD radix sort over the keys of all the pixels, in
+  linear time ;
+- without it, by counting the pixels of each color (in linear time), then
+  ordering the distinct colors only, which are usually much fewer.
+"""
+from __future__ import annotations
+
+import array
+import collections
+import collections.abc
+import colorsys
+import typing
+
+try:
+    import numpy
+except ImportError:  # numpy is an optional dependency
+    numpy = None
+
+if typing.TYPE_CHECKING:
+    import numpy.typing
+
+    Array: typing.TypeAlias = numpy.typing.NDArray[typing.Any]
+
+
+SortKey: typing.TypeAlias = typing.Literal["rgb", "luminance", "hue", "hilbert"]
+
+RADIX_BITS = 16
+"""Size of the digits of the radix sort ; numpy sorts them in linear time"""
+
+
+def rgb_key(value: int) -> int:
+    """
+    Lexicographic order of the red, green and blue channels.
+    """
+
+    return value
+
+
+def luminance_key(value: int) -> int:
+    """
+    Order by perceived brightness (ITU-R BT.601 weights).
+    """
+
+    red, green, blue = value >> 16, (value >> 8) & 0xFF, value & 0xFF
+
+    # The color itself breaks the ties, so that the order is total
+    return (299 * red + 587 * green + 114 * blue) << 24 | value
+
+
+def hue_key(value: int) -> int:
+    """
+    Order by hue, then by brightness and saturation.
+    """
+
+    hue, saturation, brightness = colorsys.rgb_to_hsv(
+        (value >> 16) / 255,
+        ((value >> 8) & 0xFF) / 255,
+        (value & 0xFF) / 255,
+    )
+    key = int(hue * 4095) << 16 | int(brightness * 255) << 8 | int(saturation * 255)
+
+    return key << 24 | value
+
+
+def hilbert_key(value: int) -> int:
+    """
+    Order along a 3D Hilbert curve going through the RGB cube, which keeps
+    close colors close to each other.
+    """
+
+    # Skilling's transform, from "Programming the Hilbert curve" (2004)
+    axes = [value >> 16, (value >> 8) & 0xFF, value & 0xFF]
+    bit = 1 << 7
+
+    while bit > 1:
+        mask = bit - 1
+
+        for i in range(3):
+            if axes[i] & bit:
+                axes[0] ^= mask
+            else:
+                swap = (axes[0] ^ axes[i]) & mask
+                axes[0] ^= swap
+                axes[i] ^= swap
+
+        bit >>= 1
+
+    for i in range(1, 3):
+        axes[i] ^= axes[i - 1]
+
+    gray = 0
+    bit = 1 << 7
+
+    while bit > 1:
+        if axes[2] & bit:
+            gray ^= bit - 1
+
+        bit >>= 1
+
+    key = 0
+
+    for shift in range(7, -1, -1):
+        for axis in axes:
+            key = key << 1 | ((axis ^ gray) >> shift) & 1
+
+    return key
+
+
+def vectorized_rgb_key(values: Array) -> Array:
+    assert numpy is not None
+
+    return values.astype(numpy.uint64)
+
+
+def vectorized_luminance_key(values: Array) -> Array:
+    assert numpy is not None
+
+    values = values.astype(numpy.uint64)
+    luminance = (
+        299 * (values >> 16) + 587 * ((values >> 8) & 0xFF) + 114 * (values & 0xFF)
+    )
+
+    return luminance << 24 | values
+
+
+def vectorized_hue_key(values: Array) -> Array:
+    assert numpy is not None
+
+    # Same computations as `colorsys.rgb_to_hsv()`, so that the keys are equal
+    red = (values >> 16) / 255
+    green = ((values >> 8) & 0xFF) / 255
+    blue = (values & 0xFF) / 255
+    highest = numpy.maximum(numpy.maximum(red, green), blue)
+    lowest = numpy.minimum(numpy.minimum(red, green), blue)
+    spread = highest - lowest
+    is_gray = spread == 0
+
+    with numpy.errstate(divide="ignore", invalid="ignore"):
+        saturation = numpy.where(is_gray, 0.0, spread / highest)
+        red_distance = (highest - red) / spread
+        green_distance = (highest - green) / spread
+        blue_distance = (highest - blue) / spread
+
+    hue = numpy.where(
+        red == highest,
+        blue_distance - green_distance,
+        numpy.where(
+            green == highest,
+            2.0 + red_distance - blue_distance,
+            4.0 + green_distance - red_distance,
+        ),
+    )
+    hue = numpy.where(is_gray, 0.0, (hue / 6.0) % 1.0)
+
+    key = (hue * 4095).astype(numpy.uint64) << 16
+    key |= (highest * 255).astype(numpy.uint64) << 8
+    key |= (saturation * 255).astype(numpy.uint64)
+
+    return key << 24 | values.astype(numpy.uint64)
+
+
+def vectorized_hilbert_key(values: Array) -> Array:
+    assert numpy is not None
+
+    values = values.astype(numpy.uint64)
+    axes = [values >> 16, (values >> 8) & 0xFF, values & 0xFF]
+    bit = 1 << 7
+
+    while bit > 1:
+        mask = bit - 1
+
+        for i in range(3):
+            is_set = (axes[i] & bit) != 0
+            swap = numpy.where(is_set, 0, (axes[0] ^ axes[i]) & mask)
+            axes[0] = numpy.where(is_set, axes[0] ^ mask, axes[0] ^ swap)
+
+            if i:
+                axes[i] = axes[i] ^ swap
+
+        bit >>= 1
+
+    for i in range(1, 3):
+        axes[i] = axes[i] ^ axes[i - 1]
+
+    gray = numpy.zeros_like(values)
+    bit = 1 << 7
+
+    while bit > 1:
+        gray ^= numpy.where((axes[2] & bit) != 0, bit - 1, 0).astype(numpy.uint64)
+        bit >>= 1
+
+    key = numpy.zeros_like(values)
+
+    for shift in range(7, -1, -1):
+        for axis in axes:
+            key = key << 1 | ((axis ^ gray) >> shift) & 1
+
+    return key
+
+
+SORT_KEYS: dict[SortKey, collections.abc.Callable[[int], int]] = {
+    "rgb": rgb_key,
+    "luminance": luminance_key,
+    "hue": hue_key,
+    "hilbert": hilbert_key,
+}
+
+VECTORIZED_SORT_KEYS: dict[SortKey, collections.abc.Callable[[Array], Array]] = {
+    "rgb": vectorized_rgb_key,
+    "luminance": vectorized_luminance_key,
+    "hue": vectorized_hue_key,
+    "hilbert": vectorized_hilbert_key,
+}
+
+
+def sort_packed(
+    data: collections.abc.Sequence[int],
+    key: SortKey,
+    empty: int,
+) -> array.array[int]:
+    """
+    Get the packed colors of `data` sorted by `key`, the `empty` pixels last.
+    """
+
+    steps = iter_sort_packed(data, key, empty, max(1, len(data)))
+
+    while True:
+        try:
+            next(steps)
+        except StopIteration as stop:
+            return stop.value
+
+
+def iter_sort_packed(
+    data: collections.abc.Sequence[int],
+    key: SortKey,
+    empty: int,
+    chunk: int,
+) -> collections.abc.Generator[None, None, array.array[int]]:
+    """
+    Time-sliced version of `sort_packed()`, yielding after each pass and after
+    each `chunk` of pixels. The sorted colors are returned at the end.
+    """
+
+    size = len(data)
+
+    if numpy is not None:
+        values = numpy.asarray(data, dtype=numpy.uint32)
+        keys = numpy.empty(size, dtype=numpy.uint64)
+        key_function = VECTORIZED_SORT_KEYS[key]
+
+        for start in range(0, size, chunk):
+            keys[start : start + chunk] = key_function(values[start : start + chunk])
+            yield
+
+        keys[values == empty] = numpy.iinfo(numpy.uint64).max
+        order = numpy.arange(size)
+
+        for shift in range(0, 64, RADIX_BITS):
+            digits = (keys[order] >> shift) & ((1 << RADIX_BITS) - 1)
+            # A stable sort of 16-bit integers is a radix sort in numpy
+            order = order[numpy.argsort(digits.astype(numpy.uint16), kind="stable")]
+            yield
+
+        return array.array("I", values[order].tobytes())
+
+    counts: collections.Counter[int] = collections.Counter()
+
+    for start in range(0, size, chunk):
+        counts.update(data[start : start + chunk])
+        yield
+
+    empty_count = counts.pop(empty, 0)
+    colors = list(counts)
+    color_keys: dict[int, int] = {}
+    scalar_key_function = SORT_KEYS[key]
+
+    for start in range(0, len(colors), chunk):
+        for color in colors[start : start + chunk]:
+            color_keys[color] = scalar_key_function(color)
+
+        yield
+
+    result = array.array("I")
+    written = 0
+
+    for color in sorted(colors, key=color_keys.__getitem__):
+        result.extend(array.array("I", [color]) * counts[color])
+        written += counts[color]
+
+        if written >= chunk:
+            written = 0
+            yield
+
+    result.extend(array.array("I", [empty]) * empty_count)
+
+    return result
@@ -1,5 +1,6 @@
 # pyright: reportMissingTypeStubs = false, reportUnusedCallResult = false
 import collections.abc
+import curses
 import io
 import sys
 import typing
@@ -12,6 +13,7 @@ _T = typing.TypeVar("_T")
 
 
 UPPER_LIMIT_PIXELS_PER_STEP = 50_000
+UPPER_LIMIT_PIXELS_PER_STEP_VECTORIZED = 500_000
 
 
 def positive_int(raw_value: str) -> int:
@@ -27,6 +29,45 @@ def positive_int(raw_value: str) -> int:
     return value
 
 
+def positive_float(raw_value: str) -> float:
+    """
+    Refined float "type" for `argparse`.
+    """
+
+    value = float(raw_value)
+
+    if not value > 0:
+        raise ValueError("value must be strictly positive")
+
+    return value
+
+
+def fraction(raw_value: str) -> float:
+    """
+    Refined float "type" for `argparse`, between 0 and 1 (inclusive).
+    """
+
+    value = float(raw_value)
+
+    if not 0 <= value <= 1:
+        raise ValueError("value must be between 0 and 1")
+
+    return value
+
+
+def dimensions(raw_value: str) -> tuple[int, int]:
+    """
+    Refined "type" for `argparse` of a size in the form `WIDTHxHEIGHT`.
+    """
+
+    raw_width, separator, raw_height = raw_value.partition("x")
+
+    if not separator:
+        raise ValueError("size must be in the form WIDTHxHEIGHT")
+
+    return positive_int(raw_width), positive_int(raw_height)
+
+
 def offset_write(
     string: str,
     x: int,
@@ -51,6 +92,20 @@ def offset_write(
     _output.write(buffer.getvalue())
 
 
+def terminal_supports_rep() -> bool:
+    """
+    Check in the terminfo database if the terminal supports the `REP`
+    (repeat preceding character) sequence.
+    """
+
+    try:
+        curses.setupterm()
+    except curses.error:
+        return False
+
+    return curses.tigetstr("rep") is not None
+
+
 def all_indices(
     sequence: collections.abc.Sequence[_T],
     item: _T,
@@ -114,19 +169,33 @@ def keyhints_repr(**descriptions: str) -> str:
     )
 
 
-def should_warn_pps_performance(pixels_per_step: int) -> bool:
+def get_pps_upper_limit(vectorized: bool) -> int:
+    """
+    Get the recommended max pixels-per-step value, which is higher if the
+    themes are evaluated in a vectorized fashion.
+    """
+
+    if vectorized:
+        return UPPER_LIMIT_PIXELS_PER_STEP_VECTORIZED
+
+    return UPPER_LIMIT_PIXELS_PER_STEP
+
+
+def should_warn_pps_performance(pixels_per_step: int, vectorized: bool = False) -> bool:
     """
     Check if the user should be warned about potential performance impact of
     high pixels-per-step values.
     """
 
-    return pixels_per_step > UPPER_LIMIT_PIXELS_PER_STEP
+    return pixels_per_step > get_pps_upper_limit(vectorized)
+
 
+def emit_warning_pps_performance(pixels_per_step: int, vectorized: bool = False) -> None:
+    upper_limit = get_pps_upper_limit(vectorized)
 
-def emit_warning_pps_performance(pixels_per_step: int) -> None:
     print(
         f"\x1b[1;33mWARNING:\x1b[22;39m \x1b[1;96m{pixels_per_step:,}\x1b[22;39m is higher than the "
-        f"recommended max pixels-per-step value of \x1b[1;96m{UPPER_LIMIT_PIXELS_PER_STEP:,}\x1b[22;39m. "
+        f"recommended max pixels-per-step value of \x1b[1;96m{upper_limit:,}\x1b[22;39m. "
         "\x1b[33mIt might impact performance.\x1b[39m",
         file=sys.stderr,
     )
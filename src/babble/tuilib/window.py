@@ -1,23 +1,44 @@
+# pyright: reportMissingImports = false
+from __future__ import annotations
+
+import array
 import collections.abc
 import dataclasses
 import random
 import typing
 
+from babble.tuilib.sorting import iter_sort_packed
+from babble.tuilib.sorting import sort_packed
+from babble.tuilib.sorting import SortKey
+
+try:
+    import numpy
+except ImportError:  # numpy is an optional dependency
+    numpy = None
+
 
 class Coordinates(typing.NamedTuple):
     x: int
     y: int
 
     @classmethod
-    def random(cls, x_max: int, y_max: int) -> typing.Self:
+    def random(
+        cls,
+        x_max: int,
+        y_max: int,
+        generator: random.Random | None = None,
+    ) -> typing.Self:
         """
-        Constructor for random coordinates.
+        Constructor for random coordinates, drawn from `generator` if it is
+        provided, else from the global one.
 
-        The resulting `x` will be between 0 and `x_max`.
-        The resulting `y` will be between 0 and `y_max`.
+        The resulting `x` will be between 0 (inclusive) and `x_max` (exclusive).
+        The resulting `y` will be between 0 (inclusive) and `y_max` (exclusive).
         """
 
-        return cls(random.randint(0, x_max), random.randint(0, y_max))
+        randrange = (generator or random).randrange
+
+        return cls(randrange(x_max), randrange(y_max))
 
 
 class RGBColor(typing.NamedTuple):
@@ -26,15 +47,140 @@ class RGBColor(typing.NamedTuple):
     blue: int
 
     @classmethod
-    def random(cls) -> typing.Self:
+    def random(cls, generator: random.Random | None = None) -> typing.Self:
         """
-        Constructor for a random color.
+        Constructor for a random color, drawn from `generator` if it is
+        provided, else from the global one.
         """
 
-        return cls(*(random.randint(0, 255) for _ in range(3)))
+        # A single draw is much faster than one `randint()` per channel
+        value = (generator or random).getrandbits(24)
+
+        return cls(value >> 16, (value >> 8) & 0xFF, value & 0xFF)
 
 
 EMPTY_PIXEL = RGBColor(256, 256, 256)
+EMPTY_PACKED = 1 << 24
+"""Packed value of the empty pixel: the bit right above the 24 color bits"""
+
+PixelStorage: typing.TypeAlias = typing.Literal["list", "packed"]
+
+
+def pack(color: RGBColor) -> int:
+    """
+    Pack a color into a single `0xRRGGBB` integer.
+    """
+
+    if color == EMPTY_PIXEL:
+        return EMPTY_PACKED
+
+    return (color.red << 16) | (color.green << 8) | color.blue
+
+
+def unpack(value: int) -> RGBColor:
+    """
+    Unpack a `0xRRGGBB` integer into a color.
+    """
+
+    if value == EMPTY_PACKED:
+        return EMPTY_PIXEL
+
+    return RGBColor(value >> 16, (value >> 8) & 0xFF, value & 0xFF)
+
+
+class PackedPixels(collections.abc.MutableSequence[RGBColor]):
+    """
+    Pixel storage backed by a contiguous buffer of packed colors.
+
+    It behaves like a `list[RGBColor]`, but uses 4 bytes per pixel.
+    """
+
+    __slots__ = ("data",)
+
+    def __init__(self, data: array.array[int]) -> None:
+        self.data = data
+
+    @classmethod
+    def empty(cls, size: int) -> typing.Self:
+        """
+        Constructor for `size` empty pixels.
+        """
+
+        return cls(array.array("I", [EMPTY_PACKED]) * size)
+
+    def __len__(self) -> int:
+        return len(self.data)
+
+    def __iter__(self) -> collections.abc.Iterator[RGBColor]:
+        return map(unpack, self.data)
+
+    def __contains__(self, value: object) -> bool:
+        if not isinstance(value, RGBColor):
+            return False
+
+        return pack(value) in self.data
+
+    @typing.overload
+    def __getitem__(self, index: int) -> RGBColor:
+        pass
+
+    @typing.overload
+    def __getitem__(self, index: slice) -> list[RGBColor]:
+        pass
+
+    def __getitem__(self, index: int | slice) -> RGBColor | list[RGBColor]:
+        if isinstance(index, slice):
+            return list(map(unpack, self.data[index]))
+
+        return unpack(self.data[index])
+
+    @typing.overload
+    def __setitem__(self, index: int, value: RGBColor) -> None:
+        pass
+
+    @typing.overload
+    def __setitem__(
+        self,
+        index: slice,
+        value: collections.abc.Iterable[RGBColor],
+    ) -> None:
+        pass
+
+    def __setitem__(
+        self,
+        index: int | slice,
+        value: RGBColor | collections.abc.Iterable[RGBColor],
+    ) -> None:
+        if isinstance(index, slice):
+            values = typing.cast(collections.abc.Iterable[RGBColor], value)
+            self.data[index] = array.array("I", map(pack, values))
+        else:
+            self.data[index] = pack(typing.cast(RGBColor, value))
+
+    def __delitem__(self, index: int | slice) -> None:
+        del self.data[index]
+
+    def insert(self, index: int, value: RGBColor) -> None:
+        self.data.insert(index, pack(value))
+
+    def copy(self) -> typing.Self:
+        return self.__class__(array.array("I", self.data))
+
+    def sort(self) -> None:
+        """
+        Sort the pixels in place.
+
+        Packed values compare like their colors, the empty ones being last.
+        """
+
+        self.data[:] = array.array("I", sorted(self.data))
+
+    def shuffle(self, generator: random.Random | None = None) -> None:
+        """
+        Shuffle the pixels in place, drawing from `generator` if it is provided.
+        """
+
+        (generator or random).shuffle(self.data)
 
 
 @dataclasses.dataclass(slots=True)
@@ -45,7 +191,25 @@ class Window:
 
     width: int
     height: int
-    pixels: list[RGBColor] = dataclasses.field(default_factory=list)
+    pixels: list[RGBColor] | PackedPixels = dataclasses.field(default_factory=list)
+
+    damage: set[int] = dataclasses.field(init=False, default_factory=set)
+    """Indices of the pixels that changed since the damage was last cleared"""
+
+    is_fully_damaged: bool = dataclasses.field(init=False, default=True)
+    """Whether the whole window changed since the damage was last cleared"""
+
+    cached_free_cells: array.array[int] | None = dataclasses.field(
+        init=False,
+        default=None,
+    )
+    """Indices of the empty pixels once found, see `free_cells`"""
+
+    cached_free_slots: array.array[int] | None = dataclasses.field(
+        init=False,
+        default=None,
+    )
+    """Position of each pixel in `free_cells` once found, see `free_slots`"""
 
     def __iter__(self) -> collections.abc.Iterator[tuple[Coordinates, RGBColor]]:
         for i, pixel in enumerate(self.pixels):
@@ -54,12 +218,24 @@ class Window:
             yield Coordinates(x, y), pixel
 
     @classmethod
-    def empty(cls, width: int, height: int) -> typing.Self:
+    def empty(
+        cls,
+        width: int,
+        height: int,
+        storage: PixelStorage = "list",
+    ) -> typing.Self:
         """
         Constructor for an empty window of size `width` × `height`.
+
+        `storage` is either `"list"` (a list of colors) or `"packed"` (a
+        contiguous buffer of packed colors, see `PackedPixels`).
         """
 
-        return cls(width, height, [EMPTY_PIXEL for _ in range(width * height)])
+        return cls(width, height, empty_pixels(width * height, storage))
+
+    @property
+    def storage(self) -> PixelStorage:
+        return "packed" if isinstance(self.pixels, PackedPixels) else "list"
 
     def is_inbounds(self, coordinates: Coordinates) -> bool:
         """
@@ -105,17 +281,476 @@ class Window:
         Unchecked version of `set_pixel`. Instead of returning `None`, raises an `IndexError`.
         """
 
-        previous = self.get_pixel_unchecked(coordinates)
-        self.pixels[self.width * coordinates.y + coordinates.x] = value
+        index = self.width * coordinates.y + coordinates.x
+        previous = self.pixels[index]
+        self.pixels[index] = value
+
+        if value != previous:
+            self.damage.add(index)
+
+            if previous == EMPTY_PIXEL:
+                self.take_free_cell(index)
+            elif value == EMPTY_PIXEL:
+                self.add_free_cell(index)
 
         return previous
 
+    def set_packed(self, index: int, value: int) -> None:
+        """
+        Set the pixel at `index` to the packed color `value`.
+        """
+
+        if isinstance(self.pixels, PackedPixels):
+            previous = self.pixels.data[index]
+            self.pixels.data[index] = value
+        else:
+            previous = pack(self.pixels[index])
+            self.pixels[index] = unpack(value)
+
+        if value != previous:
+            self.damage.add(index)
+
+            if previous == EMPTY_PACKED:
+                self.take_free_cell(index)
+            elif value == EMPTY_PACKED:
+                self.add_free_cell(index)
+
+    @property
+    def free_cells(self) -> array.array[int]:
+        """
+        Indices of the empty pixels, in no particular order.
+
+        They are only found the first time they are needed, so that a window
+        (e.g. mapped from a snapshot) is created without visiting its pixels.
+        """
+
+        if self.cached_free_cells is None:
+            self.cached_free_cells, self.cached_free_slots = find_free_cells(
+                self.pixels,
+            )
+
+        return self.cached_free_cells
+
+    @property
+    def free_slots(self) -> array.array[int]:
+        """
+        Position of each pixel in `free_cells`, or -1 if it is not empty.
+        """
+
+        if self.cached_free_slots is None:
+            self.cached_free_cells, self.cached_free_slots = find_free_cells(
+                self.pixels,
+            )
+
+        return self.cached_free_slots
+
+    @property
+    def filled_count(self) -> int:
+        """
+        Number of pixels that are not empty.
+        """
+
+        return len(self.pixels) - len(self.free_cells)
+
+    def is_full(self) -> bool:
+        """
+        Return True if the window has no empty pixel, else False.
+        """
+
+        return not self.free_cells
+
+    def random_empty_coordinates(
+        self,
+        generator: random.Random | None = None,
+    ) -> Coordinates:
+        """
+        Get the coordinates of an empty pixel picked at random, in constant time.
+        It is drawn from `generator` if it is provided.
+
+        Raises an `IndexError` if the window is full.
+        """
+
+        randrange = (generator or random).randrange
+        index = self.free_cells[randrange(len(self.free_cells))]
+        y, x = divmod(index, self.width)
+
+        return Coordinates(x, y)
+
+    def take_random_free_cells(
+        self,
+        count: int,
+        generator: random.Random | None = None,
+    ) -> array.array[int]:
+        """
+        Pick at random `count` empty pixels and remove them from the free cells,
+        in constant time per pixel. Their indices are returned. They are drawn
+        from `generator` if it is provided.
+
+        They are still empty: it is up to the caller to fill them using
+        `fill_cells()`. Raises an `IndexError` if there are not enough free
+        cells.
+        """
+
+        size = len(self.free_cells)
+
+        if count > size:
+            raise IndexError("not enough free cells")
+
+        randrange = (generator or random).randrange
+
+        return self.take_free_cells([randrange(size - i) for i in range(count)])
+
+    def take_free_cells(self, slots: collections.abc.Iterable[int]) -> array.array[int]:
+        """
+        Remove the free cells at `slots` one after the other, and return their
+        indices. Each slot is a position in the free cells left at that point.
+
+        See `take_random_free_cells()`.
+        """
+
+        free_cells = self.free_cells
+        free_slots = self.free_slots
+        taken = array.array("I")
+
+        for slot in slots:
+            index = free_cells[slot]
+            last = free_cells.pop()
+
+            if last != index:
+                free_cells[slot] = last
+                free_slots[last] = slot
+
+            free_slots[index] = -1
+            taken.append(index)
+
+        return taken
+
+    def fill_cells(
+        self,
+        indices: collections.abc.Sequence[int],
+        values: collections.abc.Sequence[int],
+    ) -> None:
+        """
+        Set the pixels at `indices`, taken with `take_random_free_cells()`, to
+        the packed colors `values`.
+        """
+
+        if isinstance(self.pixels, PackedPixels):
+            data = self.pixels.data
+
+            for index, value in zip(indices, values):
+                data[index] = value
+        else:
+            pixels = self.pixels
+
+            for index, value in zip(indices, values):
+                pixels[index] = unpack(value)
+
+        self.damage.update(indices)
+
+    def add_free_cell(self, index: int) -> None:
+        free_cells, free_slots = self.cached_free_cells, self.cached_free_slots
+
+        # Until they are needed, the empty pixels are found from the pixels
+        if free_cells is None or free_slots is None:
+            return
+
+        free_slots[index] = len(free_cells)
+        free_cells.append(index)
+
+    def take_free_cell(self, index: int) -> None:
+        free_cells, free_slots = self.cached_free_cells, self.cached_free_slots
+
+        if free_cells is None or free_slots is None:
+            return
+
+        # Swap-remove: the last free cell takes the place of the removed one
+        slot = free_slots[index]
+        last = free_cells.pop()
+
+        if last != index:
+            free_cells[slot] = last
+            free_slots[last] = slot
+
+        free_slots[index] = -1
+
+    def invalidate_free_cells(self) -> None:
+        """
+        Forget about the empty pixels, for them to be found again from the
+        pixels when needed.
+        """
+
+        self.cached_free_cells = None
+        self.cached_free_slots = None
+
     def reset(self) -> None:
         """
         Clean the window to emptiness.
         """
 
-        self.pixels = [EMPTY_PIXEL for _ in range(self.width * self.height)]
+        size = self.width * self.height
+
+        self.pixels = empty_pixels(size, self.storage)
+        self.cached_free_cells = array.array("I", range(size))
+        self.cached_free_slots = array.array("i", range(size))
+        self.mark_fully_damaged()
+
+    def shuffle(self, generator: random.Random | None = None) -> None:
+        """
+        Shuffle the pixels of the window around, drawing from `generator` if it
+        is provided.
+        """
+
+        if isinstance(self.pixels, PackedPixels):
+            self.pixels.shuffle(generator)
+        else:
+            (generator or random).shuffle(self.pixels)
+
+        self.invalidate_free_cells()
+        self.mark_fully_damaged()
+
+    def sort(self, key: SortKey = "rgb") -> None:
+        """
+        Sort the pixels of the window by `key`, the empty ones last.
+        """
+
+        data = sort_packed(self.packed(), key, EMPTY_PACKED)
+
+        if isinstance(self.pixels, PackedPixels):
+            self.pixels.data = data
+        else:
+            self.pixels[:] = [unpack(value) for value in data]
+
+        self.invalidate_free_cells()
+        self.mark_fully_damaged()
+
+    def iter_reset(self, chunk: int) -> collections.abc.Iterator[None]:
+        """
+        Time-sliced version of `reset()`, sweeping the window from top to
+        bottom and yielding after each `chunk` of pixels.
+
+        It stops early if the window is resized in the meantime.
+        """
+
+        pixels = self.pixels
+        size = self.width * self.height
+
+        data: collections.abc.MutableSequence[typing.Any]
+        blank: collections.abc.Sequence[typing.Any]
+
+        if isinstance(self.pixels, PackedPixels):
+            data = self.pixels.data
+            blank = array.array("I", [EMPTY_PACKED]) * chunk
+        else:
+            data = self.pixels
+            blank = [EMPTY_PIXEL] * chunk
+
+        try:
+            for start in range(0, size, chunk):
+                if self.pixels is not pixels:
+                    return
+
+                stop = min(size, start + chunk)
+
+                if data[start:stop] != blank[: stop - start]:
+                    data[start:stop] = blank[: stop - start]
+                    self.damage.update(range(start, stop))
+
+                yield
+        finally:
+            # This is also reached if the sweep is interrupted
+            self.invalidate_free_cells()
+
+    def iter_shuffle(
+        self,
+        chunk: int,
+        generator: random.Random | None = None,
+    ) -> collections.abc.Iterator[None]:
+        """
+        Time-sliced version of `shuffle()`: an incremental Fisher-Yates
+        shuffle, yielding after each `chunk` swaps.
+
+        It stops early if the window is resized in the meantime.
+        """
+
+        pixels = self.pixels
+        data: collections.abc.MutableSequence[typing.Any] = (
+            pixels.data if isinstance(pixels, PackedPixels) else pixels
+        )
+        damage = self.damage
+        randrange = (generator or random).randrange
+
+        try:
+            for stop in range(len(data) - 1, 0, -chunk):
+                if self.pixels is not pixels:
+                    return
+
+                for i in range(stop, max(0, stop - chunk), -1):
+                    j = randrange(i + 1)
+                    data[i], data[j] = data[j], data[i]
+                    damage.add(i)
+                    damage.add(j)
+
+                yield
+        finally:
+            self.invalidate_free_cells()
+
+    def iter_sort(
+        self,
+        key: SortKey,
+        chunk: int,
+    ) -> collections.abc.Generator[None, None, bool]:
+        """
+        Time-sliced version of `sort()`, yielding between the steps of the
+        sort, then while writing the sorted pixels by `chunk`.
+
+        It stops early if the window is resized in the meantime. Return whether
+        the window has been sorted.
+        """
+
+        pixels = self.pixels
+        sorted_data = yield from iter_sort_packed(
+            self.packed(),
+            key,
+            EMPTY_PACKED,
+            chunk,
+        )
+        size = len(sorted_data)
+        written = 0
+
+        try:
+            while written < size:
+                if self.pixels is not pixels:
+                    return False
+
+                stop = min(size, written + chunk)
+                self.write_packed(sorted_data, written, stop)
+                written = stop
+
+                yield
+
+            return self.pixels is pixels
+        finally:
+            # Only a part of the pixels would be sorted otherwise, and some of
+            # the others would be lost ; copying is quick anyway
+            if self.pixels is pixels:
+                self.write_packed(sorted_data, written, size)
+
+            self.invalidate_free_cells()
+
+    def write_packed(
+        self,
+        data: collections.abc.Sequence[int],
+        start: int,
+        stop: int,
+    ) -> None:
+        """
+        Overwrite the pixels from `start` to `stop` with the packed colors at
+        the same indices of `data`, marking them as damaged.
+
+        This does not update the free cells.
+        """
+
+        if start >= stop:
+            return
+
+        if isinstance(self.pixels, PackedPixels):
+            self.pixels.data[start:stop] = array.array("I", data[start:stop])
+        else:
+            self.pixels[start:stop] = [unpack(value) for value in data[start:stop]]
+
+        self.damage.update(range(start, stop))
+
+    def resize(self, width: int, height: int) -> None:
+        """
+        Change the size of the window to `width` × `height`.
+
+        The pixels keep their coordinates: those which are now out of bounds
+        are cropped, and the new ones are empty.
+        """
+
+        if (width, height) == (self.width, self.height):
+            return
+
+        pixels = empty_pixels(width * height, self.storage)
+
+        if isinstance(self.pixels, PackedPixels):
+            assert isinstance(pixels, PackedPixels)
+            # Unlike arrays, views accept slices of the mapped snapshots too
+            source, target = self.pixels.data, memoryview(pixels.data)
+        else:
+            source, target = self.pixels, pixels
+
+        kept_width = min(width, self.width)
+
+        for y in range(min(height, self.height)):
+            start = y * self.width
+            target[y * width : y * width + kept_width] = source[
+                start : start + kept_width
+            ]
+
+        if isinstance(target, memoryview):
+            target.release()
+
+        self.width = width
+        self.height = height
+        self.pixels = pixels
+        self.invalidate_free_cells()
+        self.mark_fully_damaged()
+
+    def mark_fully_damaged(self) -> None:
+        """
+        Mark the whole window as changed.
+        """
+
+        self.damage.clear()
+        self.is_fully_damaged = True
+
+    def clear_damage(self) -> None:
+        """
+        Forget about the changes, typically once they have been rendered.
+        """
+
+        self.damage.clear()
+        self.is_fully_damaged = False
+
+    def get_packed(self, coordinates: Coordinates) -> int | None:
+        """
+        Return the packed value of the pixel at the provided `coordinates` if they
+        are inbounds, else None.
+        """
+
+        if not self.is_inbounds(coordinates):
+            return None
+
+        index = self.width * coordinates.y + coordinates.x
+
+        if isinstance(self.pixels, PackedPixels):
+            return self.pixels.data[index]
+
+        return pack(self.pixels[index])
+
+    def packed(self) -> collections.abc.Sequence[int]:
+        """
+        Get the packed values of the pixels.
+
+        For the packed storage, this is the underlying buffer and not a copy.
+        """
+
+        if isinstance(self.pixels, PackedPixels):
+            return self.pixels.data
+
+        return [pack(pixel) for pixel in self.pixels]
+
+    def packed_rows(self) -> collections.abc.Iterator[collections.abc.Sequence[int]]:
+        """
+        Get the packed values of the window rows.
+        """
+
+        data = self.packed()
+
+        for i in range(self.height):
+            yield data[i * self.width : (i + 1) * self.width]
 
     def rows(self) -> collections.abc.Iterator[list[RGBColor]]:
         """
@@ -127,3 +762,47 @@ class Window:
 
     def copy(self) -> typing.Self:
         return self.__class__(self.width, self.height, self.pixels.copy())
+
+
+def find_free_cells(
+    pixels: list[RGBColor] | PackedPixels,
+) -> tuple[array.array[int], array.array[int]]:
+    """
+    Find the empty `pixels`, and return their indices along with the position
+    of each pixel among them (-1 if it is not empty).
+    """
+
+    if isinstance(pixels, PackedPixels) and numpy is not None:
+        values = numpy.frombuffer(pixels.data, dtype=numpy.uint32)
+        cells = numpy.flatnonzero(values == EMPTY_PACKED).astype(numpy.uint32)
+        slots = numpy.full(len(values), -1, dtype=numpy.int32)
+        slots[cells] = numpy.arange(len(cells), dtype=numpy.int32)
+
+        return array.array("I", cells.tobytes()), array.array("i", slots.tobytes())
+
+    if isinstance(pixels, PackedPixels):
+        data, empty = pixels.data, EMPTY_PACKED
+    else:
+        data, empty = pixels, EMPTY_PIXEL
+
+    cells = array.array(
+        "I",
+        (index for index, pixel in enumerate(data) if pixel == empty),
+    )
+    slots = array.array("i", [-1]) * len(data)
+
+    for slot, index in enumerate(cells):
+        slots[index] = slot
+
+    return cells, slots
+
+
+def empty_pixels(size: int, storage: PixelStorage) -> list[RGBColor] | PackedPixels:
+    """
+    Get `size` empty pixels using the given `storage`.
+    """
+
+    if storage == "packed":
+        return PackedPixels.empty(size)
+
+    return [EMPTY_PIXEL] * size
@@ -0,0 +1,99 @@
+"""
+Output of the frames to the terminal.
+"""
+import dataclasses
+import functools
+import os
+import select
+import sys
+
+
+DEFAULT_CAPACITY = 1 << 16
+"""Initial size of the frame buffer, in bytes"""
+
+
+@functools.lru_cache(maxsize=1 << 12)
+def cursor_move(x: int, y: int) -> bytes:
+    """
+    Get the sequence moving the cursor to the 0-based position (`x`, `y`).
+    """
+
+    return f"\x1b[{y + 1};{x + 1}H".encode()
+
+
+@dataclasses.dataclass(slots=True)
+class FrameWriter:
+    """
+    Assembles a whole frame in a reusable buffer, then writes it to the
+    terminal at once.
+
+    Going around `sys.stdout` avoids its encoding and line buffering, and a
+    single write prevents the terminal from showing a half-drawn frame.
+    """
+
+    fd: int = dataclasses.field(default_factory=sys.stdout.fileno)
+    buffer: bytearray = dataclasses.field(
+        default_factory=lambda: bytearray(DEFAULT_CAPACITY),
+    )
+    """Preallocated storage of the frame ; only `size` bytes are relevant"""
+    size: int = dataclasses.field(init=False, default=0)
+
+    def __len__(self) -> int:
+        return self.size
+
+    def write_bytes(self, data: bytes) -> None:
+        """
+        Append `data` to the frame.
+        """
+
+        end = self.size + len(data)
+
+        # Assigning a slice of the same length does not reallocate ; it only
+        # grows when the frame is bigger than any of the previous ones
+        self.buffer[self.size : end] = data
+        self.size = end
+
+    def write(self, string: str) -> None:
+        """
+        Append `string` to the frame.
+        """
+
+        self.write_bytes(string.encode())
+
+    def write_at(self, string: str, x: int, y: int) -> None:
+        """
+        Append `string` to the frame so that it is drawn with its top left
+        corner at the 0-based position (`x`, `y`).
+        """
+
+        for offset, line in enumerate(string.splitlines()):
+            self.write_bytes(cursor_move(x, y + offset))
+            self.write_bytes(line.encode())
+            self.write_bytes(b"\x1b[49m")
+
+    def flush(self) -> int:
+        """
+        Write the frame to the terminal and start a new one.
+
+        Return the number of bytes written.
+        """
+
+        # What has been printed the usual way must come first
+        sys.stdout.flush()
+
+        data = memoryview(self.buffer)[: self.size]
+        written = 0
+
+        try:
+            while written < len(data):
+                try:
+                    written += os.write(self.fd, data[written:])
+                except BlockingIOError:
+                    # The terminal is not keeping up: wait until it can take
+                    # the rest of the frame
+                    select.select([], [self.fd], [])
+        finally:
+            data.release()
+            self.size = 0
+
+        return written
@@ -0,0 +1,455 @@
+# pyright: reportMissingImports = false
+"""
+Themes defined by the user in a TOML file.
+
+A theme gives one expression per channel, written in a small subset of Python
+over the coordinates `x` and `y` of the pixel, the size `w` × `h` of the window
+and `rand`, a random number between 0 (inclusive) and 1 (exclusive):
+
+    [themes.sunset]
+    red = "x / w * 255"
+    green = "rand * 96"
+    blue = "255 - y / h * 255"
+
+A single `all` expression can be given instead, for the three channels. The
+values are clamped between 0 and 255, and truncated.
+
+The file is parsed and its expressions are validated once, when the themes are
+first listed. The expressions of a theme are only compiled when it is used, to
+Python functions computing a channel one pixel at a time or, with numpy, for
+whole arrays at once. They are never interpreted per pixel.
+"""
+from __future__ import annotations
+
+import ast
+import collections.abc
+import copy
+import dataclasses
+import math
+import os
+import re
+import tomllib
+import typing
+
+from babble.themes import numpy
+from babble.themes import SeededChannelFunction
+from babble.themes import Theme
+from babble.themes import VectorizedChannelFunction
+from babble.themes import VectorizedTheme
+
+if typing.TYPE_CHECKING:
+    from babble.themes import Array
+
+
+MathFunction: typing.TypeAlias = collections.abc.Callable[..., float]
+
+
+THEMES_PATH_VARIABLE = "BABBLE_THEMES"
+"""Environment variable overriding the path of the user themes file"""
+
+THEME_NAME_PATTERN = re.compile(r"[a-z0-9_-]{1,32}")
+
+CHANNELS = ("red", "green", "blue")
+VARIABLES = frozenset({"x", "y", "w", "h", "rand"})
+CONSTANTS = {"pi": math.pi}
+FUNCTION_ARITIES = {
+    "abs": 1,
+    "sqrt": 1,
+    "exp": 1,
+    "log": 1,
+    "sin": 1,
+    "cos": 1,
+    "tan": 1,
+    "floor": 1,
+    "atan2": 2,
+    "hypot": 2,
+    "min": 2,
+    "max": 2,
+}
+ALLOWED_NODES = (
+    ast.Expression,
+    ast.BinOp,
+    ast.UnaryOp,
+    ast.IfExp,
+    ast.Compare,
+    ast.Call,
+    ast.Name,
+    ast.Constant,
+    ast.Load,
+    ast.Add,
+    ast.Sub,
+    ast.Mult,
+    ast.Div,
+    ast.FloorDiv,
+    ast.Mod,
+    ast.Pow,
+    ast.UAdd,
+    ast.USub,
+    ast.Eq,
+    ast.NotEq,
+    ast.Lt,
+    ast.LtE,
+    ast.Gt,
+    ast.GtE,
+)
+DIVISION_HELPERS = {
+    ast.Div: "divide",
+    ast.FloorDiv: "floor_divide",
+    ast.Mod: "remainder",
+}
+
+
+def themes_path() -> str:
+    """
+    Get the path of the user themes file: `$BABBLE_THEMES` if it is set, else
+    `babble/themes.toml` in the configuration directory of the user.
+    """
+
+    if path := os.environ.get(THEMES_PATH_VARIABLE):
+        return path
+
+    config_home = os.environ.get("XDG_CONFIG_HOME") or os.path.join(
+        os.path.expanduser("~"),
+        ".config",
+    )
+
+    return os.path.join(config_home, "babble", "themes.toml")
+
+
+def parse_channel(source: str) -> ast.Expression:
+    """
+    Parse the expression of a channel, and check that it only uses what the
+    themes are allowed to.
+
+    Raises a `ValueError` if it does not.
+    """
+
+    try:
+        tree = ast.parse(source.strip(), mode="eval")
+    except SyntaxError as error:
+        raise ValueError(f"invalid syntax in {source!r}") from error
+
+    # The names of the functions called are not variables
+    callees = {id(node.func) for node in ast.walk(tree) if isinstance(node, ast.Call)}
+
+    for node in ast.walk(tree):
+        if not isinstance(node, ALLOWED_NODES):
+            raise ValueError(f"{type(node).__name__} is not allowed in {source!r}")
+
+        match node:
+            case ast.Constant(value=value) if type(value) not in (int, float):
+                raise ValueError(f"only numbers are allowed, not {value!r}")
+            case ast.Compare(ops=operators) if len(operators) > 1:
+                raise ValueError(f"chained comparisons are not allowed in {source!r}")
+            case ast.Call(func=ast.Name(id=name), args=args, keywords=[]) if (
+                FUNCTION_ARITIES.get(name) == len(args)
+            ):
+                pass
+            case ast.Call(func=ast.Name(id=name)) if name in FUNCTION_ARITIES:
+                raise ValueError(
+                    f"{name}() takes {FUNCTION_ARITIES[name]} positional "
+                    f"argument(s) in {source!r}",
+                )
+            case ast.Call():
+                raise ValueError(f"unknown function in {source!r}")
+            case ast.Name(id=name) if (
+                id(node) not in callees
+                and name not in VARIABLES
+                and name not in CONSTANTS
+            ):
+                raise ValueError(f"unknown name {name!r} in {source!r}")
+            case _:
+                pass
+
+    return tree
+
+
+def uses_rand(tree: ast.Expression) -> bool:
+    return any(
+        isinstance(node, ast.Name) and node.id == "rand" for node in ast.walk(tree)
+    )
+
+
+class _ScalarTransformer(ast.NodeTransformer):
+    """
+    Rewrites an expression so that the operations which raise with some values
+    in Python give what they give with numpy instead.
+    """
+
+    def visit_BinOp(self, node: ast.BinOp) -> ast.AST:
+        self.generic_visit(node)
+
+        if isinstance(node.op, ast.Pow):
+            helper = "power"
+        elif (helper := DIVISION_HELPERS.get(type(node.op))) is None:
+            return node
+
+        return ast.Call(ast.Name(helper, ast.Load()), [node.left, node.right], [])
+
+    def visit_Name(self, node: ast.Name) -> ast.AST:
+        if node.id in CONSTANTS:
+            return ast.Constant(CONSTANTS[node.id])
+
+        return node
+
+
+class _VectorizedTransformer(_ScalarTransformer):
+    """
+    Also rewrites the conditions, as both branches are computed with numpy.
+    """
+
+    def visit_IfExp(self, node: ast.IfExp) -> ast.AST:
+        self.generic_visit(node)
+
+        return ast.Call(
+            ast.Name("where", ast.Load()),
+            [node.test, node.body, node.orelse],
+            [],
+        )
+
+
+def _safe(function: MathFunction) -> MathFunction:
+    """
+    Make a function of `math` return NaN or infinity where it would raise, like
+    the one of numpy.
+    """
+
+    def safe(*args: float) -> float:
+        try:
+            return function(*args)
+        except ValueError:
+            return math.nan
+        except OverflowError:
+            return math.inf
+
+    return safe
+
+
+def _power(base: float, exponent: float) -> float:
+    try:
+        result = float(base) ** exponent
+    except (ZeroDivisionError, OverflowError):
+        return math.inf
+
+    # A negative number raised to a fractional power is a complex number
+    return math.nan if isinstance(result, complex) else result
+
+
+def _to_channel(value: float) -> int:
+    # NaN compares false with everything, so it gives 0
+    return int(min(255.0, max(0.0, value)))
+
+
+SCALAR_NAMESPACE: dict[str, typing.Any] = {
+    "__builtins__": {},
+    "abs": abs,
+    "sqrt": _safe(math.sqrt),
+    "exp": _safe(math.exp),
+    "log": _safe(math.log),
+    "sin": _safe(math.sin),
+    "cos": _safe(math.cos),
+    "tan": _safe(math.tan),
+    "floor": _safe(math.floor),
+    "atan2": math.atan2,
+    "hypot": math.hypot,
+    "min": min,
+    "max": max,
+    "divide": lambda a, b: a / b if b else 0.0,
+    "floor_divide": lambda a, b: a // b if b else 0.0,
+    "remainder": lambda a, b: a % b if b else 0.0,
+    "power": _power,
+    "to_channel": _to_channel,
+}
+
+
+def _vectorized_namespace() -> dict[str, typing.Any]:
+    assert numpy is not None
+
+    def division(operation: typing.Any) -> typing.Any:
+        def divide(a: Array, b: Array) -> Array:
+            a, b = numpy.broadcast_arrays(a, b)
+
+            return operation(a, b, out=numpy.zeros(a.shape), where=b != 0)
+
+        return divide
+
+    def to_channel(values: Array, count: int) -> Array:
+        values = numpy.broadcast_to(numpy.asarray(values, dtype=numpy.float64), count)
+        values = numpy.nan_to_num(values, nan=0.0, posinf=255.0, neginf=0.0)
+
+        return numpy.clip(values, 0, 255).astype(numpy.uint8)
+
+    return {
+        "__builtins__": {},
+        "numpy": numpy,
+        "len": len,
+        "abs": numpy.abs,
+        "sqrt": numpy.sqrt,
+        "exp": numpy.exp,
+        "log": numpy.log,
+        "sin": numpy.sin,
+        "cos": numpy.cos,
+        "tan": numpy.tan,
+        "floor": numpy.floor,
+        "atan2": numpy.arctan2,
+        "hypot": numpy.hypot,
+        "min": numpy.minimum,
+        "max": numpy.maximum,
+        "divide": division(numpy.true_divide),
+        "floor_divide": division(numpy.floor_divide),
+        "remainder": division(numpy.remainder),
+        "power": lambda a, b: numpy.power(numpy.asarray(a, dtype=numpy.float64), b),
+        "where": numpy.where,
+        "to_channel": to_channel,
+    }
+
+
+def compile_channel(tree: ast.Expression) -> SeededChannelFunction:
+    """
+    Compile the expression of a channel to a function of the pixel, drawing
+    `rand` from the generator it is given.
+    """
+
+    expression = ast.unparse(_ScalarTransformer().visit(copy.deepcopy(tree)))
+    rand = "    rand = g.random()\n" if uses_rand(tree) else ""
+    source = (
+        "def channel(c, w, h, g):\n"
+        "    x = c.x\n"
+        "    y = c.y\n"
+        f"{rand}"
+        f"    return to_channel({expression})\n"
+    )
+    namespace = dict(SCALAR_NAMESPACE)
+    exec(compile(source, "<theme>", "exec"), namespace)
+
+    return namespace["channel"]
+
+
+def compile_vectorized_channel(tree: ast.Expression) -> VectorizedChannelFunction:
+    """
+    Compile the expression of a channel to a function of arrays of pixels.
+
+    `rand` takes exactly one draw per pixel from the generator, so that the
+    values do not depend on how the pixels are grouped.
+    """
+
+    expression = ast.unparse(_VectorizedTransformer().visit(copy.deepcopy(tree)))
+    rand = "    rand = g.random(len(x))\n" if uses_rand(tree) else ""
+    source = (
+        "def channel(x, y, w, h, g):\n"
+        "    x = x.astype(numpy.float64)\n"
+        "    y = y.astype(numpy.float64)\n"
+        f"{rand}"
+        "    with numpy.errstate(all='ignore'):\n"
+        f"        return to_channel({expression}, len(x))\n"
+    )
+    namespace = _vectorized_namespace()
+    exec(compile(source, "<theme>", "exec"), namespace)
+
+    return namespace["channel"]
+
+
+@dataclasses.dataclass(slots=True, frozen=True)
+class ThemeSpec:
+    """
+    Validated expressions of the channels of a user theme.
+    """
+
+    name: str
+    red: ast.Expression
+    green: ast.Expression
+    blue: ast.Expression
+
+    @classmethod
+    def from_table(cls, name: str, table: typing.Any) -> typing.Self:
+        """
+        Constructor from the TOML table of the theme.
+
+        Raises a `ValueError` if the theme is invalid.
+        """
+
+        if THEME_NAME_PATTERN.fullmatch(name) is None:
+            raise ValueError(
+                f"invalid theme name {name!r}: it must be at most 32 lowercase "
+                "letters, digits, `-` or `_`",
+            )
+
+        if not isinstance(table, dict):
+            raise ValueError(f"{name}: a theme must be a table")
+
+        table = typing.cast(dict[str, typing.Any], table)
+        keys = {"all"} if "all" in table else set(CHANNELS)
+
+        if set(table) != keys:
+            raise ValueError(
+                f"{name}: a theme must have either `red`, `green` and `blue` "
+                "expressions, or a single `all` one",
+            )
+
+        trees: dict[str, ast.Expression] = {}
+
+        for key in keys:
+            if not isinstance(table[key], str):
+                raise ValueError(f"{name}.{key}: the expression must be a string")
+
+            try:
+                trees[key] = parse_channel(table[key])
+            except ValueError as error:
+                raise ValueError(f"{name}.{key}: {error}") from None
+
+        if "all" in trees:
+            return cls(name, trees["all"], trees["all"], trees["all"])
+
+        return cls(name, trees["red"], trees["green"], trees["blue"])
+
+    @property
+    def trees(self) -> tuple[ast.Expression, ast.Expression, ast.Expression]:
+        return (self.red, self.green, self.blue)
+
+    def compile(self) -> Theme:
+        """
+        Compile the expressions to a theme, along with its vectorized
+        equivalent if numpy is available.
+        """
+
+        red, green, blue = (compile_channel(tree) for tree in self.trees)
+        vectorized = None
+
+        if numpy is not None:
+            vectorized = VectorizedTheme(
+                *(compile_vectorized_channel(tree) for tree in self.trees),
+            )
+
+        return Theme(
+            red,
+            green,
+            blue,
+            vectorized,
+            deterministic=not any(uses_rand(tree) for tree in self.trees),
+            seeded=True,
+        )
+
+
+def load_theme_specs(path: str) -> dict[str, ThemeSpec]:
+    """
+    Read and validate the themes of the TOML file at `path`, which are in its
+    `themes` table. There are none if the file does not exist.
+
+    Raises a `ValueError` if the file or one of its themes is invalid.
+    """
+
+    try:
+        with open(path, "rb") as file:
+            document = tomllib.load(file)
+    except FileNotFoundError:
+        return {}
+
+    table = document.get("themes", {})
+
+    if not isinstance(table, dict):
+        raise ValueError("`themes` must be a table")
+
+    return {
+        name: ThemeSpec.from_table(name, theme)
+        for name, theme in typing.cast(dict[str, typing.Any], table).items()
+    }